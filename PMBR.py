@@ -3,27 +3,81 @@ Adapted from https://github.com/celstark/MST/blob/71af39c5dc2e157e0059432aa505dd
 Paul de Fontenay, UPHUMMEL EPFL, 2025
 '''
 
+from startup_profile import StartupProfile
+startup = StartupProfile() # Origin of the startup breakdown, before the other imports
+
 import numpy as np
 import csv
 import os
-from psychopy import visual, core, tools, event, sound
-from psychopy import gui
+import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
 import argparse
-import random
-from psychopy.hardware import joystick
-import pyglet
+from joystick_acquisition import JoystickAcquisition, TrajectoryBuffer
+from trajectory_store import TrajectoryWriter, trajectory_path, truncate_trajectories
+from run_log import RunLogWriter, AsyncTrialWriter
+from session_clock import SessionClock, countdown_to_ns
+from frame_timing import FrameRecorder, frame_path
+from stimulus_registry import StimulusRegistry
+from session_recording import SessionRecorder, recording_path
+from telemetry import TelemetryPublisher
+from audio_cues import AudioCueCache
+from session_schedule import SIDES, by_block, load_schedule, make_schedule, save_schedule, schedule_path
+from checkpoint import Checkpoint, checkpoint_path, committed_trajectory_end, drop_partial_row, read_checkpoint, resume_cursor
+from eeg_markers import MarkerSender, LoopbackBackend, make_backend, marker_path
+from convert_runs import upgrade_runs
+
+
+# Columns of the runs CSV. TrialStart is seconds on the task clock; the *_ns columns are
+# session clock stamps (see session_clock.py), WindowStart_ns being when the joystick window opened.
+# LateFlips/DroppedFrames summarize the flips of the trial, the flips themselves are in the frames file
+RUN_FIELDS = ['ID','Session','Run','Trial','Block','TrialStart','TrialStart_ns','RT_press',
+              'RT_start_right','RT_start_left','RT_end_right','RT_end_left','WindowStart_ns',
+              'traj_offset','traj_length','LateFlips','DroppedFrames']
+
+# psychopy and pyglet take seconds to import, load_modules() imports them on a background thread
+# while the parameters dialog is open. The headless runner sets them to its own modules instead.
+visual = core = event = sound = joystick = pyglet = None
+# The dialog's modules, imported on the main thread before load_modules() starts
+gui = tools = None
+# Opened by open_devices() along with the imports
+joysticks = cues = None
+
+
+
+def load_modules():
+    """Imports psychopy's window, event, sound and joystick modules and pyglet into the module globals."""
+    global visual, core, event, sound, joystick, pyglet
+    if visual is not None:
+        return
+    from psychopy import visual, core, event, sound
+    from psychopy.hardware import joystick
+    import pyglet
+
 
+def load_dialog_modules():
+    """Imports psychopy's dialog and file tools into the module globals."""
+    global gui, tools
+    if gui is not None:
+        return
+    from psychopy import gui, tools
 
-parser = argparse.ArgumentParser()
-parser.add_argument("-m", "--monitor", default=1)
-args = parser.parse_args()
-n_screen = int(args.monitor)
 
+def open_devices():
+    """Enumerates the joysticks and opens the audio cues, the slow device work of the startup."""
+    global joysticks, cues
+    with startup.span('imports'):
+        load_modules()
+    with startup.span('joysticks'):
+        joysticks = pyglet.input.get_joysticks()
+    with startup.span('audio'):
+        # Countdown beeps synthesized and their output stream opened now, not at the first beep
+        cues = AudioCueCache(sound_module=sound)
 
 
 def get_parameters(skip_gui=False):
+    load_dialog_modules()
     # Setup my global parameters
     try:#try to get a previous parameters file 
         param_settings = tools.filetools.fromFile('lastParams_PMBR_.pickle')
@@ -49,7 +103,7 @@ def get_parameters(skip_gui=False):
                   'NbTrials':param_settings[4],
                    'Set': param_settings[5]}
         else:
-            core.quit()
+            sys.exit() # core may not be imported yet, the imports run while the dialog is open
     else:
         params = {'ID': param_settings[0],
                   'Session': param_settings[1],
@@ -61,10 +115,11 @@ def get_parameters(skip_gui=False):
     return params
 
 
-def TI_countdown(window, t):
-    clk_text = visual.TextStim(window,text=str(t),pos=(0,0.2),color='black', height=0.07)
-    circle = visual.Circle(window, radius=0.1, pos=(0,0.2), fillColor=None, lineColor=[-0.5,-0.5,-0.5], lineWidth=4)
-    mySound = sound.Sound('A', secs=0.1)
+def TI_countdown(window, t, stimuli, cues):
+    # Circle and text are built once in show_task, the beep once at startup, only the digits change
+    clk_text = stimuli['countdown_text']
+    circle = stimuli['countdown_circle']
+    clk_text.setText(str(t))
 
     circle.setAutoDraw(True); clk_text.setAutoDraw(True)
     circle.draw(); clk_text.draw()
@@ -73,7 +128,7 @@ def TI_countdown(window, t):
     while timer.getTime() > 0:
         if t-timer.getTime() > 1:
             if t <= 4:
-                mySound.play()
+                cues.play('countdown')
             t=t-1
             clk_text.setText(str(t))
             window.flip()
@@ -93,6 +148,7 @@ def wait_b_pressed(joy, message=None, duration=100, window=None):
         window.flip()
         joy_button_pressed = joy.getButton(0)
         if joy_button_pressed:
+            mark('button_press')
             RT = duration - timer.getTime()
             return RT
         # Check for user stop
@@ -108,21 +164,30 @@ def wait_joystick_pushed(
     duration=2, correct_rect=None, 
     rect_left_red=None, rect_right_red=None, 
     joystick_right=None, joystick_left=None, 
-    rect_right_black=None, rect_left_black=None
+    rect_right_black=None, rect_left_black=None,
+    acquisition=None, max_rate=2000, verbose=False
 ):
-    import pyglet
-    from psychopy import core, event
+    """
+    Waits up to `duration` seconds for one of the joysticks to be pushed forward.
+    Trajectories are written into a TrajectoryBuffer preallocated for
+    duration * max_rate samples and returned as float32 positions and int64
+    session ns ('t_ns'). Set verbose=True to print axis values on every poll.
+    """
+    if acquisition is not None:
+        return wait_joystick_pushed_buffered(
+            acquisition, joy_r, joy_l, rect_right_green, rect_left_green, duration, correct_rect,
+            rect_left_red, rect_right_red, rect_right_black, rect_left_black)
 
     RT = None
     output = {
         'RT_end_right': RT, 'RT_end_left': RT, 
         'RT_start_right': RT, 'RT_start_left': RT,
-        'right_positions': [], 'left_positions': [], 'time': []
+        'right_positions': [], 'left_positions': [], 't_ns': [], 'window_start_ns': None
     }
-    right_positions = []
-    left_positions = []
-    times = []
+    trajectory = TrajectoryBuffer(duration, max_rate)
+    append = trajectory.append
     timer = core.CountdownTimer(duration)
+    output['window_start_ns'] = session_clock.now_ns()
 
     # Ensure joystick data updates
     pyglet.app.platform_event_loop.dispatch_posted_events()
@@ -142,7 +207,8 @@ def wait_joystick_pushed(
         joy_r.draw()
     win.flip()
 
-    while timer.getTime() > 0:
+    remaining = timer.getTime()
+    while remaining > 0:
         # Required pyglet event dispatch
         pyglet.app.platform_event_loop.dispatch_posted_events()
         pyglet.clock.tick()
@@ -152,96 +218,184 @@ def wait_joystick_pushed(
         joy_right_y_axis = joystick_right.y or 0
         joy_left_x_axis = joystick_left.x or 0
         joy_left_y_axis = joystick_left.y or 0
+        remaining = timer.getTime()
 
-        print(f'Joy right: {joy_right_y_axis:.3f}, Joy left: {joy_left_y_axis:.3f}')
+        if verbose:
+            print(f'Joy right: {joy_right_y_axis:.3f}, Joy left: {joy_left_y_axis:.3f}')
 
         # Detect start RT
-        if abs(joy_right_y_axis - last_value_right) > 0.005 and not flag_RT_start and correct_rect == 'right':
-            output['RT_start_right'] = duration - timer.getTime()
-            flag_RT_start = True
-        if abs(joy_left_y_axis - last_value_left) > 0.005 and not flag_RT_start and correct_rect == 'left':
-            output['RT_start_left'] = duration - timer.getTime()
-            flag_RT_start = True
+        if not flag_RT_start:
+            if correct_rect == 'right' and abs(joy_right_y_axis - last_value_right) > 0.005:
+                output['RT_start_right'] = duration - remaining
+                flag_RT_start = True
+            elif correct_rect == 'left' and abs(joy_left_y_axis - last_value_left) > 0.005:
+                output['RT_start_left'] = duration - remaining
+                flag_RT_start = True
 
         last_value_right = joy_right_y_axis
         last_value_left = joy_left_y_axis
 
-        right_positions.append([joy_right_x_axis, joy_right_y_axis])
-        left_positions.append([joy_left_x_axis, joy_left_y_axis])
-        times.append(timer.getTime())
-
-        # Joystick pushed right
-        if joy_right_y_axis < -0.9:
-            if correct_rect == 'right' and rect_right_green:
-                rect_right_green.draw()
-                RT = duration - timer.getTime()
-            elif correct_rect == 'left' and rect_left_red:
-                rect_left_red.draw()
+        append(remaining, joy_right_x_axis, joy_right_y_axis, joy_left_x_axis, joy_left_y_axis)
+
+        if joy_right_y_axis < -0.9 or joy_left_y_axis < -0.9:
+            # Joystick pushed right
+            if joy_right_y_axis < -0.9:
+                if correct_rect == 'right' and rect_right_green:
+                    rect_right_green.draw()
+                    RT = duration - remaining
+                elif correct_rect == 'left' and rect_left_red:
+                    rect_left_red.draw()
+                output['RT_end_right'] = RT
+            # Joystick pushed left
+            else:
+                if correct_rect == 'right' and rect_right_red:
+                    rect_right_red.draw()
+                elif correct_rect == 'left' and rect_left_green:
+                    rect_left_green.draw()
+                    RT = duration - remaining
+                output['RT_end_left'] = RT
 
             if joy_l: joy_l.draw()
             if joy_r: joy_r.draw()
             win.flip()
 
-            while timer.getTime() > 0:
+            remaining = timer.getTime()
+            while remaining > 0:
                 pyglet.app.platform_event_loop.dispatch_posted_events()
                 pyglet.clock.tick()
                 rx = joystick_right.x or 0
                 ry = joystick_right.y or 0
                 lx = joystick_left.x or 0
                 ly = joystick_left.y or 0
-                right_positions.append([rx, ry])
-                left_positions.append([lx, ly])
-                times.append(timer.getTime())
+                remaining = timer.getTime()
+                append(remaining, rx, ry, lx, ly)
+            break
 
-            output.update({
-                'RT_end_right': RT,
-                'right_positions': right_positions,
-                'left_positions': left_positions,
-                'time': times
-            })
-            return output
+        # Escape key to quit
+        keys = event.getKeys()
+        if keys and keys[0] in ['escape', 'esc']:
+            return -1
 
-        # Joystick pushed left
-        elif joy_left_y_axis < -0.9:
-            if correct_rect == 'right' and rect_right_red:
-                rect_right_red.draw()
-            elif correct_rect == 'left' and rect_left_green:
-                rect_left_green.draw()
-                RT = duration - timer.getTime()
+    times, right_positions, left_positions = trajectory.views()
+    output.update({
+        'right_positions': right_positions,
+        'left_positions': left_positions,
+        't_ns': countdown_to_ns(times, output['window_start_ns'], duration) # Polled as countdown values
+    })
+    return output
 
-            if joy_l: joy_l.draw()
-            if joy_r: joy_r.draw()
-            win.flip()
 
-            while timer.getTime() > 0:
-                pyglet.app.platform_event_loop.dispatch_posted_events()
-                pyglet.clock.tick()
-                rx = joystick_right.x or 0
-                ry = joystick_right.y or 0
-                lx = joystick_left.x or 0
-                ly = joystick_left.y or 0
-                right_positions.append([rx, ry])
-                left_positions.append([lx, ly])
-                times.append(timer.getTime())
+def wait_joystick_pushed_buffered(
+    acquisition, joy_r=None, joy_l=None,
+    rect_right_green=None, rect_left_green=None,
+    duration=2, correct_rect=None,
+    rect_left_red=None, rect_right_red=None,
+    rect_right_black=None, rect_left_black=None
+):
+    """
+    Same trial logic as wait_joystick_pushed, but the samples come from the
+    background JoystickAcquisition ring buffer instead of inline polling.
+    Onset and endpoint are detected on every sample acquired since the last
+    loop iteration, so a slow flip or event pump no longer drops samples.
+    """
+    output = {
+        'RT_end_right': None, 'RT_end_left': None,
+        'RT_start_right': None, 'RT_start_left': None,
+        'right_positions': [], 'left_positions': [], 't_ns': [], 'window_start_ns': None
+    }
+    # The window opens before the initial flip, as with the inline polling
+    timer = core.CountdownTimer(duration)
+    t0 = acquisition.now() # Session ns
+    output['window_start_ns'] = t0
+    start = cursor = acquisition.cursor()
+    acquisition.refresh() # The window's first sample is the position at its start, moved or not
 
-            output.update({
-                'RT_end_left': RT,
-                'right_positions': right_positions,
-                'left_positions': left_positions,
-                'time': times
-            })
-            return output
+    # Initial visual
+    if correct_rect == 'right' and rect_right_black:
+        rect_right_black.draw()
+    if correct_rect == 'left' and rect_left_black:
+        rect_left_black.draw()
+    if joy_l:
+        joy_l.draw()
+    if joy_r:
+        joy_r.draw()
+    win.flip()
+
+    latest = acquisition.buffer.latest()
+    last_value_right = latest[1][1] if latest else 0
+    last_value_left = latest[2][1] if latest else 0
+    flag_RT_start = correct_rect not in ('right', 'left')
+
+    while timer.getTime() > 0:
+        # Required pyglet event dispatch, keeps the device state fresh for the sampler
+        pyglet.app.platform_event_loop.dispatch_posted_events()
+        pyglet.clock.tick()
+        core.wait(0.001, hogCPUperiod=0) # Sleep between pumps instead of spinning, the sampler does the timing
+
+        cursor, times, right, left = acquisition.read_since(cursor)
+        if len(times):
+            # First sample beyond the endpoint threshold, right stick checked first as in the inline loop
+            pushed = (right[:, 1] < -0.9) | (left[:, 1] < -0.9)
+            end = int(pushed.argmax()) if pushed.any() else None
+            n = len(times) if end is None else end + 1
+
+            # Detect start RT on every new sample up to the endpoint
+            if not flag_RT_start:
+                if correct_rect == 'right':
+                    ys, last = right[:n, 1], last_value_right
+                else:
+                    ys, last = left[:n, 1], last_value_left
+                moved = np.abs(np.diff(ys, prepend=last)) > 0.005
+                if moved.any():
+                    mark('movement_onset_' + correct_rect, times[moved.argmax()])
+                    output['RT_start_' + correct_rect] = (times[moved.argmax()] - t0) * 1e-9
+                    flag_RT_start = True
+            last_value_right = right[n - 1, 1]
+            last_value_left = left[n - 1, 1]
+
+            if end is not None:
+                RT = None
+                mark('endpoint_right' if right[end, 1] < -0.9 else 'endpoint_left', times[end])
+                # Joystick pushed right
+                if right[end, 1] < -0.9:
+                    if correct_rect == 'right' and rect_right_green:
+                        rect_right_green.draw()
+                        RT = (times[end] - t0) * 1e-9
+                    elif correct_rect == 'left' and rect_left_red:
+                        rect_left_red.draw()
+                    output['RT_end_right'] = RT
+                # Joystick pushed left
+                else:
+                    if correct_rect == 'right' and rect_right_red:
+                        rect_right_red.draw()
+                    elif correct_rect == 'left' and rect_left_green:
+                        rect_left_green.draw()
+                        RT = (times[end] - t0) * 1e-9
+                    output['RT_end_left'] = RT
+
+                if joy_l: joy_l.draw()
+                if joy_r: joy_r.draw()
+                win.flip()
+
+                # Keep the sampler fed until the window closes
+                while timer.getTime() > 0:
+                    pyglet.app.platform_event_loop.dispatch_posted_events()
+                    pyglet.clock.tick()
+                    core.wait(0.001, hogCPUperiod=0)
+                break
 
         # Escape key to quit
         keys = event.getKeys()
         if keys and keys[0] in ['escape', 'esc']:
             return -1
 
-    # Timeout
+    # Samples are stored with their session ns, the countdown is derived from WindowStart_ns when reading
+    times, right, left = acquisition.buffer.read(start, acquisition.cursor())
+    n = int(np.searchsorted(times, t0 + int(duration * 1e9), side='right'))
     output.update({
-        'right_positions': right_positions,
-        'left_positions': left_positions,
-        'time': times
+        'right_positions': right[:n],
+        'left_positions': left[:n],
+        't_ns': times[:n]
     })
     return output
 
@@ -636,34 +790,45 @@ def wait_joystick_pushed(joy_r=None, joy_l=None, rect_right_green=None, rect_lef
             return -1
     return output'''
 
-def buffer_joystick(joy1, joy2, duration=2):
+def buffer_joystick(duration=2):
     """
-    Buffers joystick values for a given duration.
-    Returns a list of joystick positions.
+    Keeps the screen updated for `duration` seconds between joystick windows.
+    The sticks are sampled for the whole session by the acquisition thread, so
+    the samples of this period are in the session recording: they are returned
+    as a zero-copy view (None when nothing is recorded, e.g. practice runs).
     """
+    start_ns = session_clock.now_ns()
     timer = core.CountdownTimer(duration)
-    positions = []
     
     while timer.getTime() > 0:
-        axes1 = joy1.getAllAxes()
-        axes2 = joy2.getAllAxes()
-        positions.append((axes1, axes2))
         win.flip()
-        core.wait(0.001)  # Small delay to avoid overwhelming the buffer
-    
-    return positions
+
+    if recording is None:
+        return None
+    recording.drain()
+    return recording.window(start_ns, session_clock.now_ns())
 
 
 def mouse_clear(mouse):
     mouse.setPos((-10,-10)) # Out of screen
 
-'''
-def EEG_marker(eeg_gen):
-    delay = 0.002
-    eeg_gen.start()
-    core.wait(delay)
-    eeg_gen.stop()
-'''
+def mark(marker, sample_ns=None):
+    """Sends an EEG marker (see eeg_markers.MARKER_CODES) tagged with the current trial, without blocking."""
+    markers.send(marker, frames.block, frames.trial, sample_ns)
+
+def enter_phase(phase, block=None, trial=None):
+    """
+    Marks the start of a task phase (see frame_timing.PHASES): the following flips are tagged with it
+    and the session recording and telemetry log it. Passing block and trial starts a new trial.
+    """
+    if block is not None:
+        frames.begin_trial(block, trial, phase)
+    else:
+        frames.set_phase(phase)
+    if recording is not None:
+        recording.event(phase, frames.block, frames.trial)
+    telemetry.publish_event(session_clock.now_ns(), phase, frames.block, frames.trial)
+
 
 def show_task(params, nTrials=100):
     """
@@ -671,68 +836,92 @@ def show_task(params, nTrials=100):
 
     """
     
-    global run_path, win
-    
-    instructions2_0=visual.TextStim(win,text="Joystick Task",pos=(0,0.4),color=(-1,-1,-1),height=0.05,bold=True)
-    instructions2_1=visual.TextStim(win,text="Please press the trigger button under your right index finger when you see the message:",pos=(0,0.2),color=(-1,-1,-1),height=0.04)
-    instructions2_2=visual.TextStim(win,text="PRESS",pos=(0,0.03),color=(-1,-1,-1),height=0.06,bold=True)
-    instructions2_3=visual.TextStim(win,text="On the screen, if the image of a joystick increases in size, push the corresponding joystick forward",pos=(0,-0.2),color=(-1,-1,-1),height=0.04)
-    instructions2_4=visual.TextStim(win,text="Try to be as quick and accurate as possible.",pos=(0,-0.3),color=(-1,-1,-1),height=0.04)
+    global run_path, win, acquisition, trial_writer
+
+    enter_phase('instructions')
+    # Every stimulus of the task is built here, before the first trial, and warmed below.
+    # The instructions come first, so they are on screen while the rest is built.
+    stimuli = StimulusRegistry(win)
+    instructions2_0 = stimuli.add('instructions2_0', visual.TextStim(win,text="Joystick Task",pos=(0,0.4),color=(-1,-1,-1),height=0.05,bold=True))
+    instructions2_1 = stimuli.add('instructions2_1', visual.TextStim(win,text="Please press the trigger button under your right index finger when you see the message:",pos=(0,0.2),color=(-1,-1,-1),height=0.04))
+    instructions2_2 = stimuli.add('instructions2_2', visual.TextStim(win,text="PRESS",pos=(0,0.03),color=(-1,-1,-1),height=0.06,bold=True))
+    instructions2_3 = stimuli.add('instructions2_3', visual.TextStim(win,text="On the screen, if the image of a joystick increases in size, push the corresponding joystick forward",pos=(0,-0.2),color=(-1,-1,-1),height=0.04))
+    instructions2_4 = stimuli.add('instructions2_4', visual.TextStim(win,text="Try to be as quick and accurate as possible.",pos=(0,-0.3),color=(-1,-1,-1),height=0.04))
+    instructions2_0.draw()
+    instructions2_1.draw()
+    instructions2_2.draw()
+    instructions2_3.draw()
+    instructions2_4.draw()
+    win.flip()
+    startup.mark('first_instruction')
+
     mouse = event.Mouse(visible=False)
 
     joy1 = joystick.Joystick(0)
     joy2 = joystick.Joystick(1)
 
-    joysticks = pyglet.input.get_joysticks()
+    # Enumerated by open_devices()
     if not joysticks:
         raise RuntimeError("No joystick found!")
     joy1_pyglet = joysticks[0]
     joy2_pyglet = joysticks[1]  
 
+    # Sample both sticks continuously in the background, trials read windows from the ring buffer
+    # Only new stick states are stored: between two event pumps pyglet reports the same values again
+    acquisition = JoystickAcquisition(joy1_pyglet, joy2_pyglet, rate=1000, clock=session_clock.now_ns, changes_only=True)
+    acquisition.start()
+    if recording is not None:
+        recording.start(acquisition) # Every sample of the session goes to the recording file
+    telemetry.start(acquisition)
+
 
     # ISI cross
-    isi_cross = visual.TextStim(win,text="+",pos=(0,0.05),color=(-1,-1,-1),height=0.2,bold=True)
+    isi_cross = stimuli.add('isi_cross', visual.TextStim(win,text="+",pos=(0,0.05),color=(-1,-1,-1),height=0.2,bold=True))
 
     #Joytick images
     joy_r_image_path = os.path.join("Images", "t16_right.png")
-    joy_r_image = visual.ImageStim(win, image=joy_r_image_path, pos=(0.55,0.07))
+    joy_r_image = stimuli.add('joy_r_image', visual.ImageStim(win, image=joy_r_image_path, pos=(0.55,0.07)))
     joy_l_image_path = os.path.join("Images", "t16_left.png")
-    joy_l_image = visual.ImageStim(win, image=joy_l_image_path, pos=(-0.55,0.07))
+    joy_l_image = stimuli.add('joy_l_image', visual.ImageStim(win, image=joy_l_image_path, pos=(-0.55,0.07)))
 
     #Press message
-    press_message=visual.TextStim(win,text="PRESS",pos=(0,0.05),color=(-1,-1,-1),height=0.05,bold=True)
+    press_message = stimuli.add('press_message', visual.TextStim(win,text="PRESS",pos=(0,0.05),color=(-1,-1,-1),height=0.05,bold=True))
 
     #Correct rectangles
-    rect_right_green = visual.Rect(win, width=0.65, height=0.75, pos=(0.55,0.07), lineColor='green', lineWidth=4, fillColor = None)
-    rect_left_green = visual.Rect(win, width=0.65, height=0.75, pos=(-0.55,0.07), lineColor='green', lineWidth=4, fillColor = None)
-    rect_right_red = visual.Rect(win, width=0.65, height=0.75, pos=(0.55,0.07), lineColor='red', lineWidth=4,  fillColor = None)
-    rect_left_red = visual.Rect(win, width=0.65, height=0.75, pos=(-0.55,0.07), lineColor='red', lineWidth=4, fillColor = None)
-    rect_right_black = visual.Rect(win, width=0.65, height=0.75, pos=(0.55,0.07), lineColor='black', lineWidth=4, fillColor = None)
-    rect_left_black = visual.Rect(win, width=0.65, height=0.75, pos=(-0.55,0.07), lineColor='black', lineWidth=4, fillColor = None)  
+    rect_right_green = stimuli.add('rect_right_green', visual.Rect(win, width=0.65, height=0.75, pos=(0.55,0.07), lineColor='green', lineWidth=4, fillColor = None))
+    rect_left_green = stimuli.add('rect_left_green', visual.Rect(win, width=0.65, height=0.75, pos=(-0.55,0.07), lineColor='green', lineWidth=4, fillColor = None))
+    rect_right_red = stimuli.add('rect_right_red', visual.Rect(win, width=0.65, height=0.75, pos=(0.55,0.07), lineColor='red', lineWidth=4,  fillColor = None))
+    rect_left_red = stimuli.add('rect_left_red', visual.Rect(win, width=0.65, height=0.75, pos=(-0.55,0.07), lineColor='red', lineWidth=4, fillColor = None))
+    rect_right_black = stimuli.add('rect_right_black', visual.Rect(win, width=0.65, height=0.75, pos=(0.55,0.07), lineColor='black', lineWidth=4, fillColor = None))
+    rect_left_black = stimuli.add('rect_left_black', visual.Rect(win, width=0.65, height=0.75, pos=(-0.55,0.07), lineColor='black', lineWidth=4, fillColor = None))
 
     # Press test message definition
-    press_test_message = visual.TextStim(win, text="We will now train on the first part of the task.", pos=(0, 0.4), color=(-1, -1, -1), height=0.05, bold=False)
-    press_test_message2 = visual.TextStim(win, text="Please press the trigger button under your right index when you see the message:", pos=(0, 0.2), color=(-1, -1, -1), height=0.04)
-    press_test_message3 = visual.TextStim(win, text="PRESS", pos=(0, 0.03), color=(-1, -1, -1), height=0.06, bold=True)
-    press_test_message4 = visual.TextStim(win, text="Try to be as fast and accurate as possible.", pos=(0, -0.2), color=(-1, -1, -1), height=0.04)
+    press_test_message = stimuli.add('press_test_message', visual.TextStim(win, text="We will now train on the first part of the task.", pos=(0, 0.4), color=(-1, -1, -1), height=0.05, bold=False))
+    press_test_message2 = stimuli.add('press_test_message2', visual.TextStim(win, text="Please press the trigger button under your right index when you see the message:", pos=(0, 0.2), color=(-1, -1, -1), height=0.04))
+    press_test_message3 = stimuli.add('press_test_message3', visual.TextStim(win, text="PRESS", pos=(0, 0.03), color=(-1, -1, -1), height=0.06, bold=True))
+    press_test_message4 = stimuli.add('press_test_message4', visual.TextStim(win, text="Try to be as fast and accurate as possible.", pos=(0, -0.2), color=(-1, -1, -1), height=0.04))
 
     
     # Joystick test message definition
-    joy_text = visual.TextStim(win, text="Now, we will train on the second part of the task", pos=(0, 0.4), color=(-1, -1, -1), height=0.04)
-    joy_text2 = visual.TextStim(win, text="Please push the joystick that increases in size forward", pos=(0, 0.2), color=(-1, -1, -1), height=0.04)
-    joy_text3 = visual.TextStim(win, text="If you push the correct joystick, a green rectangle will appear around it and a red rectangle if you push the wrong one.", pos=(0, 0.03), color=(-1, -1, -1), height=0.04)
-    joy_text4 = visual.TextStim(win, text="Try to be as fast and accurate as possible.", pos=(0, -0.2), color=(-1, -1, -1), height=0.04)
+    joy_text = stimuli.add('joy_text', visual.TextStim(win, text="Now, we will train on the second part of the task", pos=(0, 0.4), color=(-1, -1, -1), height=0.04))
+    joy_text2 = stimuli.add('joy_text2', visual.TextStim(win, text="Please push the joystick that increases in size forward", pos=(0, 0.2), color=(-1, -1, -1), height=0.04))
+    joy_text3 = stimuli.add('joy_text3', visual.TextStim(win, text="If you push the correct joystick, a green rectangle will appear around it and a red rectangle if you push the wrong one.", pos=(0, 0.03), color=(-1, -1, -1), height=0.04))
+    joy_text4 = stimuli.add('joy_text4', visual.TextStim(win, text="Try to be as fast and accurate as possible.", pos=(0, -0.2), color=(-1, -1, -1), height=0.04))
 
     # Ready message
-    ready_message = visual.TextStim(win, text="We will now start the task, any questions? ", pos=(0, 0.03), color=(-1, -1, -1), height=0.03, bold=True)
-    
-    # Instructions
-    instructions2_0.draw()
-    instructions2_1.draw()
-    instructions2_2.draw()
-    instructions2_3.draw()
-    instructions2_4.draw()
-    win.flip()   
+    ready_message = stimuli.add('ready_message', visual.TextStim(win, text="We will now start the task, any questions? ", pos=(0, 0.03), color=(-1, -1, -1), height=0.03, bold=True))
+
+    # Block end, break and end of task messages, the RT text is set at the end of each block
+    RT_message = stimuli.add('RT_message', visual.TextStim(win,text="Average Reaction Time: 0.000",pos=(0,0),color=(-1,-1,-1),height=0.05,bold=True))
+    break_message = stimuli.add('break_message', visual.TextStim(win, text="BREAK", pos=(0, 0), color=(-1, -1, -1), height=0.05, bold=True))
+    end_message = stimuli.add('end_message', visual.TextStim(win, text="End of task. Thank you for your participation!", pos=(0, 0), color=(-1, -1, -1), height=0.05, bold=True))
+
+    # Countdown of TI_countdown
+    stimuli.add('countdown_text', visual.TextStim(win,text="25",pos=(0,0.2),color='black', height=0.07))
+    stimuli.add('countdown_circle', visual.Circle(win, radius=0.1, pos=(0,0.2), fillColor=None, lineColor=[-0.5,-0.5,-0.5], lineWidth=4))
+
+    with startup.span('warm_stimuli'):
+        stimuli.warm() # Into the back buffer, the instructions stay on screen
 
     # Wait for keyboard input
     key = event.waitKeys(keyList=['space','5','esc','escape'])
@@ -795,7 +984,7 @@ def show_task(params, nTrials=100):
 
             if i % 2 == 0: 
                 joy_r_image.size += (0.2, 0.2)
-                output = wait_joystick_pushed(joy_r_image,joy_l_image,rect_right_green,rect_left_green, duration=2, correct_rect='right', rect_left_red=rect_left_red, rect_right_red=rect_right_red, joystick_right=joy1_pyglet, joystick_left=joy2_pyglet, rect_left_black=rect_left_black, rect_right_black=rect_right_black)
+                output = wait_joystick_pushed(joy_r_image,joy_l_image,rect_right_green,rect_left_green, duration=2, correct_rect='right', rect_left_red=rect_left_red, rect_right_red=rect_right_red, joystick_right=joy1_pyglet, joystick_left=joy2_pyglet, rect_left_black=rect_left_black, rect_right_black=rect_right_black, acquisition=acquisition)
                 joy_r_image.size -= (0.2, 0.2)
                 win.flip() # Clear the screen for the ISI
                 #isi_cross.draw()
@@ -805,7 +994,7 @@ def show_task(params, nTrials=100):
 
             elif i % 2 == 1:
                 joy_l_image.size += (0.2, 0.2)
-                output = wait_joystick_pushed(joy_r_image,joy_l_image,rect_right_green,rect_left_green, duration=2, correct_rect='left', rect_left_red=rect_left_red, rect_right_red=rect_right_red, joystick_right=joy1_pyglet, joystick_left=joy2_pyglet, rect_left_black=rect_left_black, rect_right_black=rect_right_black)
+                output = wait_joystick_pushed(joy_r_image,joy_l_image,rect_right_green,rect_left_green, duration=2, correct_rect='left', rect_left_red=rect_left_red, rect_right_red=rect_right_red, joystick_right=joy1_pyglet, joystick_left=joy2_pyglet, rect_left_black=rect_left_black, rect_right_black=rect_right_black, acquisition=acquisition)
                 joy_l_image.size -= (0.2, 0.2)
                 win.flip() # Clear the screen for the ISI
                 #isi_cross.draw()
@@ -825,76 +1014,57 @@ def show_task(params, nTrials=100):
             print('Escaping')
             return -1
 
-    TI_countdown(win, t=5) # Ramp-up period
+    enter_phase('countdown')
+    TI_countdown(win, t=5, stimuli=stimuli, cues=cues) # Ramp-up period
 
     win.flip()
     mouse_clear(mouse)
 
     
     #log.write('Trial,Stim,Cond,Lag,LBin,StartT,Resp,RT,Corr\n')
-    log = dict.fromkeys(('ID','Session','Run','Trial'))
+    log = dict.fromkeys(RUN_FIELDS)
     local_timer = core.MonotonicClock()
 
-    
-    nb_blocks = params['NbBlocks']
-    if params['Set'] == 'P':
-        nb_blocks = 1
-    nb_trials = params['NbTrials']
-    if params['Set'] == 'P':
-        nb_trials = 10
-
-    #define percentage of trials for joystick movement
-    percentage_joystick = 0.3
-    
-    #Indices joysticks
-    nb_movements = int(nb_trials*percentage_joystick)
-    Nb_right = int(nb_movements/2) # Defines the number of right joystick movements
-
-    idcs=np.array(random.sample(range(0,nb_trials), nb_movements)) #Defines the trials where the joystick will be moved
-    idx_right=random.sample(range(nb_movements),Nb_right) # Defines the indices of the trials where the right joystick will be moved
-    idx_left=np.delete(idcs,idx_right) # Defines the trials where the left joystick will be moved
+    # Side and jitters of every trial, drawn in start_session (see session_schedule.py)
+    plan = by_block(schedule)
+    nb_blocks, nb_trials = plan.shape
+    first_block, first_trial = resume_at # (0, 0) unless the run is resumed
 
-    mask=np.zeros(len(idcs),bool)
-    mask[idx_right]=True
-    idx_right=idcs[mask] # trials where the right joystick will be moved
-
-    right_positions = []
-    left_positions = []
     RT_end_right = 0
     RT_end_left = 0
     RT_start_right = 0
     RT_start_left = 0
     
-    for block in range(nb_blocks):
+    for block in range(first_block, nb_blocks):
         log['Block'] = block + 1
         RTs = []
-        
-        # Ensure all blocks are the same duration by uniformally distributing the jitters
-        jitters_1 = np.linspace(0.65, 0.85, nb_trials)
-        jitters1shuffled = np.random.permutation(jitters_1)
-        jitters_1 = [round(i, 2) for i in jitters1shuffled]
-        jitters_2 = np.linspace(3, 4, nb_trials)
-        jitters2shuffled = np.random.permutation(jitters_2)
-        jitters_2 = [round(i, 2) for i in jitters2shuffled]
-
-        for trial in range(nb_trials):
+
+        for trial in range(first_trial if block == first_block else 0, nb_trials):
+            planned = plan[block, trial]
             
             RT_press=0
             RT_end_right = 0
             RT_end_left = 0
             RT_start_right = 0
             RT_start_left = 0
-            time=0
+            t_ns = []
+            right_positions = []
+            left_positions = []
             joy_l_image.autoDraw = True
             joy_r_image.autoDraw = True
+            enter_phase('trial_start', block + 1, trial + 1)
             win.flip()
 
             t1=local_timer.getTime()
             log['TrialStart'] = t1
+            log['TrialStart_ns'] = session_clock.now_ns()
+            window_start_ns = 'NA'
             core.wait(1) # Wait for 1 second before the press message
 
+            enter_phase('press')
             press_message.draw()
             win.flip() 
+            mark('press_message')
             mouse_clear(mouse)
             RT_press = wait_b_pressed(joy1, press_message, 1, win) # Press message, wait for trigger button press, self paced but lasts for max 1s
 
@@ -905,25 +1075,29 @@ def show_task(params, nTrials=100):
         
             if RT_press > 0.05: # We have a response
 
+                enter_phase('isi')
                 win.flip() # Clear the screen for the ISI
                 #isi_cross.draw()
                 joy_l_image.draw()
                 joy_r_image.draw()
                 win.flip() 
-                isi = jitters_1[trial] # Get the jitter for this trial 
+                isi = planned['isi1'] # Get the jitter for this trial
                 core.wait(isi) # Wait for ~0.75 seconds before the joystick push
 
-                if trial in idx_right: 
+                if planned['side'] == SIDES['right']:
                     
+                    enter_phase('onset')
                     joy_r_image.size += (0.15, 0.15) #enlarge the right joystick
                     joy_r_image.draw()
                     joy_l_image.draw()
                     rect_right_black.draw()
                     win.flip()
+                    mark('enlarge_right')
+                    enter_phase('window')
                     output = wait_joystick_pushed(
                         joy_r_image,joy_l_image,rect_right_green,rect_left_green,2, 
                         correct_rect='right', rect_left_red=rect_left_red, rect_right_red=rect_right_red,
-                          joystick_right=joy1_pyglet, joystick_left=joy2_pyglet, rect_left_black=rect_left_black, rect_right_black=rect_right_black) # wait for joystick push, lasts 2 seconds
+                          joystick_right=joy1_pyglet, joystick_left=joy2_pyglet, rect_left_black=rect_left_black, rect_right_black=rect_right_black, acquisition=acquisition) # wait for joystick push, lasts 2 seconds
                    
                     
                     RT_end_right = output['RT_end_right']
@@ -932,7 +1106,8 @@ def show_task(params, nTrials=100):
                     left_positions = output['left_positions']
                     RT_start_right = output['RT_start_right']
                     RT_start_left = output['RT_start_left']
-                    time = output['time']
+                    t_ns = output['t_ns']
+                    window_start_ns = output['window_start_ns']
                     
                     joy_r_image.size -= (0.15, 0.15)
                     win.flip() # Clear the screen for the ISI
@@ -940,17 +1115,20 @@ def show_task(params, nTrials=100):
                     joy_r_image.draw()
                     win.flip()  
 
-                elif trial in idx_left:  
+                elif planned['side'] == SIDES['left']:
 
+                    enter_phase('onset')
                     joy_l_image.size += (0.15, 0.15) #enlarge the left joystick
                     joy_l_image.draw()
                     joy_r_image.draw()
                     rect_left_black.draw()
                     win.flip()
+                    mark('enlarge_left')
+                    enter_phase('window')
                     output = wait_joystick_pushed(
                         joy_r_image,joy_l_image,rect_right_green,rect_left_green,2, 
                         correct_rect='left', rect_left_red=rect_left_red, rect_right_red=rect_right_red, 
-                        joystick_right=joy1_pyglet, joystick_left=joy2_pyglet, rect_left_black=rect_left_black, rect_right_black=rect_right_black) # wait for joystick push, lasts 2 seconds
+                        joystick_right=joy1_pyglet, joystick_left=joy2_pyglet, rect_left_black=rect_left_black, rect_right_black=rect_right_black, acquisition=acquisition) # wait for joystick push, lasts 2 seconds
                     
                     
                     RT_end_right = output['RT_end_right']
@@ -959,7 +1137,8 @@ def show_task(params, nTrials=100):
                     left_positions = output['left_positions']
                     RT_start_right = output['RT_start_right']
                     RT_start_left = output['RT_start_left']
-                    time = output['time']
+                    t_ns = output['t_ns']
+                    window_start_ns = output['window_start_ns']
                     if RT_start_left is not None:
                         RTs += [RT_start_left] # Store RT value to show at the end of the block                   
                     
@@ -970,12 +1149,14 @@ def show_task(params, nTrials=100):
                     win.flip()
 
                 else:
-                    buffer=buffer_joystick(joy1, joy2, duration=2) #Buffer to avoid storage of joystick values, lasts 2 seconds
+                    enter_phase('buffer')
+                    buffer=buffer_joystick(duration=2) #Buffer to avoid storage of joystick values, lasts 2 seconds
                     win.flip()
 
                 
-                isi2 = jitters_2[trial] # Get the jitter for this trial
-                buffer_joystick(joy1, joy2, duration=isi2) # Buffer to avoid storage of joystick values, lasts ~3.5s
+                isi2 = planned['isi2'] # Get the jitter for this trial
+                enter_phase('buffer')
+                buffer_joystick(duration=isi2) # Buffer to avoid storage of joystick values, lasts ~3.5s
                 win.flip()
 
                 log['RT_press'] = RT_press
@@ -983,9 +1164,8 @@ def show_task(params, nTrials=100):
                 log['RT_start_left'] = RT_start_left
                 log['RT_end_right'] = RT_end_right
                 log['RT_end_left'] = RT_end_left
-                log['right_positions'] = right_positions
-                log['left_positions'] = left_positions
-                log['time'] = time
+                log['WindowStart_ns'] = window_start_ns
+                trajectory = (t_ns, right_positions, left_positions)
 
             else:
                 log['RT_press'] = 'NA'
@@ -993,9 +1173,8 @@ def show_task(params, nTrials=100):
                 log['RT_end_left'] = 'NA'
                 log['RT_start_right'] = 'NA'
                 log['RT_start_left'] = 'NA'
-                log['right_positions'] = 'NA'
-                log['left_positions'] = 'NA'
-                log['time'] = 'NA'
+                log['WindowStart_ns'] = 'NA'
+                trajectory = None
 
 
             
@@ -1011,42 +1190,40 @@ def show_task(params, nTrials=100):
             log['Run'] = params['Run']
             log['Trial'] = trial+1
             log['Block'] = block + 1
+            log['LateFlips'], log['DroppedFrames'] = frames.trial_summary()
+            telemetry.publish_trial(log)
 
 
-            # Save if not practice run
-            if params['Set'] != 'P':
-                # See if run file already exist
-                if os.path.exists(run_path):
-                    new_file = 0 # Append to file
-                else:
-                    new_file = 1 # Create new file
+            # Save if not practice run, encoding and disk writes happen on the writer thread
+            # Trajectories go to the binary sidecar, the CSV only keeps their record range
+            if trial_writer is not None:
+                trial_writer.submit(log, trajectory)
 
-                with open(run_path, 'a+') as f:
-                    w = csv.DictWriter(f, log.keys(),lineterminator = '\n')
-                    if new_file == 1:
-                        w.writeheader()
-                    w.writerow(log)      
-        
+        # Commit the block: the writer flushes trajectories first so no CSV row points past
+        # the end of the sidecar, then the rows, then the checkpoint moves to the last trial
+        if trial_writer is not None:
+            trial_writer.flush()
+        frames.flush()
 
+        enter_phase('block_end')
         joy_l_image.autoDraw = False
         joy_r_image.autoDraw = False
-        RT_message=visual.TextStim(win,text=f"Average Reaction Time: {np.round(np.nanmean(RTs),3)}",pos=(0,0),color=(-1,-1,-1),height=0.05,bold=True)
+        RT_message.setText(f"Average Reaction Time: {np.round(np.nanmean(RTs),3)}")
         win.flip()
         RT_message.draw()
         win.flip()
         core.wait(5)
         # Break period
         if block < nb_blocks - 1: # If not the last block
-            break_message = visual.TextStim(win, text="BREAK", pos=(0, 0), color=(-1, -1, -1), height=0.05, bold=True)
             break_message.autoDraw = True
 
-            TI_countdown(win, t=25) # Break period
+            enter_phase('break')
+            TI_countdown(win, t=25, stimuli=stimuli, cues=cues) # Break period
             break_message.autoDraw = False
             win.flip()
 
     # End of task
     if params['Set'] != 'P':
-        end_message = visual.TextStim(win, text="End of task. Thank you for your participation!", pos=(0, 0), color=(-1, -1, -1), height=0.05, bold=True)
         end_message.draw()
         win.flip()
         core.wait(5)  # Wait for 5 seconds before closing
@@ -1060,56 +1237,169 @@ def show_task(params, nTrials=100):
 # Main routine
 
 
-params = get_parameters()
-
-params['Randomization'] = 1234
-if params['Set'] == 'Standard':
-    params['Set'] = '1'
-elif params['Set'] == 'Practice':
-    params['Set'] = 'P'
-
-# Set our random seed
-if params['Randomization'] == -1:
-    seed = params['ID']
-elif params['Randomization']==0:
-    seed = None
-else:
-    seed = params['Randomization']
-np.random.seed(seed)
-
-params['TimeStarted'] = str(datetime.now())
-
-### Creating task parameters log file
-subject_path = 'Data\\Subject_'+str(params['ID'])
-params_path = subject_path+'\\S_'+str(params['ID'])+'_PMBR_task_params.csv'
-run_path = subject_path+'\\S_'+str(params['ID'])+'_PMBR_runs.csv'
-subject_path = Path(subject_path); 
-params_path = Path(params_path); 
-run_path = Path(run_path); 
-
-# Create subject path if there isn't one
-if not os.path.exists(subject_path):
-    os.makedirs(subject_path)
-
-# See if task files already exist
-if os.path.exists(params_path):
-    new_file = 0 # Append to file
-else:
-    new_file = 1 # Create new file
-
-with open(params_path, 'a+') as f:
-    w = csv.DictWriter(f, params.keys(),lineterminator = '\n')
-    if new_file == 1:
-        w.writeheader()
-    w.writerow(params)
-
-
-
-win = visual.Window(fullscr=True,monitor='testMonitor',screen=n_screen,units="height",color=[0,0,0], winType = 'pyglet')
-
-
-
-show_task(params)
+def start_session(params, data_path='Data', clock=None, marker_backend=None, resume=False):
+    """
+    Everything that happens between the parameters dialog and the window:
+    seeds the generators, starts the session clock, creates the subject folder,
+    opens the run writers and appends params to the task params file.
+    EEG markers go to `marker_backend` (see eeg_markers), a loopback when None.
+    Draws the trial schedule from the session seed and saves it next to the params file.
+    With resume, the schedule of the run is loaded instead and the task continues
+    after the last trial committed to the runs file (see checkpoint.py).
+    Sets the module globals show_task relies on (session_clock, run_path, trial_writer, schedule, resume_at).
+    Opens the devices if open_devices() has not run yet.
+    """
+    global session_clock, subject_path, params_path, run_path, acquisition, trial_writer, frames, recording, telemetry, markers, schedule, resume_at
+
+    if cues is None:
+        open_devices()
+    params['Randomization'] = 1234
+    if params['Set'] == 'Standard':
+        params['Set'] = '1'
+    elif params['Set'] == 'Practice':
+        params['Set'] = 'P'
+
+    # Set our random seed
+    if params['Randomization'] == -1:
+        seed = params['ID']
+    elif params['Randomization']==0:
+        seed = None
+    else:
+        seed = params['Randomization']
+    # Practice runs are one block of 10 trials
+    nb_blocks, nb_trials = (1, 10) if params['Set'] == 'P' else (params['NbBlocks'], params['NbTrials'])
+
+    # Single timebase for samples, flips and trial events, its origin is TimeStarted
+    session_clock = clock or SessionClock()
+    params['TimeStarted'] = str(session_clock.wall_origin)
+
+    ### Creating task parameters log file
+    subject_path = Path(data_path) / f"Subject_{params['ID']}"
+    params_path = subject_path / f"S_{params['ID']}_PMBR_task_params.csv"
+    run_path = subject_path / f"S_{params['ID']}_PMBR_runs.csv"
+
+    # Create subject path if there isn't one
+    if not os.path.exists(subject_path):
+        os.makedirs(subject_path)
+
+    # Same schedule as the interrupted attempt when resuming, practice runs are never resumed
+    resume_at = (0, 0)
+    run_schedule_path = schedule_path(subject_path, params['ID'], params['Session'], params['Run'])
+    run_checkpoint_path = checkpoint_path(subject_path, params['ID'], params['Session'], params['Run'])
+    if resume and params['Set'] != 'P':
+        if not run_schedule_path.exists():
+            raise RuntimeError(f'{run_schedule_path} not found, the run cannot be resumed with its schedule')
+        schedule = load_schedule(run_schedule_path)
+        drop_partial_row(run_path)
+        last_checkpoint = read_checkpoint(run_checkpoint_path)
+        resume_at = resume_cursor(run_path, last_checkpoint, params['Session'], params['Run'],
+                                  by_block(schedule).shape[1])
+        # Trajectories of trials after the last committed one, or cut by the crash, are written again
+        truncate_trajectories(trajectory_path(subject_path, params['ID'], params['Session'], params['Run']),
+                              committed_trajectory_end(run_path, last_checkpoint, params['Session'], params['Run']))
+        print(f'Resuming at block {resume_at[0] + 1}, trial {resume_at[1] + 1}')
+    else:
+        schedule = make_schedule(nb_blocks, nb_trials, seed)
+        if params['Set'] != 'P':
+            save_schedule(run_schedule_path, schedule)
 
-win.close()  
-core.quit()
+    acquisition = None
+    trial_writer = None
+    if params['Set'] != 'P':
+        # Runs files written by earlier versions of the task (e.g. trajectories as text columns) have other columns,
+        # they are upgraded in place and the original kept as a backup
+        if run_path.exists() and run_path.stat().st_size > 0:
+            with open(run_path, newline='') as f:
+                fieldnames = next(csv.reader(f))
+            if fieldnames != RUN_FIELDS:
+                print(f'{run_path} upgraded to the current columns, original kept as {upgrade_runs(run_path, RUN_FIELDS).name}')
+        trajectories = TrajectoryWriter(trajectory_path(subject_path, params['ID'], params['Session'], params['Run']))
+        checkpoint = Checkpoint(run_checkpoint_path, {'ID': params['ID'], 'Session': params['Session'], 'Run': params['Run'],
+                                                      'schedule': run_schedule_path.name, 'seed': seed}, trajectories.offset)
+        # Only the block commits flush the runs file, after the trajectory file, so no row points past its end
+        run_log = RunLogWriter(run_path, flush_interval=None, on_flush=checkpoint.commit)
+        trial_writer = AsyncTrialWriter(run_log, trajectories)
+
+    # Every flip is stamped and tagged with its trial and phase, saved next to the runs file except in practice
+    frames = FrameRecorder(frame_path(subject_path, params['ID'], params['Session'], params['Run']) if params['Set'] != 'P' else None,
+                           clock=session_clock.now_ns)
+    # Continuous recording of both sticks and of the phase events
+    recording = None
+    if params['Set'] != 'P':
+        recording = SessionRecorder(recording_path(subject_path, params['ID'], params['Session'], params['Run']),
+                                    clock=session_clock.now_ns)
+    # Live samples, flips, phases and trials for a monitoring process (python telemetry.py), dropped if none listens
+    telemetry = TelemetryPublisher()
+    frames.listeners.append(telemetry.publish_flip)
+    # EEG markers are emitted off the task thread, their call-to-emit latencies are saved except in practice
+    markers = MarkerSender(marker_backend or LoopbackBackend(),
+                           marker_path(subject_path, params['ID'], params['Session'], params['Run']) if params['Set'] != 'P' else None,
+                           clock=session_clock.now_ns)
+
+    # See if task files already exist
+    if os.path.exists(params_path):
+        new_file = 0 # Append to file
+    else:
+        new_file = 1 # Create new file
+
+    with open(params_path, 'a+') as f:
+        w = csv.DictWriter(f, params.keys(),lineterminator = '\n')
+        if new_file == 1:
+            w.writeheader()
+        w.writerow(params)
+
+
+def run_session(params, window):
+    """Runs the task in `window`, then stops the acquisition and drains the writer whatever happened."""
+    global win, cues
+    win = window
+    frames.attach(win)
+    try:
+        return show_task(params)
+    finally:
+        frames.close()
+        # Escape, normal end or crash: whatever was batched still reaches the disk
+        telemetry.close()
+        markers.close()
+        print(f'EEG markers: {markers.summary()}')
+        cues.close()
+        print(f'Audio cues: {cues.summary()}')
+        cues = None
+        if acquisition is not None:
+            acquisition.stop()
+            print(f'Joystick acquisition: {acquisition.stats()}')
+        if recording is not None:
+            recording.close()
+        if trial_writer is not None:
+            trial_writer.close()
+            print(f'Trial writer: {trial_writer.stats()}')
+        print(f'Startup:\n{startup.report()}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-m", "--monitor", default=1)
+    parser.add_argument("--resume", action='store_true', help="Continue the run after its last committed trial, with the same schedule")
+    parser.add_argument("--markers", default='loopback', help="EEG marker backend: loopback, file:PATH or parallel[:ADDRESS]")
+    args = parser.parse_args()
+    n_screen = int(args.monitor)
+
+    # Imports, joysticks and audio on a background thread while the participant fills the dialog.
+    # The dialog and the window stay on the main thread, where the GUI toolkits and OpenGL need them.
+    # The dialog's modules are imported first, so psychopy is never imported by both threads at once.
+    with startup.span('dialog_imports'):
+        load_dialog_modules()
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix='startup') as pool:
+        devices = pool.submit(open_devices)
+        params = startup.timed('dialog', get_parameters)
+        devices.result()
+
+    with startup.span('session_files'):
+        start_session(params, marker_backend=make_backend(args.markers), resume=args.resume)
+
+    with startup.span('window'):
+        win = visual.Window(fullscr=True,monitor='testMonitor',screen=n_screen,units="height",color=[0,0,0], winType = 'pyglet')
+    run_session(params, win)
+
+    win.close()  
+    core.quit()
@@ -0,0 +1,103 @@
+'''Audio cues of the PMBR task, synthesized once and played on an output stream kept open.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import importlib.util
+import time
+
+import numpy as np
+
+
+# name: (frequency Hz, duration s), the countdown beep is psychopy's Sound('A', secs=0.1)
+TONES = {'countdown': (440.0, 0.1)}
+
+
+def synthesize(frequency, secs, sample_rate=48000, volume=0.8, ramp=0.005):
+    """Sine tone with raised-cosine onset and offset ramps (no clicks), float32 in [-1, 1]."""
+    t = np.arange(int(round(secs * sample_rate))) / sample_rate
+    wave = volume * np.sin(2 * np.pi * frequency * t)
+    n = min(int(ramp * sample_rate), len(wave) // 2)
+    if n:
+        envelope = 0.5 - 0.5 * np.cos(np.pi * np.arange(n) / n)
+        wave[:n] *= envelope
+        wave[-n:] *= envelope[::-1]
+    return wave.astype(np.float32)
+
+
+class AudioCueCache:
+    """
+    Tones of the task, ready to play. backend is 'stream' (sounddevice),
+    'psychopy' (sound_module.Sound) or 'auto' (stream when sounddevice is installed).
+    latencies holds, per play(), the seconds from the call to the DAC (stream)
+    or the duration of the call (psychopy).
+    """
+
+    def __init__(self, tones=TONES, sample_rate=48000, backend='auto', sound_module=None):
+        self.sample_rate = sample_rate
+        self.waves = {name: synthesize(frequency, secs, sample_rate) for name, (frequency, secs) in tones.items()}
+        if backend == 'auto':
+            backend = 'stream' if importlib.util.find_spec('sounddevice') is not None else 'psychopy'
+        self.backend = backend
+        self.latencies = []
+        self._pending = None # (wave, play time on the stream clock), handed to the callback
+        self._current = None # [wave, position] being played by the callback
+        self._stream = None
+        self._sounds = {}
+        if backend == 'stream':
+            import sounddevice
+            self._stream = sounddevice.OutputStream(samplerate=sample_rate, channels=1, dtype='float32',
+                                                    latency='low', callback=self._callback)
+            self._stream.start()
+        elif backend == 'psychopy':
+            for name, wave in self.waves.items():
+                cue = sound_module.Sound(value=wave, sampleRate=sample_rate, secs=len(wave) / sample_rate)
+                # A silent first play opens the audio library's stream and buffers
+                silent = hasattr(cue, 'setVolume')
+                if silent:
+                    cue.setVolume(0)
+                cue.play()
+                cue.stop()
+                if silent:
+                    cue.setVolume(1)
+                self._sounds[name] = cue
+        else:
+            raise ValueError(f'unknown audio backend {backend!r}')
+
+    def _callback(self, out, frames, time_info, status):
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            wave, t_play = pending
+            self._current = [wave, 0]
+            self.latencies.append(time_info.outputBufferDacTime - t_play)
+        out.fill(0)
+        if self._current is not None:
+            wave, position = self._current
+            n = min(frames, len(wave) - position)
+            out[:n, 0] = wave[position:position + n]
+            self._current[1] += n
+            if self._current[1] >= len(wave):
+                self._current = None
+
+    def play(self, name):
+        """Starts cue `name`, cutting the one playing if any."""
+        if self._stream is not None:
+            self._pending = (self.waves[name], self._stream.time)
+            return
+        t0 = time.perf_counter()
+        self._sounds[name].play()
+        self.latencies.append(time.perf_counter() - t0)
+
+    def summary(self):
+        latency = np.array(self.latencies) * 1000
+        if not len(latency):
+            return {'backend': self.backend, 'cues': 0}
+        return {'backend': self.backend, 'cues': len(latency), 'latency_median_ms': float(np.median(latency)),
+                'latency_max_ms': float(latency.max())}
+
+    def close(self):
+        if self._stream is not None:
+            self._stream.stop()
+            self._stream.close()
+            self._stream = None
+        for cue in self._sounds.values():
+            cue.stop()
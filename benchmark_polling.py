@@ -0,0 +1,209 @@
+'''Joystick polling benchmark: rate, interval percentiles, jitter, duplicate samples and CPU of every acquisition backend.
+Usage:
+    python benchmark_polling.py --duration 5 --backends pyglet sdl2 --output bench.jsonl
+    python benchmark_polling.py --csv joystick_pyglet_data.csv joystick_threaded.csv
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import argparse
+import json
+import platform
+import sys
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from session_clock import SessionClock
+from virtual_joystick import ReplayTrack, VirtualJoystick, load_probe_csv
+
+
+def polling_metrics(t_ns, x, y, wall_s, cpu_s):
+    """Metrics of one recording: t_ns are session clock stamps, x/y the sampled axes."""
+    t_ns = np.asarray(t_ns, dtype=np.int64)
+    isi_ms = np.diff(t_ns) * 1e-6
+    n = len(t_ns)
+    duplicates = (np.diff(x) == 0) & (np.diff(y) == 0) if n > 1 else np.zeros(0, bool)
+    metrics = {
+        'samples': n,
+        'rate_hz': n / wall_s if wall_s > 0 else 0.0,
+        'duplicate_ratio': float(duplicates.mean()) if len(duplicates) else 0.0,
+        'cpu_percent': 100.0 * cpu_s / wall_s if wall_s > 0 else 0.0,
+    }
+    if len(isi_ms):
+        p50, p90, p99 = np.percentile(isi_ms, [50, 90, 99])
+        metrics.update({'isi_mean_ms': float(isi_ms.mean()), 'isi_p50_ms': float(p50),
+                        'isi_p90_ms': float(p90), 'isi_p99_ms': float(p99),
+                        'isi_max_ms': float(isi_ms.max()), 'jitter_ms': float(isi_ms.std())})
+    return metrics
+
+
+def record_pyglet(duration, clock):
+    import pyglet
+    joystick = pyglet.input.get_joysticks()[0]
+    joystick.open()
+    samples = []
+
+    def poll(dt):
+        samples.append((clock.now_ns(), joystick.x or 0, joystick.y or 0))
+
+    pyglet.clock.schedule_interval(poll, 0.001)
+    pyglet.clock.schedule_once(lambda dt: pyglet.app.exit(), duration)
+    pyglet.app.run()
+    pyglet.clock.unschedule(poll)
+    joystick.close()
+    return samples
+
+
+def record_pygame(duration, clock):
+    import pygame
+    pygame.init()
+    pygame.joystick.init()
+    joystick = pygame.joystick.Joystick(0)
+    joystick.init()
+    samples = []
+    stop = threading.Event()
+
+    def poll():
+        while not stop.is_set():
+            pygame.event.pump()
+            samples.append((clock.now_ns(), joystick.get_axis(0), joystick.get_axis(1)))
+            time.sleep(0.001)
+
+    thread = threading.Thread(target=poll)
+    thread.start()
+    time.sleep(duration)
+    stop.set()
+    thread.join()
+    pygame.quit()
+    return samples
+
+
+def record_sdl2(duration, clock):
+    from sdl2_joystick import SDLJoystick
+    joystick = SDLJoystick(clock)
+    end = clock.now_ns() + int(duration * 1e9)
+    while clock.now_ns() < end:
+        joystick.wait()
+        joystick.update()
+    s = joystick.samples()
+    return list(zip(s['time'], s['x'] / 32768.0, s['y'] / 32768.0))
+
+
+def record_screen(duration, clock):
+    from psychopy import visual
+    from psychopy.hardware import joystick as psychopy_joystick
+    win = visual.Window([400, 400])
+    psychopy_joystick.backend = 'pyglet'
+    joy = psychopy_joystick.Joystick(0)
+    samples = []
+    end = clock.now_ns() + int(duration * 1e9)
+    while clock.now_ns() < end:
+        samples.append((clock.now_ns(), joy.getX(), joy.getY()))
+        win.flip()
+    win.close()
+    return samples
+
+
+def record_acquisition(duration, clock):
+    import pyglet
+    from joystick_acquisition import JoystickAcquisition
+    joystick = pyglet.input.get_joysticks()[0]
+    joystick.open()
+    # The sampler thread reads the device state, the pyglet event loop keeps it
+    # updated, as win.flip() does in the task
+    with JoystickAcquisition(joystick, joystick, rate=1000, clock=clock.now_ns) as acquisition:
+        start = acquisition.cursor()
+        pyglet.clock.schedule_once(lambda dt: pyglet.app.exit(), duration)
+        pyglet.app.run()
+        _, times, right, _ = acquisition.read_since(start)
+    joystick.close()
+    return list(zip(times, right[:, 0], right[:, 1]))
+
+
+def record_replay(duration, clock, source='joystick_pygame_data.csv'):
+    """JoystickAcquisition over two virtual sticks replaying a probe CSV, runs without devices or display."""
+    from joystick_acquisition import JoystickAcquisition
+    t_ns, x, y = load_probe_csv(source)
+    track = ReplayTrack(t_ns * 1e-9, np.column_stack((x, y)))
+    right = VirtualJoystick(track, loop=True, clock=clock.now)
+    left = VirtualJoystick(track, loop=True, clock=clock.now)
+    right.start(); left.start()
+    with JoystickAcquisition(right, left, rate=1000, clock=clock.now_ns) as acquisition:
+        start = acquisition.cursor()
+        time.sleep(duration)
+        _, times, right_positions, _ = acquisition.read_since(start)
+    return list(zip(times, right_positions[:, 0], right_positions[:, 1]))
+
+
+BACKENDS = {
+    'pyglet': record_pyglet,
+    'pygame': record_pygame,
+    'sdl2': record_sdl2,
+    'screen': record_screen,
+    'acquisition': record_acquisition,
+    'replay': record_replay,
+}
+
+
+def run_backend(name, duration, replay=None):
+    """Runs one backend, returns its result record; backends that cannot run report an error."""
+    record = {'backend': name, 'duration_s': duration, 'date': datetime.now().isoformat(),
+              'machine': platform.node(), 'platform': platform.platform(), 'python': platform.python_version()}
+    clock = SessionClock()
+    try:
+        wall0, cpu0 = time.perf_counter(), time.process_time()
+        if name == 'replay' and replay:
+            samples = record_replay(duration, clock, replay)
+        else:
+            samples = BACKENDS[name](duration, clock)
+        wall, cpu = time.perf_counter() - wall0, time.process_time() - cpu0
+    except Exception as e: # Missing module, no device, no display...
+        record['error'] = f'{type(e).__name__}: {e}'
+        return record
+    samples = np.array(samples, dtype=np.float64).reshape(-1, 3)
+    record.update(polling_metrics(samples[:, 0].astype(np.int64), samples[:, 1], samples[:, 2], wall, cpu))
+    return record
+
+
+def analyze_probe_csv(path):
+    """Metrics of a past recording; CPU use was not recorded, so it is left out."""
+    t_ns, x, y = load_probe_csv(path)
+    wall = (t_ns[-1] - t_ns[0]) * 1e-9 if len(t_ns) else 0.0
+    record = {'backend': 'csv', 'source': str(path), 'duration_s': wall}
+    record.update(polling_metrics(t_ns, x, y, wall, 0.0))
+    del record['cpu_percent']
+    return record
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the joystick polling backends under the same protocol')
+    parser.add_argument('-d', '--duration', type=float, default=5.0, help='recording length per backend, in seconds')
+    parser.add_argument('-b', '--backends', nargs='+', choices=list(BACKENDS), default=list(BACKENDS))
+    parser.add_argument('-o', '--output', help='append results to this JSON lines file')
+    parser.add_argument('--replay', help='CSV replayed by the replay backend (default joystick_pygame_data.csv)')
+    parser.add_argument('--csv', nargs='+', default=[], help='analyze probe CSV recordings instead of recording')
+    args = parser.parse_args(argv)
+
+    if args.csv:
+        records = (analyze_probe_csv(path) for path in args.csv)
+    else:
+        records = (run_backend(name, args.duration, args.replay) for name in args.backends)
+    for record in records:
+        name = Path(record['source']).name if 'source' in record else record['backend']
+        if 'error' in record:
+            print(f'{name:32s} unavailable: {record["error"]}')
+        else:
+            print(f'{name:32s} {record["rate_hz"]:8.1f} Hz  ISI p50/p99 {record.get("isi_p50_ms", float("nan")):.2f}/'
+                  f'{record.get("isi_p99_ms", float("nan")):.2f} ms  jitter {record.get("jitter_ms", float("nan")):.2f} ms  '
+                  f'dup {100 * record["duplicate_ratio"]:.1f}%  CPU {record.get("cpu_percent", float("nan")):.0f}%')
+        if args.output:
+            with open(args.output, 'a') as f:
+                f.write(json.dumps(record) + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
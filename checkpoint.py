@@ -0,0 +1,141 @@
+'''Checkpoints of the PMBR runs, and resume after the last committed trial (python PMBR.py --resume).
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import csv
+import json
+import os
+import time
+from pathlib import Path
+
+
+def checkpoint_path(subject_path, subject_id, session, run):
+    return Path(subject_path) / f'S_{subject_id}_PMBR_ses{session}_run{run}_checkpoint.json'
+
+
+class Checkpoint:
+    """
+    Atomic checkpoint of one run. `state` holds what does not change during
+    the run (ID, Session, Run, schedule file and seed); commit() adds the
+    cursor of the last trial written and the end of the last trajectory
+    written (traj_end, in records). Pass commit as the on_flush callback of
+    the RunLogWriter.
+    """
+
+    def __init__(self, path, state, traj_end=0):
+        self.path = Path(path)
+        self.state = dict(state)
+        self.traj_end = traj_end
+
+    def commit(self, rows):
+        for row in reversed(rows):
+            if row.get('traj_offset') not in (None, '', 'NA'):
+                self.traj_end = int(row['traj_offset']) + int(row['traj_length'])
+                break
+        row = rows[-1]
+        state = dict(self.state, block=int(row['Block']), trial=int(row['Trial']), traj_end=self.traj_end,
+                     time=time.time())
+        tmp = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path) # Readers see the old checkpoint or the new one, never half of one
+
+
+def read_checkpoint(path):
+    """Checkpoint state as a dict, None when there is none."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def _lines_backwards(f, chunk):
+    """Complete lines of a binary file, last first, reading `chunk` bytes at a time from the end."""
+    position = f.seek(0, os.SEEK_END)
+    tail = b''
+    while position > 0:
+        step = min(chunk, position)
+        position -= step
+        f.seek(position)
+        lines = (f.read(step) + tail).split(b'\n')
+        tail = lines.pop(0) # May be cut, completed by the next chunk
+        for line in reversed(lines):
+            if line.strip():
+                yield line
+    if tail.strip():
+        yield tail
+
+
+def _run_rows_backwards(run_path, session, run, chunk):
+    """Rows of `session`/`run` in the runs CSV as dicts, last first, up to the rows of an earlier run."""
+    run_path = Path(run_path)
+    if not run_path.exists() or run_path.stat().st_size == 0:
+        return
+    with open(run_path, 'rb') as f:
+        header = next(csv.reader([f.readline().decode()]))
+        seen = False
+        for line in _lines_backwards(f, chunk):
+            values = next(csv.reader([line.decode()]))
+            if values == header or len(values) != len(header): # Header, or a row cut by a crash
+                continue
+            row = dict(zip(header, values))
+            if row.get('Session') == str(session) and row.get('Run') == str(run):
+                seen = True
+                yield row
+            elif seen:
+                return
+
+
+def last_committed_row(run_path, session, run, chunk=64 * 1024):
+    """Last row of `session`/`run` in the runs CSV as a dict, None if the run has no row."""
+    return next(_run_rows_backwards(run_path, session, run, chunk), None)
+
+
+def committed_trajectory_end(run_path, checkpoint, session, run, chunk=64 * 1024):
+    """
+    Records of the run's trajectory file that belong to committed trials: the end of the
+    last trajectory in the CSV, or else of the checkpoint; 0 if none was committed.
+    """
+    for row in _run_rows_backwards(run_path, session, run, chunk):
+        if row.get('traj_offset') not in (None, '', 'NA'):
+            return int(row['traj_offset']) + int(row['traj_length'])
+    return checkpoint.get('traj_end', 0) if checkpoint is not None else 0
+
+
+def drop_partial_row(run_path):
+    """Truncates the runs CSV after its last complete line (a row cut by a crash), returns the bytes dropped."""
+    run_path = Path(run_path)
+    if not run_path.exists():
+        return 0
+    with open(run_path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            step = min(4096, end)
+            f.seek(end - step)
+            newline = f.read(step).rfind(b'\n')
+            if newline >= 0:
+                end = end - step + newline + 1
+                break
+            end -= step
+        if end < size:
+            f.truncate(end)
+        return size - end
+
+
+def resume_cursor(run_path, checkpoint, session, run, nb_trials):
+    """
+    (block, trial), 0-based, of the first trial still to run, from the last
+    committed one (in the CSV, or else the checkpoint); (0, 0) if none was.
+    """
+    row = last_committed_row(run_path, session, run)
+    if row is not None:
+        block, trial = int(row['Block']), int(row['Trial'])
+    elif checkpoint is not None:
+        block, trial = checkpoint['block'], checkpoint['trial']
+    else:
+        return 0, 0
+    return (block, 0) if trial >= nb_trials else (block - 1, trial)
@@ -0,0 +1,2 @@
+# test_joystick_frames.py is a hardware probe script, not a test
+collect_ignore = ['test_joystick_frames.py']
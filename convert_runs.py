@@ -0,0 +1,224 @@
+'''Converts legacy PMBR runs files, trajectories as repr strings, to the trajectory sidecar format.
+Usage:
+    python convert_runs.py Data --output Data_converted --jobs 4
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import argparse
+import ast
+import csv
+import os
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+from session_clock import countdown_to_ns
+from trajectory_store import MISSING_NS, TrajectoryWriter, trajectory_path, read_trajectories
+
+
+TRAJECTORY_COLUMNS = ('right_positions', 'left_positions', 'time')
+_STRIP = str.maketrans('', '', '[] ')
+
+csv.field_size_limit(sys.maxsize)
+
+
+def parse_list_column(cells, width=1):
+    """
+    Parses repr-encoded lists ('[[x, y], ...]' for width 2, '[t, ...]' for width 1).
+    'NA', '' and '0' cells hold no samples.
+    Returns (values, counts): values is an (N, width) float64 array of all samples
+    and counts[i] the number of samples of cell i.
+    """
+    stripped = ['' if c in ('', 'NA', '0') else c.translate(_STRIP) for c in cells]
+    counts = np.fromiter((s.count(',') + 1 if s else 0 for s in stripped), dtype=np.int64, count=len(stripped))
+    joined = ','.join(s for s in stripped if s)
+    values = np.array(joined.split(','), dtype=np.float64) if joined else np.empty(0)
+    if values.size != counts.sum():
+        raise ValueError('Malformed trajectory column')
+    if np.any(counts % width):
+        raise ValueError(f'Trajectory cells are not lists of {width}-element lists')
+    return values.reshape(-1, width), counts // width
+
+
+def read_legacy_runs(run_path):
+    with open(run_path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader)
+        rows = list(reader)
+    return header, rows
+
+
+def window_ns(countdown, duration=2.0):
+    """Legacy countdown times as ns since the window opened, MISSING_NS for NaN."""
+    countdown = np.asarray(countdown, dtype=np.float64)
+    finite = np.isfinite(countdown)
+    return np.where(finite, countdown_to_ns(np.where(finite, countdown, duration), 0, duration), MISSING_NS)
+
+
+def convert_subject(subject_path, output_path, duration=2.0):
+    """
+    Converts one subject folder. Returns (subject_id, number_of_trials, number_of_samples).
+    Rows are grouped per (Session, Run) into their own trajectory file; the
+    'time' column is optional (older files do not have it) and is stored as MISSING_NS
+    whenever it is missing or its length does not match the positions.
+    """
+    subject_path, output_path = Path(subject_path), Path(output_path)
+    subject_id = subject_path.name.split('_', 1)[1]
+    run_path = subject_path / f'S_{subject_id}_PMBR_runs.csv'
+    header, rows = read_legacy_runs(run_path)
+    col = {name: i for i, name in enumerate(header)}
+    scalar_cols = [name for name in header if name not in TRAJECTORY_COLUMNS]
+
+    right, right_n = parse_list_column([r[col['right_positions']] for r in rows], 2)
+    left, left_n = parse_list_column([r[col['left_positions']] for r in rows], 2)
+    if np.any(right_n != left_n):
+        raise ValueError(f'{run_path}: right and left trajectories differ in length')
+    if 'time' in col:
+        times, time_n = parse_list_column([r[col['time']] for r in rows], 1)
+        times = times[:, 0]
+    else:
+        times, time_n = np.empty(0), np.zeros(len(rows), dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(right_n)))
+    time_starts = np.concatenate(([0], np.cumsum(time_n)))
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    out_run_path = output_path / f'S_{subject_id}_PMBR_runs.csv'
+    writers = {}
+    try:
+        with open(out_run_path, 'w', newline='') as f:
+            w = csv.writer(f, lineterminator='\n')
+            w.writerow(scalar_cols + ['traj_offset', 'traj_length'])
+            for i, r in enumerate(rows):
+                scalars = [r[col[name]] for name in scalar_cols]
+                if r[col['right_positions']] == 'NA':
+                    w.writerow(scalars + ['NA', 'NA'])
+                    continue
+                key = (r[col['Session']], r[col['Run']])
+                if key not in writers:
+                    path = trajectory_path(output_path, subject_id, *key)
+                    path.unlink(missing_ok=True)
+                    writers[key] = TrajectoryWriter(path)
+                n = right_n[i]
+                if time_n[i] == n:
+                    t = window_ns(times[time_starts[i]:time_starts[i + 1]], duration)
+                else:
+                    t = np.full(n, MISSING_NS)
+                offset, length = writers[key].write(t, right[starts[i]:starts[i + 1]], left[starts[i]:starts[i + 1]])
+                w.writerow(scalars + [offset, length])
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return subject_id, len(rows), int(right_n.sum())
+
+
+def verify_subject(subject_path, output_path, duration=2.0):
+    """
+    Checks a converted subject against its legacy file, decoding every legacy cell
+    with ast.literal_eval. Returns a list of mismatch descriptions (empty when identical).
+    """
+    subject_path, output_path = Path(subject_path), Path(output_path)
+    subject_id = subject_path.name.split('_', 1)[1]
+    header, rows = read_legacy_runs(subject_path / f'S_{subject_id}_PMBR_runs.csv')
+    with open(output_path / f'S_{subject_id}_PMBR_runs.csv', newline='') as f:
+        converted = list(csv.DictReader(f))
+    errors = []
+    if len(converted) != len(rows):
+        return [f'S_{subject_id}: {len(rows)} legacy rows, {len(converted)} converted rows']
+    maps = {}
+    for i, (r, c) in enumerate(zip(rows, converted)):
+        legacy = dict(zip(header, r))
+        where = f'S_{subject_id} row {i + 1}'
+        for name, value in legacy.items():
+            if name not in TRAJECTORY_COLUMNS and c[name] != value:
+                errors.append(f'{where}: {name} {value!r} != {c[name]!r}')
+        if legacy['right_positions'] == 'NA':
+            if c['traj_offset'] != 'NA':
+                errors.append(f'{where}: expected no trajectory')
+            continue
+        key = (c['Session'], c['Run'])
+        if key not in maps:
+            maps[key] = read_trajectories(trajectory_path(output_path, subject_id, *key))
+        offset, length = int(c['traj_offset']), int(c['traj_length'])
+        records = maps[key][offset:offset + length]
+        for side in ('right', 'left'):
+            expected = np.array(ast.literal_eval(legacy[side + '_positions']), dtype=np.float32).reshape(-1, 2)
+            if not np.array_equal(records[side], expected):
+                errors.append(f'{where}: {side}_positions differ')
+        if 'time' in legacy and legacy['time'] not in ('', 'NA', '0'):
+            expected = np.array(ast.literal_eval(legacy['time']), dtype=np.float64)
+            if len(expected) == length and not np.array_equal(records['t_ns'], window_ns(expected, duration)):
+                errors.append(f'{where}: time differs')
+    return errors
+
+
+def upgrade_runs(run_path, fieldnames):
+    """
+    Rewrites a runs CSV of an earlier version of the task with the columns `fieldnames`, in place:
+    trajectories stored as text go to sidecar files (see convert_subject), columns the file
+    does not have are 'NA'. The original is renamed S_<ID>_PMBR_runs.<date>.bak. Returns the backup path.
+    """
+    run_path = Path(run_path)
+    subject_path = run_path.parent
+    backup = run_path.with_name(f'{run_path.stem}.{datetime.now():%Y%m%d-%H%M%S}.bak')
+    header, _ = read_legacy_runs(run_path)
+    with tempfile.TemporaryDirectory(dir=subject_path) as converted:
+        source = run_path
+        if 'right_positions' in header:
+            convert_subject(subject_path, converted)
+            errors = verify_subject(subject_path, converted)
+            if errors:
+                raise ValueError(f'{run_path} could not be converted: {errors[0]}')
+            for path in Path(converted).glob('*_trajectories.bin'):
+                os.replace(path, subject_path / path.name)
+            source = Path(converted) / run_path.name
+        upgraded = Path(converted) / 'upgraded.csv'
+        with open(source, newline='') as f, open(upgraded, 'w', newline='') as out:
+            w = csv.DictWriter(out, fieldnames, restval='NA', extrasaction='ignore', lineterminator='\n')
+            w.writeheader()
+            w.writerows(csv.DictReader(f))
+        os.rename(run_path, backup)
+        os.replace(upgraded, run_path)
+    return backup
+
+
+def _convert_and_verify(subject_path, output_path, verify):
+    subject_id, n_trials, n_samples = convert_subject(subject_path, output_path)
+    errors = verify_subject(subject_path, output_path) if verify else []
+    return subject_id, n_trials, n_samples, errors
+
+
+def subject_folders(data_path):
+    """Subject folders that have a runs file, sorted by subject number."""
+    folders = [p for p in Path(data_path).glob('Subject_*')
+               if (p / f'S_{p.name.split("_", 1)[1]}_PMBR_runs.csv').exists()]
+    return sorted(folders, key=lambda p: int(p.name.split('_', 1)[1]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert legacy PMBR runs files to the trajectory sidecar format')
+    parser.add_argument('data', nargs='?', default='Data', help='folder holding the Subject_* folders')
+    parser.add_argument('-o', '--output', default='Data_converted', help='output folder, mirrors the Subject_* layout')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('--skip-verify', action='store_true', help='do not check the converted output against the legacy files')
+    args = parser.parse_args(argv)
+
+    folders = subject_folders(args.data)
+    outputs = [Path(args.output) / p.name for p in folders]
+    failed = False
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        results = pool.map(_convert_and_verify, folders, outputs, [not args.skip_verify] * len(folders))
+        for subject_id, n_trials, n_samples, errors in results:
+            status = 'ok' if not errors else f'{len(errors)} mismatches'
+            print(f'S_{subject_id}: {n_trials} trials, {n_samples} samples, {status}')
+            for error in errors[:10]:
+                print(f'    {error}')
+            failed |= bool(errors)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
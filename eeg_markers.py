@@ -0,0 +1,179 @@
+'''EEG trigger markers for the PMBR task, sent from a worker thread and logged with their latency.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import csv
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+MARKER_CODES = {
+    'press_message': 10,        # PRESS shown
+    'button_press': 11,         # Trigger button pressed
+    'enlarge_right': 20,        # Right joystick image enlarged
+    'enlarge_left': 21,
+    'movement_onset_right': 30, # First sample of the movement, as detected by the trial logic
+    'movement_onset_left': 31,
+    'endpoint_right': 40,       # Stick beyond the endpoint threshold
+    'endpoint_left': 41,
+}
+
+MARKER_FIELDS = ['Marker', 'Code', 'Block', 'Trial', 'Call_ns', 'Emit_ns', 'Latency_us', 'Sample_ns']
+
+
+def marker_path(subject_path, subject_id, session, run):
+    return Path(subject_path) / f'S_{subject_id}_PMBR_ses{session}_run{run}_markers.csv'
+
+
+class LoopbackBackend:
+    """Keeps (perf_counter_ns, code) of every write in memory."""
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, code):
+        self.writes.append((time.perf_counter_ns(), code))
+
+    def close(self):
+        pass
+
+
+class FileBackend:
+    """Appends one 'perf_counter_ns,code' line per write."""
+
+    def __init__(self, path):
+        self._file = open(path, 'a')
+
+    def write(self, code):
+        self._file.write(f'{time.perf_counter_ns()},{code}\n')
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+class ParallelPortBackend:
+    """Writes the code on the data lines of a parallel port."""
+
+    def __init__(self, address=0x0378):
+        from psychopy import parallel
+        self.port = parallel.ParallelPort(address=address)
+        self.port.setData(0)
+
+    def write(self, code):
+        self.port.setData(code)
+
+    def close(self):
+        self.port.setData(0)
+
+
+class PulseBackend:
+    """Single-channel trigger device with start()/stop(), as driven by the old EEG_marker: every code is one pulse."""
+
+    def __init__(self, device):
+        self.device = device
+
+    def write(self, code):
+        if code:
+            self.device.start()
+        else:
+            self.device.stop()
+
+    def close(self):
+        self.device.stop()
+
+
+def make_backend(spec):
+    """Backend from a command line spec: 'loopback', 'file:PATH' or 'parallel[:ADDRESS]'."""
+    kind, _, argument = spec.partition(':')
+    if kind == 'loopback':
+        return LoopbackBackend()
+    if kind == 'file':
+        return FileBackend(argument)
+    if kind == 'parallel':
+        return ParallelPortBackend(int(argument, 0)) if argument else ParallelPortBackend()
+    raise ValueError(f'unknown marker backend {spec!r}')
+
+
+class MarkerSender:
+    """
+    Sends markers without blocking the caller.
+
+    send() stamps the call on `clock` and queues the marker; the worker writes
+    the code, stamps the write, holds the code for `pulse` seconds and writes
+    0. A marker sent while the previous pulse is still held waits for it, which
+    shows in its latency. With threaded=False the code and the reset are
+    written on the caller's thread, with no pulse width (virtual clock runs).
+    The log is appended to `path` on close() (nothing is saved when path is None).
+    """
+
+    def __init__(self, backend, path=None, clock=time.perf_counter_ns, pulse=0.002, threaded=True):
+        self.backend = backend
+        self.path = Path(path) if path is not None else None
+        self.clock = clock
+        self.pulse = pulse
+        self.threaded = threaded
+        self.log = []
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        if threaded:
+            self._thread = threading.Thread(target=self._run, name='MarkerSender', daemon=True)
+            self._thread.start()
+
+    def send(self, marker, block=0, trial=0, sample_ns=None):
+        """
+        Emits `marker` (a MARKER_CODES name) as soon as possible. sample_ns is the
+        session time of the sample that triggered it, for markers of detected events.
+        """
+        item = (marker, MARKER_CODES[marker], block, trial, self.clock(), sample_ns)
+        if self.threaded:
+            self._queue.put(item)
+        else:
+            self._emit(item)
+
+    def _emit(self, item):
+        marker, code, block, trial, call_ns, sample_ns = item
+        emit_ns = self.clock()
+        self.backend.write(code)
+        self.log.append((marker, code, block, trial, call_ns, emit_ns, (emit_ns - call_ns) / 1000,
+                         'NA' if sample_ns is None else sample_ns))
+        if self.threaded:
+            time.sleep(self.pulse)
+        self.backend.write(0)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            self._emit(item)
+
+    def latencies_us(self):
+        return np.array([row[6] for row in self.log])
+
+    def summary(self):
+        latency = self.latencies_us()
+        if not len(latency):
+            return {'markers': 0}
+        return {'markers': len(latency), 'latency_median_us': float(np.median(latency)),
+                'latency_p99_us': float(np.percentile(latency, 99)), 'latency_max_us': float(latency.max())}
+
+    def close(self):
+        """Emits what is still queued, then saves the log and closes the backend."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+        if self.path is not None and self.log:
+            new_file = not os.path.exists(self.path)
+            with open(self.path, 'a', newline='') as f:
+                w = csv.writer(f, lineterminator='\n')
+                if new_file:
+                    w.writerow(MARKER_FIELDS)
+                w.writerows(self.log)
+        self.backend.close()
@@ -0,0 +1,186 @@
+'''Per-flip frame timing for the PMBR task, with the late flips and dropped frames of each trial.
+Usage:
+    python frame_timing.py Data/Subject_12/S_12_PMBR_ses1_run1_frames.bin
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+
+# One record per flip: request and return stamps (session ns), trial and phase code
+FRAME_DTYPE = np.dtype([('request', '<i8'), ('flip', '<i8'), ('block', '<i2'), ('trial', '<i2'), ('phase', 'u1')])
+
+PHASES = ('other', 'instructions', 'countdown', 'trial_start', 'press', 'isi', 'onset', 'window',
+          'buffer', 'block_end', 'break')
+PHASE_CODES = {name: code for code, name in enumerate(PHASES)}
+
+# Phases whose flips follow each other with no intended wait in between
+CONTINUOUS_PHASES = ('press', 'buffer')
+
+
+def frame_path(subject_path, subject_id, session, run):
+    return Path(subject_path) / f'S_{subject_id}_PMBR_ses{session}_run{run}_frames.bin'
+
+
+def late_and_dropped(records, frame_period, tolerance=0.5):
+    """
+    (late, dropped) per record: whether the flip missed its vertical blank and
+    how many frames were dropped before it (0 outside continuous phases and for
+    the first flip of a phase).
+    """
+    period_ns = frame_period * 1e9
+    limit = period_ns * (1 + tolerance)
+    late = (records['flip'] - records['request']) > limit
+    dropped = np.zeros(len(records), dtype=np.int64)
+    if len(records) > 1:
+        interval = np.diff(records['flip'])
+        continuous = np.isin(records['phase'], [PHASE_CODES[p] for p in CONTINUOUS_PHASES])
+        same = ((records['phase'][1:] == records['phase'][:-1]) & (records['trial'][1:] == records['trial'][:-1])
+                & (records['block'][1:] == records['block'][:-1]) & continuous[1:])
+        missed = np.rint(interval / period_ns).astype(np.int64) - 1
+        dropped[1:] = np.where(same & (interval > limit), np.maximum(missed, 0), 0)
+    return late, dropped
+
+
+class FrameRecorder:
+    """
+    Records every flip of a window with its block, trial and phase.
+
+    attach(win) replaces win.flip by a wrapper, so every flip of the task is
+    recorded without touching the call sites; set_phase() and begin_trial()
+    change the tags of the following flips. Records live in a preallocated
+    array; flush() appends the ones not saved yet to `path` (nothing is saved
+    when path is None, e.g. practice runs). Callables in `listeners` get each
+    new record right after the flip (e.g. TelemetryPublisher.publish_flip).
+    """
+
+    def __init__(self, path=None, clock=time.perf_counter_ns, capacity=2**16, frame_period=1 / 60):
+        self.path = Path(path) if path is not None else None
+        self.clock = clock
+        self.frame_period = frame_period
+        self.records = np.zeros(capacity, dtype=FRAME_DTYPE)
+        self.n = 0
+        self.block = 0
+        self.trial = 0
+        self.phase = PHASE_CODES['other']
+        self._trial_start = 0
+        self._saved = 0 # Records [0, _saved) are already in the file
+        self._file = open(self.path, 'ab') if self.path is not None else None
+        self._window = None
+        self._flip = None
+        self.listeners = []
+
+    def attach(self, win):
+        """Records the flips of `win` from now on, the frame period is taken from the window."""
+        self._window, self._flip = win, win.flip
+        self.frame_period = getattr(win, 'monitorFramePeriod', None) or self.frame_period
+        clock, flip = self.clock, win.flip
+
+        def recorded_flip(*args, **kwargs):
+            request = clock()
+            result = flip(*args, **kwargs)
+            self._append(request, clock())
+            return result
+
+        win.flip = recorded_flip
+
+    def detach(self):
+        if self._window is not None:
+            self._window.flip = self._flip
+            self._window = self._flip = None
+
+    def _append(self, request, flip):
+        if self.n == len(self.records):
+            self._make_room()
+        self.records[self.n] = (request, flip, self.block, self.trial, self.phase)
+        for listener in self.listeners:
+            listener(self.records[self.n])
+        self.n += 1
+
+    def _make_room(self):
+        """Saves what can be saved and keeps only the current trial, or doubles the array when nothing can go."""
+        self.flush()
+        keep = self._trial_start if self._file is not None else 0
+        if keep == 0:
+            self.records = np.concatenate((self.records, np.zeros_like(self.records)))
+            return
+        self.records[:self.n - keep] = self.records[keep:self.n]
+        self.n -= keep
+        self._saved -= keep
+        self._trial_start = 0
+
+    def set_phase(self, phase):
+        self.phase = PHASE_CODES[phase]
+
+    def begin_trial(self, block, trial, phase='trial_start'):
+        self.block, self.trial = block, trial
+        self._trial_start = self.n
+        self.set_phase(phase)
+
+    def trial_summary(self, tolerance=0.5):
+        """(late flips, dropped frames) of the flips since begin_trial()."""
+        late, dropped = late_and_dropped(self.records[self._trial_start:self.n], self.frame_period, tolerance)
+        return int(late.sum()), int(dropped.sum())
+
+    def flush(self):
+        if self._file is None:
+            self._saved = self.n
+            return
+        self.records[self._saved:self.n].tofile(self._file)
+        self._file.flush()
+        self._saved = self.n
+
+    def close(self):
+        self.detach()
+        self.flush()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_frames(path):
+    """Memory map of a frames file, an empty record array if the file is empty."""
+    if Path(path).stat().st_size == 0:
+        return np.zeros(0, dtype=FRAME_DTYPE)
+    return np.memmap(path, dtype=FRAME_DTYPE, mode='r')
+
+
+def frame_report(records, frame_period=None, tolerance=0.5):
+    """
+    Per (Block, Trial) flips, late flips, dropped frames and longest continuous-phase
+    interval in ms, as a pandas DataFrame. The frame period defaults to the
+    median interval of the continuous phases.
+    """
+    import pandas as pd
+    records = np.asarray(records)
+    if frame_period is None:
+        continuous = np.isin(records['phase'], [PHASE_CODES[p] for p in CONTINUOUS_PHASES])
+        intervals = np.diff(records['flip'])[continuous[1:] & continuous[:-1]]
+        frame_period = np.median(intervals) * 1e-9 if len(intervals) else 1 / 60
+    late, dropped = late_and_dropped(records, frame_period, tolerance)
+    interval = np.diff(records['flip'], prepend=records['flip'][:1]) * 1e-6
+    frame = pd.DataFrame({'Block': records['block'], 'Trial': records['trial'], 'late': late, 'dropped': dropped,
+                          'interval': np.where(dropped > 0, interval, 0.0)})
+    grouped = frame.groupby(['Block', 'Trial'])
+    return pd.DataFrame({'flips': grouped.size(), 'late_flips': grouped['late'].sum(),
+                         'dropped_frames': grouped['dropped'].sum(),
+                         'worst_drop_ms': grouped['interval'].max()}).reset_index()
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    for path in argv:
+        report = frame_report(read_frames(path))
+        print(path)
+        print(report[(report['late_flips'] > 0) | (report['dropped_frames'] > 0)].to_string(index=False))
+        print(f"{report['late_flips'].sum()} late flips, {report['dropped_frames'].sum()} dropped frames "
+              f"in {len(report)} trials")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
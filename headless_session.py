@@ -0,0 +1,417 @@
+'''Headless runs of the PMBR task on a virtual clock, with a simulated participant.
+Usage:
+    python headless_session.py --data /tmp/headless --blocks 20 --trials 27
+    python headless_session.py --data /tmp/headless --replay Data_converted/Subject_12 12
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import argparse
+import functools
+import importlib
+import importlib.util
+import inspect
+import sys
+import time
+import types
+from datetime import datetime
+
+import numpy as np
+
+from audio_cues import AudioCueCache
+from eeg_markers import MarkerSender
+from joystick_acquisition import JoystickAcquisition
+from session_clock import SessionClock
+from session_recording import SessionRecorder
+from telemetry import TelemetryPublisher
+from trajectory_store import load_subject_trials
+from virtual_joystick import ReplayTrack, VirtualJoystick, tracks_from_trajectory
+
+
+class VirtualClock:
+    """
+    Seconds of task time, moved only by the task itself: advance() jumps it
+    (core.wait, win.flip) and every poll of a countdown timer costs
+    `poll_cost` seconds, so busy loops such as `while timer.getTime() > 0`
+    run in as many iterations as the duration allows and no more.
+    The run is deterministic and independent of the speed of the machine.
+    """
+
+    def __init__(self, poll_cost=0.001):
+        self.poll_cost = poll_cost
+        self._t = 0.0
+
+    def time(self):
+        return self._t
+
+    def advance(self, seconds):
+        if seconds > 0:
+            self._t += seconds
+
+    def poll(self):
+        self._t += self.poll_cost
+        return self._t
+
+
+class VirtualSessionClock(SessionClock):
+    """SessionClock reading a VirtualClock, so samples, flips and trial events share the virtual timebase."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.origin_ns = 0
+        self.wall_origin = datetime.now()
+
+    def now_ns(self):
+        return int(self.clock.time() * 1e9)
+
+    def now(self):
+        return self.clock.time()
+
+
+# ---------------------------------------------------------------------------
+# Null psychopy / pyglet surface used by PMBR.py
+
+
+class NullStim:
+    """Accepts any stimulus arguments, draws nothing."""
+
+    def __init__(self, win=None, text='', size=(1.0, 1.0), **kwargs):
+        self.win = win
+        self.text = text
+        self.size = np.array(size, dtype=float)
+        self.autoDraw = False
+        self.__dict__.update(kwargs)
+
+    def draw(self, win=None):
+        pass
+
+    def setAutoDraw(self, value):
+        self.autoDraw = value
+
+    def setText(self, text):
+        self.text = text
+
+
+class NullWindow:
+    """Window whose flip() takes one frame of virtual time, flips are counted."""
+
+    def __init__(self, clock, frame_rate=60.0, **kwargs):
+        self.clock = clock
+        self.frame_period = self.monitorFramePeriod = 1.0 / frame_rate
+        self.flips = 0
+
+    def flip(self, clearBuffer=True):
+        self.clock.advance(self.frame_period)
+        self.flips += 1
+        return self.clock.time()
+
+    def clearBuffer(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class NullSound:
+    def __init__(self, value='A', secs=0.1, **kwargs):
+        self.secs = secs
+
+    def play(self, **kwargs):
+        pass
+
+    def stop(self):
+        pass
+
+
+class NullMouse:
+    def __init__(self, visible=True, **kwargs):
+        self.visible = visible
+
+    def setPos(self, pos):
+        pass
+
+
+def make_core(clock):
+    """psychopy.core equivalent on the virtual clock."""
+    core = types.ModuleType('psychopy.core')
+
+    class Clock:
+        def __init__(self):
+            self._start = clock.time()
+
+        def getTime(self):
+            return clock.time() - self._start
+
+        def reset(self, newT=0.0):
+            self._start = clock.time() + newT
+
+    class CountdownTimer(Clock):
+        def __init__(self, start=0):
+            super().__init__()
+            self._duration = start
+
+        def getTime(self):
+            return self._duration - (clock.poll() - self._start)
+
+        def reset(self, t=None):
+            if t is not None:
+                self._duration = t
+            self._start = clock.time()
+
+    def quit():
+        raise SystemExit
+
+    core.Clock, core.MonotonicClock, core.CountdownTimer = Clock, Clock, CountdownTimer
+    core.wait = lambda secs, hogCPUperiod=0.2: clock.advance(secs)
+    core.getTime = clock.time
+    core.quit = quit
+    return core
+
+
+def make_modules(clock, participant):
+    """(psychopy, pyglet) module objects holding the parts of their API the task uses."""
+    psychopy = types.ModuleType('psychopy')
+    psychopy.core = make_core(clock)
+    psychopy.visual = types.ModuleType('psychopy.visual')
+    psychopy.visual.Window = lambda *args, **kwargs: NullWindow(clock, **kwargs)
+    for name in ('TextStim', 'ImageStim', 'Rect', 'Circle'):
+        setattr(psychopy.visual, name, NullStim)
+    psychopy.event = types.ModuleType('psychopy.event')
+    psychopy.event.getKeys = lambda *args, **kwargs: []
+    psychopy.event.waitKeys = lambda keyList=None, **kwargs: ['space'] # Instructions are skipped at once
+    psychopy.event.Mouse = NullMouse
+    psychopy.sound = types.ModuleType('psychopy.sound')
+    psychopy.sound.Sound = NullSound
+    psychopy.tools = types.ModuleType('psychopy.tools')
+    psychopy.gui = types.ModuleType('psychopy.gui')
+    psychopy.hardware = types.ModuleType('psychopy.hardware')
+    psychopy.hardware.joystick = types.ModuleType('psychopy.hardware.joystick')
+    psychopy.hardware.joystick.Joystick = lambda i: participant.joysticks[i]
+
+    pyglet = types.ModuleType('pyglet')
+    pyglet.input = types.SimpleNamespace(get_joysticks=lambda: list(participant.joysticks))
+    pyglet.app = types.SimpleNamespace(platform_event_loop=types.SimpleNamespace(dispatch_posted_events=lambda: None))
+    pyglet.clock = types.SimpleNamespace(tick=lambda: 0.0)
+    return psychopy, pyglet
+
+
+def _missing(name):
+    """Whether the real library `name` is not installed (a null module of an earlier run does not count)."""
+    module = sys.modules.get(name)
+    if module is not None:
+        return module.__spec__ is None
+    return importlib.util.find_spec(name) is None
+
+
+def load_task(psychopy, pyglet):
+    """
+    Imports PMBR.py and points its psychopy/pyglet globals at the null modules.
+    When the real libraries are missing, the null modules are registered under
+    their names first (replacing those of an earlier run, bound to its clock)
+    so the import itself and the task's local imports succeed.
+    """
+    if _missing('psychopy'):
+        modules = {'psychopy': psychopy, 'psychopy.hardware': psychopy.hardware,
+                   'psychopy.hardware.joystick': psychopy.hardware.joystick}
+        for name in ('core', 'visual', 'event', 'sound', 'tools', 'gui'):
+            modules['psychopy.' + name] = getattr(psychopy, name)
+        sys.modules.update(modules)
+    if _missing('pyglet'):
+        sys.modules['pyglet'] = pyglet
+    task = importlib.import_module('PMBR')
+    task.core, task.visual, task.event, task.sound = psychopy.core, psychopy.visual, psychopy.event, psychopy.sound
+    task.joystick = psychopy.hardware.joystick
+    task.pyglet = pyglet
+    task.JoystickAcquisition = SteppedAcquisition
+    # The stepped acquisition is filled by its readers, the recording and telemetry drain it on the task thread
+    task.SessionRecorder = functools.partial(SessionRecorder, threaded=False)
+    task.TelemetryPublisher = functools.partial(TelemetryPublisher, threaded=False)
+    task.MarkerSender = functools.partial(MarkerSender, threaded=False)
+    task.AudioCueCache = functools.partial(AudioCueCache, backend='psychopy') # Null sounds, no audio device
+    return task
+
+
+class SteppedAcquisition(JoystickAcquisition):
+    """
+    JoystickAcquisition without a thread, for the virtual clock.
+
+    Virtual time only moves when the main thread acts, so a sampler thread
+    would see it jump. Instead, the buffer is filled on demand: whenever the
+    trial logic asks for the cursor or for new samples, the samples of every
+    period elapsed since the last fill are written in one batch, with the
+    stick state at each instant.
+    """
+
+    def __init__(self, joystick_right, joystick_left, rate=1000, capacity=2**15, clock=None, **kwargs):
+        super().__init__(joystick_right, joystick_left, rate, capacity, clock, **kwargs)
+        self.period = 1_000_000_000 // rate
+        self._next_t = None
+
+    def start(self):
+        self._next_t = self.clock()
+
+    def stop(self):
+        pass
+
+    def _fill(self):
+        now = self.clock()
+        start = max(self._next_t, now - (self.buffer.capacity - 1) * self.period)
+        times = np.arange(start, now + 1, self.period, dtype=np.int64)
+        if len(times):
+            seconds = times * 1e-9
+            right = self.joystick_right.axes_at(seconds)[:, :2]
+            left = self.joystick_left.axes_at(seconds)[:, :2]
+            self.buffer.extend(times, right, left)
+            self.polls += len(times)
+            self._next_t = int(times[-1]) + self.period
+
+    def cursor(self):
+        self._fill()
+        return self.buffer.write_count
+
+    def read_since(self, cursor):
+        self._fill()
+        return super().read_since(cursor)
+
+
+# ---------------------------------------------------------------------------
+# Simulated participant
+
+
+class SimulatedParticipant:
+    """
+    Drives two virtual joysticks (index 0 right, 1 left) from the task's own calls:
+    before each press window the trigger is scheduled after a normal RT (or
+    missed with probability `miss_rate`), before each joystick window the
+    sticks restart on a new movement, pushing the enlarged stick (or the
+    other one with probability `error_rate`) and releasing it after `hold`.
+    Movements are minimum-jerk pushes to -1, or recorded trials given as
+    (right, left) track pairs, replayed in turn.
+    """
+
+    def __init__(self, clock, seed=0, press_rt=(0.35, 0.05), onset=(0.35, 0.08), movement_time=0.25,
+                 hold=0.3, miss_rate=0.05, error_rate=0.05, trials=None):
+        self.rng = np.random.default_rng(seed)
+        self.press_rt = press_rt
+        self.onset = onset
+        self.movement_time = movement_time
+        self.hold = hold
+        self.miss_rate = miss_rate
+        self.error_rate = error_rate
+        self.trials = trials
+        self._next_trial = 0
+        rest = ReplayTrack([0.0], [[0.0, 0.0]])
+        self.joysticks = (VirtualJoystick(rest, clock=clock.time, name='Virtual right'),
+                          VirtualJoystick(rest, clock=clock.time, name='Virtual left'))
+        for joy in self.joysticks:
+            joy.start()
+
+    def before_press(self, joy):
+        if self.rng.random() >= self.miss_rate:
+            joy.press(0, hold=0.1, delay=max(self.rng.normal(*self.press_rt), 0.06))
+
+    def _synthetic_push(self):
+        onset = max(self.rng.normal(*self.onset), 0.1)
+        s = np.linspace(0.0, 1.0, 30)
+        times = np.concatenate(([0.0], onset + s * self.movement_time, [onset + self.movement_time + self.hold]))
+        y = np.concatenate(([0.0], -(10 * s**3 - 15 * s**4 + 6 * s**5), [0.0]))
+        return ReplayTrack(times, np.column_stack((np.zeros_like(y), y)))
+
+    def before_window(self, correct_rect):
+        rest = ReplayTrack([0.0], [[0.0, 0.0]])
+        if self.trials:
+            right, left = self.trials[self._next_trial % len(self.trials)]
+            self._next_trial += 1
+            release = right.duration + self.hold
+            right = ReplayTrack(np.append(right.times, release), np.vstack((right.axes, [0.0, 0.0])))
+            left = ReplayTrack(np.append(left.times, release), np.vstack((left.axes, [0.0, 0.0])))
+        else:
+            side = correct_rect
+            if self.rng.random() < self.error_rate:
+                side = 'left' if correct_rect == 'right' else 'right'
+            push = self._synthetic_push()
+            right, left = (push, rest) if side == 'right' else (rest, push)
+        for joy, track in zip(self.joysticks, (right, left)):
+            joy.track = track
+            joy.start()
+
+    def attach(self, task):
+        """
+        Wraps the task's wait functions so the participant acts when each window opens.
+        The wrappers of a participant attached earlier (a previous run in this process) are replaced.
+        """
+        wait_b_pressed = inspect.unwrap(task.wait_b_pressed)
+        wait_joystick_pushed = inspect.unwrap(task.wait_joystick_pushed)
+
+        @functools.wraps(wait_b_pressed)
+        def simulated_wait_b_pressed(joy, *args, **kwargs):
+            self.before_press(joy)
+            return wait_b_pressed(joy, *args, **kwargs)
+
+        @functools.wraps(wait_joystick_pushed)
+        def simulated_wait_joystick_pushed(*args, correct_rect=None, **kwargs):
+            self.before_window(correct_rect)
+            return wait_joystick_pushed(*args, correct_rect=correct_rect, **kwargs)
+
+        task.wait_b_pressed = simulated_wait_b_pressed
+        task.wait_joystick_pushed = simulated_wait_joystick_pushed
+
+
+def run_headless(params, data_path, poll_cost=0.001, frame_rate=60.0, seed=0, trials=None, resume=False,
+                 **participant_options):
+    """
+    Runs one session of the task headless and returns a summary: virtual and
+    wall durations, flips and the trial writer statistics.
+    `params` holds what the dialog would return (ID, Session, Run, NbBlocks, NbTrials, Set).
+    With resume, the run continues after its last committed trial, as python PMBR.py --resume.
+    """
+    clock = VirtualClock(poll_cost)
+    participant = SimulatedParticipant(clock, seed=seed, trials=trials, **participant_options)
+    psychopy, pyglet = make_modules(clock, participant)
+    task = load_task(psychopy, pyglet)
+    participant.attach(task)
+
+    wall0 = time.perf_counter()
+    params = dict(params)
+    task.start_session(params, data_path, clock=VirtualSessionClock(clock), resume=resume)
+    window = NullWindow(clock, frame_rate)
+    result = task.run_session(params, window)
+    wall = time.perf_counter() - wall0
+    summary = {'result': result, 'virtual_s': clock.time(), 'wall_s': wall, 'flips': window.flips,
+               'run_path': str(task.run_path)}
+    if task.trial_writer is not None:
+        summary.update(task.trial_writer.stats())
+    return summary
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run a PMBR session headless, with a virtual clock and a simulated participant')
+    parser.add_argument('--data', default='Data_headless', help='folder receiving the Subject_* output')
+    parser.add_argument('--id', type=int, default=999)
+    parser.add_argument('--session', type=int, default=1)
+    parser.add_argument('--run', type=int, default=1)
+    parser.add_argument('--blocks', type=int, default=20)
+    parser.add_argument('--trials', type=int, default=27)
+    parser.add_argument('--practice', action='store_true')
+    parser.add_argument('--poll-cost', type=float, default=0.001, help='virtual seconds per pass of a busy loop')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--resume', action='store_true', help='continue the run after its last committed trial')
+    parser.add_argument('--replay', nargs=2, metavar=('SUBJECT_PATH', 'ID'), help='replay the stored trials of a converted subject')
+    args = parser.parse_args(argv)
+
+    trials = None
+    if args.replay:
+        stored = load_subject_trials(args.replay[0], int(args.replay[1]))
+        trials = [tracks_from_trajectory(*stored[key]) for key in sorted(stored)]
+    params = {'ID': args.id, 'Session': args.session, 'Run': args.run, 'NbBlocks': args.blocks,
+              'NbTrials': args.trials, 'Set': 'Practice' if args.practice else 'Standard'}
+    summary = run_headless(params, args.data, poll_cost=args.poll_cost, seed=args.seed, trials=trials,
+                           resume=args.resume)
+    print(f"{summary['virtual_s']:.0f} s of task in {summary['wall_s']:.2f} s "
+          f"({summary['virtual_s'] / summary['wall_s']:.0f}x), {summary['flips']} flips")
+    for key, value in summary.items():
+        print(f'  {key}: {value}')
+    return 0 if summary['result'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
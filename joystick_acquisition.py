@@ -0,0 +1,236 @@
+'''Background joystick acquisition for the PMBR task.
+A sampler thread polls both sticks into a ring buffer, trials read the samples of their window from it.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import threading
+import time
+
+import numpy as np
+
+
+class JoystickRingBuffer:
+    """
+    Single-producer ring buffer of joystick samples.
+
+    Each sample holds an int64 ns timestamp and (x, y) for the right and left stick.
+    The writer fills a slot and only then bumps `write_count`, so readers
+    never need a lock: every index below `write_count` is fully written, and
+    a reader detects that it was lapped by re-checking the counter after copying.
+    """
+
+    def __init__(self, capacity=2**15):
+        if capacity & (capacity - 1):
+            raise ValueError('capacity must be a power of two')
+        self.capacity = capacity
+        self._mask = capacity - 1
+        self.times = np.zeros(capacity, dtype=np.int64)
+        self.right = np.zeros((capacity, 2), dtype=np.float32)
+        self.left = np.zeros((capacity, 2), dtype=np.float32)
+        self.write_count = 0
+        self.overruns = 0
+
+    def push(self, t, right_x, right_y, left_x, left_y):
+        i = self.write_count & self._mask
+        self.times[i] = t
+        self.right[i] = (right_x, right_y)
+        self.left[i] = (left_x, left_y)
+        self.write_count += 1 # Publish the slot only once it is complete
+
+    def extend(self, times, right, left):
+        """Writes a batch of samples, (n,) times and (n, 2) right/left positions, as push() would one by one."""
+        n = len(times)
+        if n > self.capacity: # Only the last `capacity` samples can survive anyway
+            skipped = n - self.capacity
+            times, right, left = times[skipped:], right[skipped:], left[skipped:]
+            self.write_count += skipped
+            n = self.capacity
+        i0 = self.write_count & self._mask
+        first = min(n, self.capacity - i0)
+        self.times[i0:i0 + first] = times[:first]
+        self.right[i0:i0 + first] = right[:first]
+        self.left[i0:i0 + first] = left[:first]
+        if first < n:
+            self.times[:n - first] = times[first:]
+            self.right[:n - first] = right[first:]
+            self.left[:n - first] = left[first:]
+        self.write_count += n
+
+    def latest(self):
+        """Returns (t, right_xy, left_xy) of the most recent sample, or None if empty."""
+        count = self.write_count
+        if count == 0:
+            return None
+        i = (count - 1) & self._mask
+        return self.times[i], self.right[i].copy(), self.left[i].copy()
+
+    def read(self, start, stop=None):
+        """
+        Copies samples [start, stop) out of the buffer.
+        Returns (times, right_positions, left_positions) as new arrays.
+        Samples that were already overwritten are skipped and counted in `overruns`.
+        """
+        if stop is None:
+            stop = self.write_count
+        oldest = stop - self.capacity
+        if start < oldest:
+            self.overruns += oldest - start
+            start = oldest
+        n = max(stop - start, 0)
+        times = np.empty(n, dtype=np.int64)
+        right = np.empty((n, 2), dtype=np.float32)
+        left = np.empty((n, 2), dtype=np.float32)
+        if n:
+            i0 = start & self._mask
+            first = min(n, self.capacity - i0)
+            times[:first] = self.times[i0:i0 + first]
+            right[:first] = self.right[i0:i0 + first]
+            left[:first] = self.left[i0:i0 + first]
+            if first < n:
+                times[first:] = self.times[:n - first]
+                right[first:] = self.right[:n - first]
+                left[first:] = self.left[:n - first]
+            # The writer may have lapped us while copying, and may be filling slot write_count right now
+            lapped = self.write_count + 1 - self.capacity - start
+            if lapped > 0:
+                self.overruns += lapped
+                times, right, left = times[lapped:], right[lapped:], left[lapped:]
+        return times, right, left
+
+
+class JoystickAcquisition:
+    """
+    Polls two pyglet joysticks from a background thread into a JoystickRingBuffer.
+
+    `clock` returns int64 nanoseconds, normally SessionClock.now_ns, so samples
+    share the timebase of flips and trial events. The thread paces itself on
+    that clock: it sleeps until `spin_ns` before each deadline and only yields
+    for the rest, since a sleep can overshoot (by several ms on Windows).
+    Device state itself is still updated by the window's event loop
+    (win.flip / dispatch_posted_events), so keep pumping events on the main thread.
+
+    Between two pumps the device reads the same values again. With
+    `changes_only` such repeats are not stored: a sample is pushed when the
+    sticks moved, so its stamp is the first time the new state was seen, and
+    after refresh() so that a window starts with the current position.
+    stats() compares the polls with the samples kept, i.e. the effective rate.
+    """
+
+    def __init__(self, joystick_right, joystick_left, rate=1000, capacity=2**15, clock=time.perf_counter_ns,
+                 spin_ns=200_000, changes_only=False):
+        self.joystick_right = joystick_right
+        self.joystick_left = joystick_left
+        self.rate = rate
+        self.spin_ns = spin_ns
+        self.changes_only = changes_only
+        self.clock = clock
+        self.buffer = JoystickRingBuffer(capacity)
+        self.polls = 0
+        self._refresh = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def _read(self):
+        r, l = self.joystick_right, self.joystick_left
+        return (r.x or 0, r.y or 0, l.x or 0, l.y or 0)
+
+    def _poll_loop(self):
+        period = 1_000_000_000 // self.rate
+        push = self.buffer.push
+        read = self._read
+        clock = self.clock
+        spin_ns = self.spin_ns
+        changes_only = self.changes_only
+        refresh = self._refresh
+        last = None
+        next_t = clock()
+        while not self._stop_event.is_set():
+            now = clock()
+            if now < next_t:
+                # Sleep most of the wait, only yield the GIL for the last spin_ns
+                time.sleep(max(next_t - now - spin_ns, 0) * 1e-9)
+                continue
+            forced = refresh.is_set()
+            if forced:
+                refresh.clear() # Before the read, so the pushed state is never older than the request
+            sample = read()
+            if forced or sample != last or not changes_only:
+                push(now, *sample)
+                last = sample
+            self.polls += 1
+            next_t += period
+            if now - next_t > period: # Stalled for more than one period, resync instead of bursting
+                next_t = now + period
+
+    def start(self):
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._poll_loop, name='JoystickAcquisition', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+    def now(self):
+        return self.clock()
+
+    def refresh(self):
+        """Makes the next poll push a sample even if the sticks did not move."""
+        self._refresh.set()
+
+    def stats(self):
+        return {'polls': self.polls, 'samples': self.buffer.write_count, 'overruns': self.buffer.overruns}
+
+    def cursor(self):
+        """Position of the next sample to be written, use it to mark the start of a window."""
+        return self.buffer.write_count
+
+    def read_since(self, cursor):
+        """Returns (new_cursor, times, right_positions, left_positions) for samples written since `cursor`."""
+        stop = self.buffer.write_count
+        times, right, left = self.buffer.read(cursor, stop)
+        return stop, times, right, left
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class TrajectoryBuffer:
+    """
+    Preallocated storage for one trial window, sized for duration * max_rate samples.
+
+    append() writes in place with no per-sample allocation. If the device
+    outruns max_rate the arrays are doubled, so samples are never dropped.
+    views() returns (times, right_positions, left_positions) as views on the filled part.
+    """
+
+    def __init__(self, duration, max_rate=2000):
+        size = max(int(np.ceil(duration * max_rate)), 1)
+        self.times = np.empty(size, dtype=np.float64)
+        self.positions = np.empty((size, 4), dtype=np.float32)
+        self.n = 0
+
+    def append(self, t, right_x, right_y, left_x, left_y):
+        i = self.n
+        if i == len(self.times):
+            self._grow()
+        self.times[i] = t
+        self.positions[i] = (right_x, right_y, left_x, left_y)
+        self.n = i + 1
+
+    def _grow(self):
+        self.times = np.concatenate((self.times, np.empty_like(self.times)))
+        self.positions = np.concatenate((self.positions, np.empty_like(self.positions)))
+
+    def views(self):
+        n = self.n
+        return self.times[:n], self.positions[:n, :2], self.positions[:n, 2:]
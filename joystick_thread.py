@@ -2,6 +2,7 @@ import pygame
 import threading
 import time
 import csv
+from session_clock import SessionClock
 
 # Initialize pygame and joystick
 pygame.init()
@@ -15,7 +16,8 @@ joystick.init()
 
 print(f"Joystick initialized: {joystick.get_name()} with {joystick.get_numaxes()} axes")
 
-# Shared list for joystick data
+# Shared list for joystick data, stamped in session clock ns
+clock = SessionClock()
 joystick_data = []
 stop_flag = [False]
 
@@ -25,7 +27,7 @@ def poll_joystick():
         # Read all axes - here we take first two axes (usually X and Y)
         x = joystick.get_axis(0)
         y = joystick.get_axis(1)
-        timestamp = time.time()
+        timestamp = clock.now_ns()
         joystick_data.append((timestamp, x, y))
         time.sleep(0.001)  # ~1000 Hz polling
 
@@ -43,7 +45,7 @@ poll_thread.join()
 # Save data to CSV
 with open("joystick_pygame_data.csv", "w", newline="") as f:
     writer = csv.writer(f)
-    writer.writerow(["Timestamp", "X_axis", "Y_axis"])
+    writer.writerow(["Timestamp_ns", "X_axis", "Y_axis"])
     writer.writerows(joystick_data)
 
 print(f"Saved {len(joystick_data)} joystick samples to joystick_pygame_data.csv")
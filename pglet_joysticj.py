@@ -2,6 +2,7 @@ import pyglet
 import time
 import csv
 from psychopy import visual, core
+from session_clock import SessionClock
 
 # === Joystick Setup ===
 joysticks = pyglet.input.get_joysticks()
@@ -17,7 +18,7 @@ text = visual.TextStim(win, text='', pos=(0, 0), height=0.1, color='white')
 
 # === Data and Time Tracking ===
 joystick_data = []
-start_time = time.time()
+clock = SessionClock()
 
 # === Joystick Polling Function ===
 x_val = 0.0
@@ -25,7 +26,7 @@ y_val = 0.0
 
 def poll_joystick(dt):
     global x_val, y_val
-    timestamp = time.time()
+    timestamp = clock.now_ns()
     x_val = joystick.x if hasattr(joystick, 'x') else 0.0
     y_val = joystick.y if hasattr(joystick, 'y') else 0.0
     joystick_data.append((timestamp, x_val, y_val))
@@ -34,7 +35,7 @@ pyglet.clock.schedule_interval(poll_joystick, 0.001)
 
 # === Drawing Loop (runs independently of polling rate) ===
 def update_display(dt):
-    elapsed = time.time() - start_time
+    elapsed = clock.now()
     text.text = f"Time: {elapsed:.2f}s\nX: {x_val:.3f}  Y: {y_val:.3f}"
     text.draw()
     win.flip()
@@ -46,7 +47,7 @@ def stop(dt):
     print(f"Collected {len(joystick_data)} samples")
     with open("joystick_pyglet_data.csv", "w", newline="") as f:
         writer = csv.writer(f)
-        writer.writerow(["Timestamp", "X_axis", "Y_axis"])
+        writer.writerow(["Timestamp_ns", "X_axis", "Y_axis"])
         writer.writerows(joystick_data)
     joystick.close()
     win.close()
@@ -0,0 +1,152 @@
+'''Offline re-scoring of movement onset and endpoint from stored trajectories,
+for one subject or the whole cohort at once.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+from pathlib import Path
+
+import numpy as np
+
+from trajectory_store import TRAJECTORY_DTYPE, elapsed, load_subject_trials
+
+
+ONSET_METHODS = ('step', 'displacement', 'velocity', 'peak_fraction')
+ENDPOINT_METHODS = ('threshold', 'peak_fraction')
+
+
+class TrajectoryBatch:
+    """
+    Trials of one or more runs concatenated into flat sample arrays.
+
+    `rows` gives the trial of every sample and `starts` the first sample of
+    every trial, so per-trial operations are segment reductions over the
+    flat arrays: memory stays linear in the number of samples even when a
+    few trials are much longer than the others.
+
+    t holds the time elapsed since the start of the response window,
+    t_ns - WindowStart_ns of every trial (`window_starts`, 0 for runs converted
+    from legacy files, whose t_ns already count from the window start). Trials
+    converted from runs files without a time column have no sample times; they
+    are assumed evenly spaced at `missing_time_rate`, 60 Hz by default since the
+    early versions of the task polled once per flip (as virtual_joystick does).
+    With missing_time_rate=None those times, and therefore the scores, are NaN.
+    """
+
+    def __init__(self, keys, trajectories, window_starts=None, missing_time_rate=60.0,
+                 key_names=('Session', 'Run', 'Block', 'Trial')):
+        self.keys = list(keys)
+        self.key_names = list(key_names)
+        self.lengths = np.array([len(tr) for tr in trajectories], dtype=np.int64)
+        self.starts = np.cumsum(self.lengths) - self.lengths
+        self.rows = np.repeat(np.arange(len(self.lengths)), self.lengths)
+        flat = np.concatenate(trajectories) if len(trajectories) else np.empty(0, dtype=TRAJECTORY_DTYPE)
+        if window_starts is None:
+            window_starts = np.zeros(len(self.lengths), dtype=np.int64)
+        self.t = elapsed(flat, np.repeat(np.asarray(window_starts, dtype=np.int64), self.lengths))
+        self.x = {side: flat[side][:, 0].astype(np.float64) for side in ('right', 'left')}
+        self.y = {side: flat[side][:, 1].astype(np.float64) for side in ('right', 'left')}
+        if missing_time_rate:
+            missing = np.isnan(self.t)
+            self.t[missing] = (np.flatnonzero(missing) - self.starts[self.rows[missing]]) / missing_time_rate
+
+    def _first(self, mask):
+        """Flat index of the first True sample of every trial, -1 for trials without any."""
+        idx = np.flatnonzero(mask)
+        trials, first = np.unique(self.rows[idx], return_index=True)
+        out = np.full(len(self.lengths), -1, dtype=np.int64)
+        out[trials] = idx[first]
+        return out
+
+    def _scored(self, idx):
+        return np.where(idx >= 0, self.t[np.maximum(idx, 0)] if len(self.t) else np.nan, np.nan)
+
+    def _displacement(self, side):
+        """|y - y[0]| of every sample and its per-trial peak."""
+        y = self.y[side]
+        displacement = np.abs(y - y[self.starts[self.rows]])
+        nonempty = self.lengths > 0
+        peak = np.zeros(len(self.lengths))
+        if len(y):
+            peak[nonempty] = np.fmax.reduceat(displacement, self.starts[nonempty])
+        return displacement, np.nan_to_num(peak)
+
+    @classmethod
+    def from_subject(cls, subject_path, subject_id, **kwargs):
+        trials = load_subject_trials(subject_path, subject_id)
+        keys = sorted(trials)
+        return cls(keys, [trials[k][0] for k in keys], [trials[k][1] for k in keys], **kwargs)
+
+    @classmethod
+    def from_cohort(cls, data_path, **kwargs):
+        """Every trial of every Data/Subject_* folder in one batch, keyed by (ID, Session, Run, Block, Trial)."""
+        keys, trajectories, window_starts = [], [], []
+        for subject_path in sorted(Path(data_path).glob('Subject_*'), key=lambda p: int(p.name.split('_', 1)[1])):
+            subject_id = int(subject_path.name.split('_', 1)[1])
+            if not (subject_path / f'S_{subject_id}_PMBR_runs.csv').exists():
+                continue
+            trials = load_subject_trials(subject_path, subject_id)
+            for key in sorted(trials):
+                keys.append((subject_id,) + key)
+                trajectories.append(trials[key][0])
+                window_starts.append(trials[key][1])
+        return cls(keys, trajectories, window_starts, key_names=('ID', 'Session', 'Run', 'Block', 'Trial'), **kwargs)
+
+    def onsets(self, side, method='velocity', threshold=1.0, fraction=0.1):
+        """
+        Onset time of every trial for one stick, NaN when the criterion is never met.
+        step:          |y[i] - y[i-1]| > threshold (the online criterion, threshold=0.005)
+        displacement:  |y - y[0]| > threshold
+        velocity:      |dy/dt| > threshold, in axis units per second
+        peak_fraction: |y - y[0]| > fraction * peak |y - y[0]| of the trial
+        """
+        y, t = self.y[side], self.t
+        # Differences never cross a trial boundary: the first sample of each trial has no predecessor
+        boundary = np.zeros(len(y), dtype=bool)
+        boundary[self.starts[self.lengths > 0]] = True
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if method == 'step':
+                mask = (np.abs(np.diff(y, prepend=np.nan)) > threshold) & ~boundary
+            elif method == 'displacement':
+                mask = self._displacement(side)[0] > threshold
+            elif method == 'velocity':
+                dt = np.diff(t, prepend=np.nan)
+                velocity = np.diff(y, prepend=np.nan) / dt
+                mask = (np.abs(velocity) > threshold) & (dt > 0) & ~boundary
+            elif method == 'peak_fraction':
+                displacement, peak = self._displacement(side)
+                peak = peak[self.rows]
+                mask = (displacement > fraction * peak) & (peak > 0)
+            else:
+                raise ValueError(f'Unknown onset method {method!r}, expected one of {ONSET_METHODS}')
+        return self._scored(self._first(mask))
+
+    def endpoints(self, side, method='threshold', threshold=-0.9, fraction=0.9):
+        """
+        Endpoint time of every trial for one stick, NaN when it is never reached.
+        threshold:     y < threshold (the online criterion, -0.9)
+        peak_fraction: |y - y[0]| >= fraction * peak |y - y[0]| of the trial
+        """
+        y = self.y[side]
+        with np.errstate(invalid='ignore'):
+            if method == 'threshold':
+                mask = y < threshold
+            elif method == 'peak_fraction':
+                displacement, peak = self._displacement(side)
+                peak = peak[self.rows]
+                mask = (displacement >= fraction * peak) & (peak > 0)
+            else:
+                raise ValueError(f'Unknown endpoint method {method!r}, expected one of {ENDPOINT_METHODS}')
+        return self._scored(self._first(mask))
+
+    def rescore(self, onset=('velocity', {'threshold': 1.0}), endpoint=('threshold', {'threshold': -0.9})):
+        """
+        Onset and endpoint of both sticks for every trial, as a pandas DataFrame
+        indexed by the batch keys, (Session, Run, Block, Trial) or (ID, Session, Run, Block, Trial).
+        """
+        import pandas as pd
+        columns = {}
+        for side in ('right', 'left'):
+            columns[f'onset_{side}'] = self.onsets(side, onset[0], **onset[1])
+            columns[f'end_{side}'] = self.endpoints(side, endpoint[0], **endpoint[1])
+        index = pd.MultiIndex.from_tuples(self.keys, names=self.key_names)
+        return pd.DataFrame(columns, index=index)
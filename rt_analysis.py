@@ -0,0 +1,121 @@
+'''Reaction time block means of the whole cohort, as in analysis_script.ipynb.
+Usage:
+    python rt_analysis.py Data --jobs 8 --output block_means.csv
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+
+
+MEASURES = ('start', 'end')
+SIDES = ('right', 'left')
+
+
+def long_rts(trials, min_rt=0.1):
+    """
+    Stacks the RT_<measure>_<side> columns into a long frame with columns
+    ID, Block, measure, side, RT, keeping only RTs above `min_rt`.
+    `trials` is a runs frame, either with plain columns or indexed as in TrialStore.
+    """
+    if 'ID' not in trials.columns:
+        trials = trials.reset_index()
+    rt_columns = [f'RT_{m}_{s}' for m in MEASURES for s in SIDES]
+    rts = trials[['ID', 'Block'] + rt_columns].apply(pd.to_numeric, errors='coerce')
+    long = rts.melt(id_vars=['ID', 'Block'], value_vars=rt_columns, var_name='column', value_name='RT')
+    long = long[long['RT'] > min_rt]
+    measure = {f'RT_{m}_{s}': m for m in MEASURES for s in SIDES}
+    side = {f'RT_{m}_{s}': s for m in MEASURES for s in SIDES}
+    return pd.DataFrame({'ID': long['ID'].astype(int), 'Block': long['Block'].astype(int),
+                         'measure': long['column'].map(measure), 'side': long['column'].map(side),
+                         'RT': long['RT'].astype(float)})
+
+
+def exclude_outliers(long, k=1.5):
+    """Drops RTs outside the Tukey fences, computed per subject, measure and side."""
+    grouped = long.groupby(['ID', 'measure', 'side'])['RT']
+    q1 = grouped.transform('quantile', 0.25)
+    q3 = grouped.transform('quantile', 0.75)
+    iqr = q3 - q1
+    return long[(long['RT'] >= q1 - k * iqr) & (long['RT'] <= q3 + k * iqr)]
+
+
+def block_means(trials, min_rt=0.1, iqr_k=1.5, outliers=True):
+    """
+    Tidy frame with one row per (ID, measure, Block) and the columns
+    right, left (mean RTs), n_right, n_left (trial counts) and diff (right - left).
+    Set outliers=False to skip the IQR exclusion, iqr_k sets the fence width.
+    """
+    long = long_rts(trials, min_rt)
+    if outliers:
+        long = exclude_outliers(long, iqr_k)
+    stats = long.groupby(['ID', 'measure', 'Block', 'side'])['RT'].agg(['mean', 'count']).unstack('side')
+    result = pd.DataFrame({
+        'right': stats[('mean', 'right')] if ('mean', 'right') in stats else float('nan'),
+        'left': stats[('mean', 'left')] if ('mean', 'left') in stats else float('nan'),
+        'n_right': stats[('count', 'right')] if ('count', 'right') in stats else 0,
+        'n_left': stats[('count', 'left')] if ('count', 'left') in stats else 0,
+    }, index=stats.index)
+    result[['n_right', 'n_left']] = result[['n_right', 'n_left']].fillna(0).astype(int)
+    result['diff'] = result['right'] - result['left']
+    return result.reset_index()
+
+
+def read_runs(paths):
+    """Reads the scalar columns of several runs files into one frame, skipping the trajectory text columns."""
+    usecols = lambda c: c not in ('right_positions', 'left_positions', 'time')
+    return pd.concat([pd.read_csv(p, usecols=usecols) for p in paths], ignore_index=True)
+
+
+def subject_runs_files(data_path='Data'):
+    """Runs files of every Data/Subject_* folder, sorted by subject number."""
+    files = Path(data_path).glob('Subject_*/S_*_PMBR_runs.csv')
+    return sorted(files, key=lambda p: int(p.parent.name.split('_', 1)[1]))
+
+
+def analyze_subject(run_path, min_rt=0.1, iqr_k=1.5, outliers=True):
+    return block_means(read_runs([run_path]), min_rt, iqr_k, outliers)
+
+
+def analyze_cohort(data_path='Data', jobs=None, min_rt=0.1, iqr_k=1.5, outliers=True):
+    """
+    block_means for every subject, one subject per worker process.
+    Subjects are independent (all statistics are per ID), so the result is
+    the same frame as a serial run; rows come back in subject order whatever
+    the completion order. jobs=1 runs serially in this process.
+    """
+    files = subject_runs_files(data_path)
+    args = ([min_rt] * len(files), [iqr_k] * len(files), [outliers] * len(files))
+    if jobs == 1:
+        results = list(map(analyze_subject, files, *args))
+    else:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(analyze_subject, files, *args))
+    return pd.concat(results, ignore_index=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Per-block RT means and right - left differences for every subject')
+    parser.add_argument('data', nargs='?', default='Data', help='folder holding the Subject_* folders')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help='number of worker processes')
+    parser.add_argument('-o', '--output', help='write the result to this CSV instead of printing it')
+    parser.add_argument('--min-rt', type=float, default=0.1)
+    parser.add_argument('--iqr-k', type=float, default=1.5)
+    parser.add_argument('--keep-outliers', action='store_true')
+    args = parser.parse_args(argv)
+
+    result = analyze_cohort(args.data, args.jobs, args.min_rt, args.iqr_k, not args.keep_outliers)
+    if args.output:
+        result.to_csv(args.output, index=False)
+    else:
+        print(result.to_string(index=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
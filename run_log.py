@@ -0,0 +1,194 @@
+'''Run log writer for the PMBR runs CSV.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import csv
+import os
+import queue
+import threading
+import time
+from pathlib import Path
+
+
+class RunLogWriter:
+    """
+    Keeps the runs CSV open for a whole run and batches trial rows in memory.
+
+    The header is read once when the file already exists, or written from the
+    keys of the first row otherwise. Rows are written out on flush(), which the
+    task calls at block boundaries. With a `flush_interval`, write() also
+    flushes once that many seconds have passed since the last flush; leave it
+    None when rows point into a trajectory file, or a row may reach the disk
+    before the samples it refers to. close() always flushes, so call it
+    from a finally clause to keep the rows of an aborted or crashed run.
+    `on_flush`, if given, is called with the rows written once they are on disk
+    (see checkpoint.Checkpoint.commit).
+    """
+
+    def __init__(self, path, flush_interval=None, clock=time.monotonic, on_flush=None):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.clock = clock
+        self.on_flush = on_flush
+        self.fieldnames = None
+        if self.path.exists() and self.path.stat().st_size > 0:
+            with open(self.path, newline='') as f:
+                self.fieldnames = next(csv.reader(f))
+        self._file = open(self.path, 'a', newline='')
+        self._writer = None
+        self._rows = []
+        self._last_flush = clock()
+        self.rows_written = 0
+        self.flushes = 0
+
+    def write(self, row):
+        if self.fieldnames is None:
+            self.fieldnames = list(row.keys())
+        elif list(row.keys()) != self.fieldnames:
+            raise ValueError(f'Row columns {list(row.keys())} do not match the header of {self.path}')
+        self._rows.append(dict(row))
+        if self.flush_interval is not None and self.clock() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        self._last_flush = self.clock()
+        if not self._rows:
+            return
+        if self._writer is None:
+            self._writer = csv.DictWriter(self._file, self.fieldnames, lineterminator='\n')
+            if self._file.tell() == 0:
+                self._writer.writeheader()
+        rows, self._rows = self._rows, []
+        self._writer.writerows(rows)
+        self.rows_written += len(rows)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.flushes += 1
+        if self.on_flush is not None:
+            self.on_flush(rows)
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class AsyncTrialWriter:
+    """
+    Moves trial persistence off the stimulus thread.
+
+    submit() copies the trial row and hands it, with its trajectory arrays,
+    to a background thread through a bounded queue. The thread writes the
+    trajectory to the TrajectoryWriter, fills in traj_offset/traj_length and
+    passes the row to the RunLogWriter. flush() and close() are forwarded to
+    the same thread so ordering is preserved.
+
+    When the queue is full submit() blocks; how often and for how long is
+    tracked in stats() together with the current and peak queue depth. While
+    blocked it checks the thread every `put_timeout` seconds and raises if it
+    has died, instead of waiting forever.
+    """
+
+    _FLUSH = object()
+    _STOP = object()
+
+    def __init__(self, run_log, trajectories=None, maxsize=256, put_timeout=0.5):
+        self.run_log = run_log
+        self.trajectories = trajectories
+        self.put_timeout = put_timeout
+        self._queue = queue.Queue(maxsize)
+        self._error = None
+        self.submitted = 0
+        self.written = 0
+        self.max_depth = 0
+        self.blocked_puts = 0
+        self.blocked_time = 0.0
+        self._thread = threading.Thread(target=self._worker, name='AsyncTrialWriter', daemon=True)
+        self._thread.start()
+
+    def _check_worker(self):
+        if self._error is not None:
+            raise RuntimeError('Trial writer thread failed') from self._error
+        if not self._thread.is_alive():
+            raise RuntimeError('Trial writer thread is not running')
+
+    def _put(self, item):
+        self._check_worker()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            # Back-pressure: the disk is behind, wait rather than drop trial data,
+            # but never wait on a queue that a dead worker will not drain
+            t0 = time.perf_counter()
+            while True:
+                try:
+                    self._queue.put(item, timeout=self.put_timeout)
+                    break
+                except queue.Full:
+                    self._check_worker()
+            self.blocked_puts += 1
+            self.blocked_time += time.perf_counter() - t0
+        self.max_depth = max(self.max_depth, self._queue.qsize())
+
+    def submit(self, row, trajectory=None):
+        """Queues a trial row; `trajectory` is (times, right_positions, left_positions) or None."""
+        self._put((dict(row), trajectory))
+        self.submitted += 1
+
+    def flush(self):
+        self._put(self._FLUSH)
+
+    def _worker(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is self._STOP:
+                    return
+                if item is self._FLUSH:
+                    if self.trajectories is not None:
+                        self.trajectories.flush()
+                    self.run_log.flush()
+                    continue
+                row, trajectory = item
+                if trajectory is not None and self.trajectories is not None:
+                    row['traj_offset'], row['traj_length'] = self.trajectories.write(*trajectory)
+                else:
+                    row['traj_offset'], row['traj_length'] = 'NA', 'NA'
+                self.run_log.write(row)
+                self.written += 1
+            except Exception as e:
+                self._error = e
+                return
+            finally:
+                self._queue.task_done()
+
+    def stats(self):
+        return {'queue_depth': self._queue.qsize(), 'max_depth': self.max_depth,
+                'submitted': self.submitted, 'written': self.written, 'flushes': self.run_log.flushes,
+                'blocked_puts': self.blocked_puts, 'blocked_time': self.blocked_time}
+
+    def close(self):
+        """Drains the queue, stops the thread and closes both writers."""
+        if self._thread.is_alive():
+            try:
+                self._put(self._STOP)
+            except RuntimeError:
+                pass # The worker died, its error is raised below once the writers are closed
+            self._thread.join()
+        if self.trajectories is not None:
+            self.trajectories.close()
+        self.run_log.close()
+        if self._error is not None:
+            raise RuntimeError('Trial writer thread failed') from self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
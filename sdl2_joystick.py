@@ -1,93 +1,143 @@
 import ctypes
-import time
-import datetime
-import pandas as pd
+import numpy as np
 from sdl2 import *
-from psychopy import visual, core, event
 from threading import Thread, Event
-from queue import Queue
+from queue import Queue, Empty, Full
+from session_clock import SessionClock
+
+
+# One row per axis event: SDL event timestamp mapped to session clock ns and the
+# raw int16 state of both axes after the event. Divide by 32768 to normalise.
+SAMPLE_DTYPE = np.dtype([('time', '<i8'), ('x', '<i2'), ('y', '<i2')])
 
 
 class SDLJoystick:
-    def __init__(self):
+    """
+    Event-driven SDL2 joystick recorder: one sample per axis event, stamped with
+    the event's own timestamp mapped onto the session clock.
+    """
+
+    BATCH = 256
+    CHUNK = 8192
+
+    def __init__(self, clock=None):
         SDL_Init(SDL_INIT_JOYSTICK)
+        clock = clock or SessionClock()
+        self.tick_offset_ns = clock.offset_of(lambda: SDL_GetTicks() / 1000)
         self.axis = {}
         self.button = {}
         self.device = None
+        self._events = (SDL_Event * self.BATCH)()
+        self._chunks = [np.empty(self.CHUNK, dtype=SAMPLE_DTYPE)]
+        self._n = 0 # Samples in the current chunk
+
+    def _append(self, timestamp):
+        chunk = self._chunks[-1]
+        if self._n == len(chunk):
+            chunk = np.empty(self.CHUNK, dtype=SAMPLE_DTYPE)
+            self._chunks.append(chunk)
+            self._n = 0
+        chunk[self._n] = (timestamp * 1_000_000 + self.tick_offset_ns, self.axis.get(0, 0), self.axis.get(1, 0))
+        self._n += 1
+
+    def wait(self, timeout_ms=5):
+        """Blocks until an event is pending or timeout_ms elapsed, instead of spinning."""
+        return SDL_WaitEventTimeout(None, timeout_ms) != 0
 
     def update(self):
-        event = SDL_Event()
-        while SDL_PollEvent(ctypes.byref(event)) != 0:
-            if event.type == SDL_JOYDEVICEADDED and self.device is None:
-                self.device = SDL_JoystickOpen(event.jdevice.which)
-            elif event.type == SDL_JOYAXISMOTION:
-                self.axis[event.jaxis.axis] = event.jaxis.value / 32768.0
-            elif event.type == SDL_JOYBUTTONDOWN:
-                self.button[event.jbutton.button] = True
-            elif event.type == SDL_JOYBUTTONUP:
-                self.button[event.jbutton.button] = False
+        """Drains pending events, returns the number of axis samples recorded."""
+        SDL_PumpEvents()
+        recorded = 0
+        while True:
+            n = SDL_PeepEvents(self._events, self.BATCH, SDL_GETEVENT, SDL_FIRSTEVENT, SDL_LASTEVENT)
+            for i in range(max(n, 0)):
+                ev = self._events[i]
+                if ev.type == SDL_JOYDEVICEADDED and self.device is None:
+                    self.device = SDL_JoystickOpen(ev.jdevice.which)
+                elif ev.type == SDL_JOYAXISMOTION:
+                    self.axis[ev.jaxis.axis] = ev.jaxis.value
+                    if ev.jaxis.axis in (0, 1):
+                        self._append(ev.jaxis.timestamp)
+                        recorded += 1
+                elif ev.type == SDL_JOYBUTTONDOWN:
+                    self.button[ev.jbutton.button] = True
+                elif ev.type == SDL_JOYBUTTONUP:
+                    self.button[ev.jbutton.button] = False
+            if n < self.BATCH:
+                return recorded
+
+    def samples(self):
+        """All recorded samples as one SAMPLE_DTYPE array."""
+        return np.concatenate(self._chunks[:-1] + [self._chunks[-1][:self._n]])
 
 
 def normalize(value, min_value=-1.0, max_value=1.0):
     return (value - min_value) / (max_value - min_value)
 
 
+def publish_latest(q: Queue, value):
+    """Replaces whatever the display has not consumed yet, the queue never holds more than one value."""
+    try:
+        q.get_nowait()
+    except Empty:
+        pass
+    try:
+        q.put_nowait(value)
+    except Full:
+        pass
+
+
 def get_joystick_state(subject, session, stop_condition, q: Queue, min_max: dict):
     joystick = SDLJoystick()
-    df = pd.DataFrame(columns=["x", "y", "time"])
     min_value, max_value = min_max["min"], min_max["max"]
 
     while not stop_condition.is_set():
-        joystick.update()
-
-        x = joystick.axis.get(0, None)
-        y = joystick.axis.get(1, None)
-        timestamp = datetime.datetime.now().isoformat()
-
-        if x is not None and y is not None:
-            df.loc[len(df)] = [x, y, timestamp]
-            q.put((x, y))
-
-        time.sleep(0.000001)  # Polling rate of 1000 Hz
+        joystick.wait()
+        if joystick.update() and 0 in joystick.axis and 1 in joystick.axis:
+            publish_latest(q, (joystick.axis[0] / 32768.0, joystick.axis[1] / 32768.0))
 
-    filename = f"sub-{subject}_session-{session}_joystick.csv"
-    df.to_csv(filename, index=False)
-    print(f"Saved joystick data to {filename}")
+    filename = f"sub-{subject}_session-{session}_joystick.npy"
+    samples = joystick.samples()
+    np.save(filename, samples)
+    print(f"Saved {len(samples)} joystick samples to {filename}")
 
 
 # ==== PsychoPy Display Code ====
-subject = "001"
-session = "01"
-stop_condition = Event()
-q = Queue()
-min_max = {"min": -1, "max": 1}
-
-# Start joystick polling thread
-joystick_thread = Thread(target=get_joystick_state, args=(subject, session, stop_condition, q, min_max))
-joystick_thread.start()
-
-# Create PsychoPy window and text
-win = visual.Window(size=(800, 600), color="black", waitBlanking=False)
-text = visual.TextStim(win, text="Waiting for joystick data...", height=0.05, color="white", pos=(0, 0))
-
-clock = core.Clock()
-while True:
-    # Check for quit
-    keys = event.getKeys()
-    if "escape" in keys:
-        stop_condition.set()
-        break
-
-    # Try getting latest joystick values
-    try:
-        x, y = q.get_nowait()
-        text.text = f"Joystick\nX: {x:.3f}\nY: {y:.3f}"
-    except:
-        pass  # no new data
-
-    text.draw()
-    win.flip()
-
-joystick_thread.join()
-win.close()
-core.quit()
+if __name__ == '__main__':
+    from psychopy import visual, core, event
+
+    subject = "001"
+    session = "01"
+    stop_condition = Event()
+    q = Queue(maxsize=1)
+    min_max = {"min": -1, "max": 1}
+
+    # Start joystick polling thread
+    joystick_thread = Thread(target=get_joystick_state, args=(subject, session, stop_condition, q, min_max))
+    joystick_thread.start()
+
+    # Create PsychoPy window and text
+    win = visual.Window(size=(800, 600), color="black", waitBlanking=False)
+    text = visual.TextStim(win, text="Waiting for joystick data...", height=0.05, color="white", pos=(0, 0))
+
+    clock = core.Clock()
+    while True:
+        # Check for quit
+        keys = event.getKeys()
+        if "escape" in keys:
+            stop_condition.set()
+            break
+
+        # Try getting latest joystick values
+        try:
+            x, y = q.get_nowait()
+            text.text = f"Joystick\nX: {x:.3f}\nY: {y:.3f}"
+        except Empty:
+            pass  # no new data
+
+        text.draw()
+        win.flip()
+
+    joystick_thread.join()
+    win.close()
+    core.quit()
@@ -0,0 +1,62 @@
+'''Session timebase for the PMBR task, int64 ns since the session started, and conversions
+from the other clocks of the project.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+class SessionClock:
+    """
+    Monotonic session clock, int64 nanoseconds since construction.
+    The wall-clock time of the origin is kept so stamps can be reported as dates.
+    """
+
+    def __init__(self):
+        self.origin_ns = time.perf_counter_ns()
+        self.wall_origin = datetime.now()
+
+    def now_ns(self):
+        return time.perf_counter_ns() - self.origin_ns
+
+    def now(self):
+        """Seconds since the session started, as a float."""
+        return (time.perf_counter_ns() - self.origin_ns) * 1e-9
+
+    def from_perf_counter(self, t):
+        """Maps time.perf_counter() seconds (also what psychopy's clocks read on Windows) to session ns."""
+        return np.round(np.asarray(t) * 1e9).astype(np.int64) - self.origin_ns
+
+    def offset_of(self, get_time):
+        """
+        Offset in ns such that session_ns = get_time() * 1e9 + offset, for any clock
+        returning seconds (core.MonotonicClock().getTime, time.time, ...).
+        The clock is read between two session reads and the midpoint is used.
+        """
+        before = self.now_ns()
+        t = get_time()
+        after = self.now_ns()
+        return (before + after) // 2 - int(round(t * 1e9))
+
+    def to_datetime(self, ns):
+        return self.wall_origin + timedelta(microseconds=int(ns) / 1000)
+
+
+def countdown_to_ns(countdown, window_start_ns, duration):
+    """
+    Maps CountdownTimer values (the legacy `time` column, remaining seconds of a
+    `duration` window) to session ns, given the session time the window opened.
+    """
+    elapsed = duration - np.asarray(countdown, dtype=np.float64)
+    return np.int64(window_start_ns) + np.round(elapsed * 1e9).astype(np.int64)
+
+
+def ns_to_seconds(ns, origin_ns=0):
+    return (np.asarray(ns, dtype=np.int64) - origin_ns) * 1e-9
+
+
+def seconds_to_ns(seconds):
+    return np.round(np.asarray(seconds, dtype=np.float64) * 1e9).astype(np.int64)
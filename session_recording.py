@@ -0,0 +1,192 @@
+'''Continuous recording of both sticks for the whole session, with the table of the task phases.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+from frame_timing import PHASE_CODES, PHASES
+
+
+# One record per sample, as in the acquisition ring buffer: session ns, right (x, y), left (x, y)
+SAMPLE_DTYPE = np.dtype([('time', '<i8'), ('right', '<f4', (2,)), ('left', '<f4', (2,))])
+# One record per phase entered by the task
+EVENT_DTYPE = np.dtype([('time', '<i8'), ('phase', 'u1'), ('block', '<i2'), ('trial', '<i2')])
+
+
+def recording_path(subject_path, subject_id, session, run):
+    return Path(subject_path) / f'S_{subject_id}_PMBR_ses{session}_run{run}_session.bin'
+
+
+def events_path(path):
+    path = Path(path)
+    return path.with_name(path.name.replace('_session.bin', '_events.bin'))
+
+
+def _valid_length(path):
+    """Number of records before the zero-filled tail a crashed recorder leaves behind."""
+    if not Path(path).exists() or Path(path).stat().st_size < SAMPLE_DTYPE.itemsize:
+        return 0
+    valid = np.flatnonzero(np.memmap(path, dtype=SAMPLE_DTYPE, mode='r')['time'])
+    return int(valid[-1]) + 1 if len(valid) else 0
+
+
+class SessionRecorder:
+    """
+    Appends every sample of a JoystickAcquisition to a memory-mapped file.
+
+    The file is grown `chunk` records at a time and truncated to the samples
+    actually written on close(); after a crash the zero-filled tail is ignored
+    by SessionRecording. Samples already in the file (an earlier attempt at
+    the same run) are kept and the new ones appended after them. The drain
+    thread wakes every `interval` seconds, well within the ~30 s the ring
+    buffer holds at 1 kHz. With threaded=False the
+    ring is drained on every event() instead, on the caller's thread.
+    """
+
+    def __init__(self, path, clock=time.perf_counter_ns, chunk=2**20, interval=0.1, threaded=True):
+        self.path = Path(path)
+        self.clock = clock
+        self.chunk = chunk
+        self.interval = interval
+        self.threaded = threaded
+        self.acquisition = None
+        self.n = 0
+        self._file = open(self.path, 'ab+')
+        self._base = _valid_length(self.path) # Records kept from an earlier recording
+        self._map = None
+        self._grow()
+        self._events = open(events_path(self.path), 'ab')
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._cursor = 0
+
+    def _grow(self):
+        size = (len(self._map) if self._map is not None else 0) + self.chunk
+        if self._map is not None:
+            # Windows refuses to resize a mapped file: unmap first, samples() and window() only hand out copies
+            self._map.flush()
+            self._map = None
+        self._file.truncate((self._base + size) * SAMPLE_DTYPE.itemsize)
+        self._map = np.memmap(self.path, dtype=SAMPLE_DTYPE, mode='r+', shape=(size,),
+                              offset=self._base * SAMPLE_DTYPE.itemsize)
+
+    def start(self, acquisition):
+        """Records `acquisition` from its current position on."""
+        self.acquisition = acquisition
+        self._cursor = acquisition.cursor()
+        if self.threaded:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._drain_loop, name='SessionRecorder', daemon=True)
+            self._thread.start()
+
+    def _drain_loop(self):
+        while not self._stop_event.wait(self.interval):
+            self.drain()
+
+    def drain(self):
+        """Appends the samples acquired since the last drain, returns how many."""
+        if self.acquisition is None:
+            return 0
+        with self._lock:
+            self._cursor, times, right, left = self.acquisition.read_since(self._cursor)
+            k = len(times)
+            while self.n + k > len(self._map):
+                self._grow()
+            block = self._map[self.n:self.n + k]
+            block['time'], block['right'], block['left'] = times, right, left
+            self.n += k
+            return k
+
+    def event(self, phase, block=0, trial=0):
+        """Logs that the task entered `phase` (a frame_timing phase name) now."""
+        if not self.threaded:
+            self.drain()
+        np.array([(self.clock(), PHASE_CODES[phase], block, trial)], dtype=EVENT_DTYPE).tofile(self._events)
+
+    def samples(self):
+        """Copy of everything recorded so far (the map is replaced when the file grows)."""
+        with self._lock:
+            return np.array(self._map[:self.n])
+
+    def window(self, start_ns, stop_ns):
+        """Copy of the samples stamped in [start_ns, stop_ns)."""
+        with self._lock:
+            samples = self._map[:self.n]
+            i, j = np.searchsorted(samples['time'], (start_ns, stop_ns))
+            return np.array(samples[i:j])
+
+    def close(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        self.drain()
+        self._map.flush()
+        self._map = None
+        self._file.truncate((self._base + self.n) * SAMPLE_DTYPE.itemsize)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._events.close()
+
+
+def _attempt(records, attempt):
+    """Records of one attempt: every attempt restarts the session clock, so attempts start where time goes back."""
+    starts = np.concatenate(([0], np.flatnonzero(np.diff(records['time']) < 0) + 1, [len(records)]))
+    attempt = range(len(starts) - 1)[attempt]
+    return records[starts[attempt]:starts[attempt + 1]]
+
+
+class SessionRecording:
+    """
+    A recorded session: mapped samples, the event table and slices of both.
+    When a run was restarted, its file holds several attempts, the last one is
+    used unless `attempt` says otherwise (0 for the first, -2 for the one before last...).
+    """
+
+    def __init__(self, path, attempt=-1):
+        self.path = Path(path)
+        n = _valid_length(self.path)
+        samples = np.memmap(self.path, dtype=SAMPLE_DTYPE, mode='r', shape=(n,)) if n else \
+            np.zeros(0, dtype=SAMPLE_DTYPE)
+        path = events_path(self.path)
+        events = np.fromfile(path, dtype=EVENT_DTYPE) if path.exists() else np.zeros(0, dtype=EVENT_DTYPE)
+        self.samples = _attempt(samples, attempt) if n else samples
+        self.events = _attempt(events, attempt) if len(events) else events
+
+    def window(self, start_ns, stop_ns):
+        i, j = np.searchsorted(self.samples['time'], (start_ns, stop_ns))
+        return self.samples[i:j]
+
+    def _until_next(self, k, same_kind=None):
+        """Samples from event k to the next event (of the same phase if same_kind, else any)."""
+        later = self.events[k + 1:]
+        if same_kind is not None:
+            later = later[later['phase'] == same_kind]
+        stop = later['time'][0] if len(later) else np.iinfo(np.int64).max
+        return self.window(self.events['time'][k], stop)
+
+    def trial(self, block, trial):
+        """Samples from the start of the trial to the start of the next one."""
+        e = self.events
+        k = np.flatnonzero((e['phase'] == PHASE_CODES['trial_start']) & (e['block'] == block) & (e['trial'] == trial))
+        if not len(k):
+            raise KeyError(f'no trial {trial} in block {block}')
+        return self._until_next(k[-1], PHASE_CODES['trial_start'])
+
+    def phases(self, phase):
+        """(block, trial, samples) for every time the task entered `phase`, until the next event."""
+        for k in np.flatnonzero(self.events['phase'] == PHASE_CODES[phase]):
+            yield int(self.events['block'][k]), int(self.events['trial'][k]), self._until_next(k)
+
+    def event_table(self):
+        """Events as a pandas DataFrame with phase names."""
+        import pandas as pd
+        return pd.DataFrame({'time_ns': self.events['time'], 'phase': np.array(PHASES)[self.events['phase']],
+                             'Block': self.events['block'], 'Trial': self.events['trial']})
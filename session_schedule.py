@@ -0,0 +1,58 @@
+'''Trial schedule of a PMBR run, drawn once from one seed.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+from pathlib import Path
+
+import numpy as np
+
+
+SCHEDULE_DTYPE = np.dtype([('block', '<i2'), ('trial', '<i2'), ('condition', 'u1'), ('side', 'u1'),
+                           ('isi1', '<f8'), ('isi2', '<f8')])
+
+CONDITIONS = {'press': 0, 'movement': 1}
+SIDES = {'none': 0, 'right': 1, 'left': 2}
+
+
+def schedule_path(subject_path, subject_id, session, run):
+    return Path(subject_path) / f'S_{subject_id}_PMBR_ses{session}_run{run}_schedule.npy'
+
+
+def make_schedule(nb_blocks, nb_trials, seed=None, percentage_joystick=0.3, isi1=(0.65, 0.85), isi2=(3, 4)):
+    """
+    Rows of every trial, blocks and trials numbered from 1. The movement trials are
+    the same in every block, half of them (rounded down) with the right stick; the
+    ISIs of a block are a permutation of values evenly spaced over their range,
+    rounded to 10 ms, so all blocks last the same.
+    """
+    rng = np.random.default_rng(seed)
+    nb_movements = int(nb_trials * percentage_joystick)
+    movements = rng.choice(nb_trials, nb_movements, replace=False)
+    side = np.full(nb_trials, SIDES['none'], dtype=np.uint8)
+    side[movements] = SIDES['left']
+    side[movements[rng.choice(nb_movements, nb_movements // 2, replace=False)]] = SIDES['right']
+
+    schedule = np.zeros(nb_blocks * nb_trials, dtype=SCHEDULE_DTYPE)
+    schedule['block'] = np.repeat(np.arange(1, nb_blocks + 1), nb_trials)
+    schedule['trial'] = np.tile(np.arange(1, nb_trials + 1), nb_blocks)
+    schedule['side'] = np.tile(side, nb_blocks)
+    schedule['condition'] = np.where(schedule['side'] == SIDES['none'], CONDITIONS['press'], CONDITIONS['movement'])
+    jitters_1 = np.round(np.linspace(*isi1, nb_trials), 2)
+    jitters_2 = np.round(np.linspace(*isi2, nb_trials), 2)
+    schedule['isi1'] = np.concatenate([rng.permutation(jitters_1) for _ in range(nb_blocks)])
+    schedule['isi2'] = np.concatenate([rng.permutation(jitters_2) for _ in range(nb_blocks)])
+    return schedule
+
+
+def by_block(schedule):
+    """(blocks, trials) view of a schedule: row [block - 1, trial - 1] is that trial."""
+    nb_blocks = int(schedule['block'].max()) if len(schedule) else 0
+    return schedule.reshape(nb_blocks, -1) if nb_blocks else schedule.reshape(0, 0)
+
+
+def save_schedule(path, schedule):
+    np.save(path, schedule, allow_pickle=False)
+
+
+def load_schedule(path):
+    return np.load(path, allow_pickle=False)
@@ -0,0 +1,49 @@
+'''Startup timing of the PMBR task, one span per step and thread.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import threading
+import time
+from contextlib import contextmanager
+
+
+class StartupProfile:
+    """Spans and instants of the startup, in seconds from the creation of the profile."""
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.origin = clock()
+        self.spans = [] # (name, start, stop, thread name)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name):
+        start = self.clock()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.spans.append((name, start - self.origin, self.clock() - self.origin,
+                                   threading.current_thread().name))
+
+    def timed(self, name, function, *args, **kwargs):
+        """Calls function inside span(name) and returns its result (for executors)."""
+        with self.span(name):
+            return function(*args, **kwargs)
+
+    def mark(self, name):
+        """Instant `name`, e.g. the first flip of the instructions."""
+        now = self.clock() - self.origin
+        with self._lock:
+            self.spans.append((name, now, now, threading.current_thread().name))
+
+    def elapsed(self, name):
+        """Seconds from the origin to the end of the last span or instant called `name`."""
+        return next(stop for span_name, _, stop, _ in reversed(self.spans) if span_name == name)
+
+    def report(self):
+        lines = [f"{'step':<20}{'start s':>10}{'duration s':>12}  thread"]
+        for name, start, stop, thread in sorted(self.spans, key=lambda span: span[1]):
+            duration = f'{stop - start:12.3f}' if stop > start else f"{'':>12}"
+            lines.append(f'{name:<20}{start:10.3f}{duration}  {thread}')
+        return '\n'.join(lines)
@@ -0,0 +1,48 @@
+'''Stimuli of the PMBR task, built once per session and warmed before the first trial.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import time
+
+
+class StimulusRegistry:
+    """
+    Named stimuli of one window. add() returns the stimulus, so the task keeps
+    its local names: rect = stimuli.add('rect', visual.Rect(win, ...)).
+    Anything without a draw() method (sounds) is stored but not warmed.
+    """
+
+    def __init__(self, win):
+        self.win = win
+        self._stimuli = {}
+        self.warm_times = {}
+
+    def add(self, name, stimulus):
+        if name in self._stimuli:
+            raise KeyError(f'stimulus {name!r} is already registered')
+        self._stimuli[name] = stimulus
+        return stimulus
+
+    def __getitem__(self, name):
+        return self._stimuli[name]
+
+    def __contains__(self, name):
+        return name in self._stimuli
+
+    def __iter__(self):
+        return iter(self._stimuli)
+
+    def __len__(self):
+        return len(self._stimuli)
+
+    def warm(self):
+        """Draws every stimulus once and clears the back buffer, returns the total time in seconds."""
+        start = time.perf_counter()
+        for name, stimulus in self._stimuli.items():
+            if not hasattr(stimulus, 'draw'):
+                continue
+            t0 = time.perf_counter()
+            stimulus.draw()
+            self.warm_times[name] = time.perf_counter() - t0
+        self.win.clearBuffer()
+        return time.perf_counter() - start
@@ -0,0 +1,205 @@
+'''Live telemetry of a PMBR session (samples, flips, phases, trials) on a local datagram socket.
+Usage, in a second terminal while the task runs:
+    python telemetry.py
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import os
+import socket
+import struct
+import sys
+import threading
+import time
+
+import numpy as np
+
+from frame_timing import FRAME_DTYPE, PHASES, PHASE_CODES
+from session_recording import EVENT_DTYPE, SAMPLE_DTYPE
+
+
+DEFAULT_ADDRESS = ('127.0.0.1', 50555) if sys.platform == 'win32' else '/tmp/pmbr_telemetry.sock'
+VERSION = 1
+HEADER = struct.Struct('<BBHI') # kind, version, record count, sequence number; the packed records follow
+
+# Trial results, NaN for RTs that were not measured
+TRIAL_DTYPE = np.dtype([('block', '<i2'), ('trial', '<i2'), ('rt_press', '<f4'),
+                        ('rt_start_right', '<f4'), ('rt_start_left', '<f4'),
+                        ('rt_end_right', '<f4'), ('rt_end_left', '<f4'),
+                        ('late_flips', '<u2'), ('dropped_frames', '<u2')])
+
+KINDS = {1: ('samples', SAMPLE_DTYPE), 2: ('flips', FRAME_DTYPE), 3: ('events', EVENT_DTYPE), 4: ('trials', TRIAL_DTYPE)}
+KIND_CODES = {name: code for code, (name, _) in KINDS.items()}
+
+# Keeps datagrams well under the default Unix datagram limit (~200 KB on Linux) and the UDP limit
+MAX_RECORDS = 2048
+
+
+def _open_socket(address):
+    family = socket.AF_UNIX if isinstance(address, str) else socket.AF_INET
+    return socket.socket(family, socket.SOCK_DGRAM)
+
+
+class TelemetryPublisher:
+    """
+    Non-blocking publisher. publish() packs and sends one message; start()
+    adds a thread forwarding the samples of a JoystickAcquisition every
+    `interval` seconds, so the stimulus loop only pays for flips, events
+    and trials (one sendto each). With threaded=False the samples are
+    forwarded on every event instead, on the caller's thread.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, interval=0.02, threaded=True):
+        self.address = address
+        self.interval = interval
+        self.threaded = threaded
+        self.acquisition = None
+        self._cursor = 0
+        self.sent = 0
+        self.dropped = 0
+        self._seq = 0
+        self._socket = _open_socket(address)
+        self._socket.setblocking(False)
+        self._send_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def publish(self, kind, records):
+        """Sends records (an array of the kind's dtype) in as many datagrams as needed."""
+        code = KIND_CODES[kind]
+        for i in range(0, max(len(records), 1), MAX_RECORDS):
+            chunk = records[i:i + MAX_RECORDS]
+            with self._send_lock:
+                message = HEADER.pack(code, VERSION, len(chunk), self._seq) + chunk.tobytes()
+                self._seq = (self._seq + 1) & 0xFFFFFFFF
+                try:
+                    self._socket.sendto(message, self.address)
+                    self.sent += 1
+                except OSError: # No listener, listener gone or its buffer is full
+                    self.dropped += 1
+
+    def publish_flip(self, record):
+        self.publish('flips', np.asarray(record, dtype=FRAME_DTYPE).reshape(1))
+
+    def publish_event(self, t, phase, block, trial):
+        if not self.threaded:
+            self.forward()
+        self.publish('events', np.array([(t, PHASE_CODES[phase], block, trial)], dtype=EVENT_DTYPE))
+
+    def publish_trial(self, row):
+        """Publishes a runs CSV row (dict with the RUN_FIELDS keys)."""
+        def rt(key):
+            value = row.get(key)
+            return np.nan if value in (None, 'NA') else value
+        self.publish('trials', np.array([(row['Block'], row['Trial'], rt('RT_press'), rt('RT_start_right'),
+                                          rt('RT_start_left'), rt('RT_end_right'), rt('RT_end_left'),
+                                          row.get('LateFlips') or 0, row.get('DroppedFrames') or 0)],
+                                        dtype=TRIAL_DTYPE))
+
+    def start(self, acquisition):
+        """Forwards the samples of `acquisition` from its current position on."""
+        self.acquisition = acquisition
+        self._cursor = acquisition.cursor()
+        if self.threaded:
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._forward_loop, name='TelemetryPublisher', daemon=True)
+            self._thread.start()
+
+    def _forward_loop(self):
+        while not self._stop_event.wait(self.interval):
+            self.forward()
+
+    def forward(self):
+        """Publishes the samples acquired since the last call."""
+        if self.acquisition is None:
+            return
+        self._cursor, times, right, left = self.acquisition.read_since(self._cursor)
+        if len(times):
+            samples = np.empty(len(times), dtype=SAMPLE_DTYPE)
+            samples['time'], samples['right'], samples['left'] = times, right, left
+            self.publish('samples', samples)
+
+    def close(self):
+        if self._thread is not None:
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+        self._socket.close()
+
+
+class TelemetrySubscriber:
+    """
+    Receives the messages of a publisher: iterate over it to get
+    (kind, records, dropped) tuples, `dropped` being the number of messages
+    lost since the previous one. A stale Unix socket file is replaced.
+    """
+
+    def __init__(self, address=DEFAULT_ADDRESS, timeout=1.0, buffer_size=4 * 2**20):
+        self.address = address
+        self._socket = _open_socket(address)
+        if isinstance(address, str) and os.path.exists(address):
+            os.unlink(address)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, buffer_size)
+        self._socket.bind(address)
+        self._socket.settimeout(timeout)
+        self._next_seq = None
+
+    def receive(self):
+        """Next message as (kind, records, dropped), or None on timeout."""
+        try:
+            message = self._socket.recv(HEADER.size + MAX_RECORDS * max(d.itemsize for _, d in KINDS.values()))
+        except socket.timeout:
+            return None
+        code, version, count, seq = HEADER.unpack_from(message)
+        kind, dtype = KINDS[code]
+        dropped = 0 if self._next_seq is None else (seq - self._next_seq) & 0xFFFFFFFF
+        self._next_seq = (seq + 1) & 0xFFFFFFFF
+        return kind, np.frombuffer(message, dtype=dtype, count=count, offset=HEADER.size), dropped
+
+    def __iter__(self):
+        while True:
+            message = self.receive()
+            if message is not None:
+                yield message
+
+    def close(self):
+        self._socket.close()
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.unlink(self.address)
+
+
+def monitor(address=DEFAULT_ADDRESS):
+    """Prints the trials as they complete, the block RT means and a once-per-second sample summary."""
+    subscriber = TelemetrySubscriber(address)
+    print(f'Listening on {address}')
+    block_rts, samples, lost, last_report = {}, 0, 0, time.monotonic()
+    try:
+        for kind, records, dropped in subscriber:
+            lost += dropped
+            if kind == 'samples':
+                samples += len(records)
+                latest = records[-1]
+            elif kind == 'events':
+                for e in records:
+                    print(f"  {e['time'] * 1e-9:9.3f} s  block {e['block']} trial {e['trial']}: {PHASES[e['phase']]}")
+            elif kind == 'trials':
+                for r in records:
+                    rts = block_rts.setdefault(int(r['block']), [])
+                    rts += [rt for rt in (r['rt_start_right'], r['rt_start_left']) if not np.isnan(rt)]
+                    print(f"Block {r['block']} trial {r['trial']}: press {r['rt_press']:.3f}  "
+                          f"start R/L {r['rt_start_right']:.3f}/{r['rt_start_left']:.3f}  "
+                          f"end R/L {r['rt_end_right']:.3f}/{r['rt_end_left']:.3f}  "
+                          f"block mean start {np.mean(rts) if rts else np.nan:.3f}  "
+                          f"late {r['late_flips']} dropped {r['dropped_frames']}")
+            now = time.monotonic()
+            if samples and now - last_report >= 1:
+                print(f'  {samples / (now - last_report):.0f} samples/s, right {latest["right"]}, '
+                      f'left {latest["left"]}, {lost} messages lost')
+                samples, last_report = 0, now
+    except KeyboardInterrupt:
+        pass
+    finally:
+        subscriber.close()
+
+
+if __name__ == '__main__':
+    monitor()
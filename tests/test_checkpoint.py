@@ -0,0 +1,129 @@
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from checkpoint import (Checkpoint, committed_trajectory_end, drop_partial_row, read_checkpoint,
+                        resume_cursor)
+from trajectory_store import TRAJECTORY_DTYPE, TrajectoryWriter, read_trajectories, truncate_trajectories
+
+ROOT = Path(__file__).resolve().parents[1]
+FIELDS = ['Session', 'Run', 'Block', 'Trial', 'traj_offset', 'traj_length']
+NB_TRIALS = 5
+SAMPLES = 10
+
+# Writes block 1 and commits it, writes 3 trials of block 2, then dies as `mode` says.
+# The run log clock jumps 1000 s per call, so any time-based flush would fire on every row.
+CRASHING_RUN = '''
+import itertools, os, sys
+import numpy as np
+sys.path.insert(0, {root!r})
+from checkpoint import Checkpoint
+from run_log import AsyncTrialWriter, RunLogWriter
+from trajectory_store import TrajectoryWriter
+
+folder, mode = sys.argv[1], sys.argv[2]
+trajectories = TrajectoryWriter(os.path.join(folder, 'run_trajectories.bin'))
+checkpoint = Checkpoint(os.path.join(folder, 'checkpoint.json'), {{}}, trajectories.offset)
+ticks = itertools.count(0, 1000)
+run_log = RunLogWriter(os.path.join(folder, 'runs.csv'), clock=lambda: next(ticks),
+                       on_flush=checkpoint.commit)
+writer = AsyncTrialWriter(run_log, trajectories)
+
+def trial(block, trial):
+    times = np.arange({samples}, dtype=np.int64) + 1000 * (block * 100 + trial)
+    positions = np.full(({samples}, 2), trial, dtype=np.float32)
+    writer.submit({{'Session': 1, 'Run': 1, 'Block': block, 'Trial': trial}}, (times, positions, -positions))
+
+for t in range(1, {nb_trials} + 1):
+    trial(1, t)
+writer.flush()
+writer._queue.join()
+for t in range(1, 4):
+    trial(2, t)
+if mode == 'between_flushes':
+    flush = trajectories.flush
+    def flush_and_die():
+        flush()
+        os._exit(1)
+    trajectories.flush = flush_and_die
+    writer.flush()
+    writer._thread.join()
+else:
+    writer._queue.join()
+    os._exit(1)
+'''
+
+
+def crash_run(folder, mode):
+    script = CRASHING_RUN.format(root=str(ROOT), samples=SAMPLES, nb_trials=NB_TRIALS)
+    result = subprocess.run([sys.executable, '-c', script, str(folder), mode])
+    assert result.returncode == 1
+
+
+@pytest.mark.parametrize('mode', ['between_flushes', 'mid_block'])
+def test_resume_after_crash(tmp_path, mode):
+    crash_run(tmp_path, mode)
+    run_path = tmp_path / 'runs.csv'
+    bin_path = tmp_path / 'run_trajectories.bin'
+    with open(run_path, 'ab') as f: # A row cut by the crash
+        f.write(b'1,1,2,4,15')
+
+    drop_partial_row(run_path)
+    checkpoint = read_checkpoint(tmp_path / 'checkpoint.json')
+    assert (checkpoint['block'], checkpoint['trial']) == (1, NB_TRIALS)
+    assert resume_cursor(run_path, checkpoint, 1, 1, NB_TRIALS) == (1, 0)
+    end = committed_trajectory_end(run_path, checkpoint, 1, 1)
+    assert end == NB_TRIALS * SAMPLES
+    truncate_trajectories(bin_path, end)
+    assert bin_path.stat().st_size == end * TRAJECTORY_DTYPE.itemsize
+
+    # The resumed run appends right after the committed trials
+    with TrajectoryWriter(bin_path) as trajectories:
+        assert trajectories.offset == end
+    records = read_trajectories(bin_path)
+    assert (records['right'][-SAMPLES:, 0] == NB_TRIALS).all()
+
+
+def test_drop_partial_row(tmp_path):
+    run_path = tmp_path / 'runs.csv'
+    run_path.write_bytes(b'a,b\n1,2\n3,')
+    assert drop_partial_row(run_path) == 2
+    assert run_path.read_bytes() == b'a,b\n1,2\n'
+    assert drop_partial_row(run_path) == 0
+    assert drop_partial_row(tmp_path / 'missing.csv') == 0
+
+
+def write_rows(run_path, rows):
+    lines = [','.join(FIELDS)] + [','.join(str(v) for v in row) for row in rows]
+    run_path.write_text('\n'.join(lines) + '\n')
+
+
+def test_resume_cursor(tmp_path):
+    run_path = tmp_path / 'runs.csv'
+    assert resume_cursor(run_path, None, 1, 1, NB_TRIALS) == (0, 0)
+    assert resume_cursor(run_path, {'block': 2, 'trial': 3}, 1, 1, NB_TRIALS) == (1, 3)
+    # Rows of the run win over the checkpoint, rows of other runs are ignored
+    write_rows(run_path, [(1, 1, 1, 5, 0, 10), (1, 1, 2, 2, 10, 10), (1, 2, 1, 1, 0, 10)])
+    assert resume_cursor(run_path, {'block': 1, 'trial': 1}, 1, 1, NB_TRIALS) == (1, 2)
+    assert resume_cursor(run_path, None, 1, 2, NB_TRIALS) == (0, 1)
+    write_rows(run_path, [(1, 1, 1, 4, 0, 10), (1, 1, 1, 5, 10, 10)])
+    assert resume_cursor(run_path, None, 1, 1, NB_TRIALS) == (1, 0)
+
+
+def test_committed_trajectory_end(tmp_path):
+    run_path = tmp_path / 'runs.csv'
+    write_rows(run_path, [(1, 1, 1, 1, 0, 10), (1, 1, 1, 2, 10, 7), (1, 1, 1, 3, 'NA', 'NA')])
+    assert committed_trajectory_end(run_path, {'traj_end': 3}, 1, 1, chunk=8) == 17
+    assert committed_trajectory_end(run_path, {'traj_end': 3}, 1, 2) == 3
+    assert committed_trajectory_end(tmp_path / 'missing.csv', None, 1, 1) == 0
+
+
+def test_checkpoint_commit(tmp_path):
+    checkpoint = Checkpoint(tmp_path / 'checkpoint.json', {'ID': 7}, traj_end=4)
+    checkpoint.commit([{'Block': '1', 'Trial': '2', 'traj_offset': '4', 'traj_length': '6'},
+                       {'Block': '1', 'Trial': '3', 'traj_offset': 'NA', 'traj_length': 'NA'}])
+    state = read_checkpoint(tmp_path / 'checkpoint.json')
+    assert (state['ID'], state['block'], state['trial'], state['traj_end']) == (7, 1, 3, 10)
+    assert read_checkpoint(tmp_path / 'none.json') is None
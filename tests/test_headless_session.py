@@ -0,0 +1,67 @@
+import csv
+
+from headless_session import run_headless
+from trajectory_store import read_trajectories, trajectory_path
+
+NB_TRIALS = 7 # 30% of the trials, i.e. 2, are movement trials
+PARAMS = {'ID': 999, 'Session': 1, 'Run': 1, 'NbBlocks': 2, 'NbTrials': NB_TRIALS, 'Set': 'Standard'}
+
+
+def read_rows(run_path):
+    with open(run_path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def check_run(rows, data_path):
+    assert [(r['Block'], r['Trial']) for r in rows] == [(str(b), str(t)) for b in (1, 2) for t in range(1, NB_TRIALS + 1)]
+    records = read_trajectories(trajectory_path(data_path / 'Subject_999', 999, 1, 1))
+    end = windows = 0
+    for row in rows:
+        if row['traj_offset'] == 'NA':
+            continue
+        offset, length = int(row['traj_offset']), int(row['traj_length'])
+        assert offset == end # Trajectories follow each other in the file, with no gap
+        end = offset + length
+        if row['WindowStart_ns'] == 'NA': # No-go trial, no response window
+            assert length == 0
+            continue
+        t_ns = records['t_ns'][offset:end]
+        window_start = int(row['WindowStart_ns'])
+        assert length and window_start <= t_ns[0] and t_ns[-1] <= window_start + 2_000_000_000
+        windows += 1
+    assert windows
+    assert end == len(records)
+
+
+def test_run_headless(tmp_path):
+    summary = run_headless(PARAMS, tmp_path, seed=1)
+    assert summary['result'] == 0
+    assert summary['written'] == 2 * NB_TRIALS and summary['flushes'] == 2
+    rows = read_rows(summary['run_path'])
+    check_run(rows, tmp_path)
+
+    # Same seed, same trials: the virtual clock makes runs reproducible
+    again = run_headless(PARAMS, tmp_path / 'again', seed=1)
+    columns = ('Block', 'Trial', 'RT_press', 'RT_start_right', 'RT_start_left', 'traj_length')
+    assert [[r[c] for c in columns] for r in read_rows(again['run_path'])] == [[r[c] for c in columns] for r in rows]
+
+
+def test_resume_headless(tmp_path):
+    summary = run_headless(PARAMS, tmp_path, seed=2)
+    run_path = summary['run_path']
+    rows = read_rows(run_path)
+    # Crash after the commit of block 1, in the middle of the first trial of block 2
+    with open(run_path) as f:
+        lines = f.readlines()
+    with open(run_path, 'w') as f:
+        f.writelines(lines[:1 + NB_TRIALS])
+        f.write(lines[1 + NB_TRIALS][:20])
+    path = trajectory_path(tmp_path / 'Subject_999', 999, 1, 1)
+    with open(path, 'ab') as f:
+        f.write(b'\x00' * 7)
+
+    resumed = run_headless(PARAMS, tmp_path, seed=2, resume=True)
+    assert resumed['result'] == 0 and resumed['written'] == NB_TRIALS
+    resumed_rows = read_rows(run_path)
+    assert resumed_rows[:NB_TRIALS] == rows[:NB_TRIALS]
+    check_run(resumed_rows, tmp_path)
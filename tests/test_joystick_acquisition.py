@@ -0,0 +1,103 @@
+import threading
+import time
+
+import numpy as np
+import pytest
+
+from joystick_acquisition import JoystickAcquisition, JoystickRingBuffer, TrajectoryBuffer
+
+
+def fill(buffer, start, stop):
+    for i in range(start, stop):
+        buffer.push(i, i, -i, 2 * i, -2 * i)
+
+
+def assert_samples(result, indices):
+    times, right, left = result
+    indices = np.asarray(indices)
+    assert times.tolist() == indices.tolist()
+    assert (right == np.column_stack((indices, -indices))).all()
+    assert (left == np.column_stack((2 * indices, -2 * indices))).all()
+
+
+def test_capacity_must_be_power_of_two():
+    with pytest.raises(ValueError):
+        JoystickRingBuffer(12)
+
+
+def test_read_across_the_wrap():
+    buffer = JoystickRingBuffer(8)
+    fill(buffer, 0, 13)
+    assert_samples(buffer.read(6, 13), range(6, 13))
+    assert_samples(buffer.read(10), range(10, 13))
+    assert buffer.overruns == 0
+    assert buffer.latest()[0] == 12
+
+
+def test_overwritten_samples_are_skipped():
+    buffer = JoystickRingBuffer(8)
+    fill(buffer, 0, 20)
+    # 12 may be in the slot the writer fills next, it is dropped as well
+    assert_samples(buffer.read(3, 20), range(13, 20))
+    assert buffer.overruns == 10
+
+
+def test_lapped_while_copying():
+    buffer = JoystickRingBuffer(8)
+    fill(buffer, 0, 10)
+    stop = buffer.write_count
+    fill(buffer, 10, 13) # The writer went on after the reader took its stop, and is filling slot 13
+    # Slots of samples 2 to 5 were reused by 10 to 13, only 6 to 9 are still valid
+    assert_samples(buffer.read(2, stop), range(6, 10))
+    assert buffer.overruns == 4
+
+
+@pytest.mark.parametrize('capacity, start, n', [(8, 0, 5), (8, 6, 5), (8, 3, 8), (8, 0, 20), (16, 13, 16)])
+def test_extend_matches_push(capacity, start, n):
+    pushed, extended = JoystickRingBuffer(capacity), JoystickRingBuffer(capacity)
+    fill(pushed, 0, start + n)
+    fill(extended, 0, start)
+    i = np.arange(start, start + n)
+    extended.extend(i, np.column_stack((i, -i)), np.column_stack((2 * i, -2 * i)))
+    assert extended.write_count == pushed.write_count
+    assert_samples(extended.read(0), pushed.read(0)[0])
+
+
+class SteppedStick:
+    """Stick whose y moves every `hold` reads, like a device only updated by the event pump."""
+
+    def __init__(self, hold):
+        self.hold = hold
+        self.reads = 0
+        self.x = 0.0
+
+    @property
+    def y(self):
+        self.reads += 1
+        return float(self.reads // self.hold)
+
+
+def test_changes_only_keeps_new_states():
+    stick = SteppedStick(hold=5)
+    with JoystickAcquisition(stick, SteppedStick(hold=10**9), rate=2000, changes_only=True) as acquisition:
+        time.sleep(0.1)
+        acquisition.refresh()
+        cursor = acquisition.cursor()
+        deadline = time.monotonic() + 1
+        while acquisition.cursor() == cursor and time.monotonic() < deadline:
+            time.sleep(0.001)
+    times, right, _ = acquisition.buffer.read(0)
+    assert (np.diff(times) > 0).all()
+    assert (np.diff(right[:cursor, 1]) != 0).all() # No repeated state
+    assert acquisition.stats()['polls'] > acquisition.stats()['samples'] > 0
+    assert acquisition.cursor() > cursor # refresh() pushed the current state, moved or not
+
+
+def test_trajectory_buffer_grows():
+    buffer = TrajectoryBuffer(0.001, max_rate=1000)
+    for i in range(5):
+        buffer.append(i, i, 0, 0, -i)
+    times, right, left = buffer.views()
+    assert times.tolist() == list(range(5))
+    assert right[:, 0].tolist() == list(range(5))
+    assert left[:, 1].tolist() == [-i for i in range(5)]
@@ -0,0 +1,58 @@
+import csv
+import threading
+
+import pytest
+
+from run_log import AsyncTrialWriter, RunLogWriter
+
+
+def test_rows_reach_the_disk_only_on_flush(tmp_path):
+    path = tmp_path / 'runs.csv'
+    flushed = []
+    run_log = RunLogWriter(path, on_flush=flushed.append)
+    run_log.write({'Block': 1, 'Trial': 1})
+    run_log.write({'Block': 1, 'Trial': 2})
+    assert path.read_text() == ''
+    run_log.flush()
+    assert [row['Trial'] for row in flushed[0]] == [1, 2]
+    with pytest.raises(ValueError):
+        run_log.write({'Trial': 3})
+    run_log.close()
+
+    # Reopened, the header is kept and the rows appended
+    with RunLogWriter(path, flush_interval=0) as run_log:
+        run_log.write({'Block': 2, 'Trial': 1})
+        assert run_log.flushes == 1
+    with open(path, newline='') as f:
+        assert [(r['Block'], r['Trial']) for r in csv.DictReader(f)] == [('1', '1'), ('1', '2'), ('2', '1')]
+
+
+class FailingLog:
+    flushes = 0
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def write(self, row):
+        self.release.wait()
+        raise OSError('disk full')
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_dead_worker_does_not_block(tmp_path):
+    log = FailingLog()
+    writer = AsyncTrialWriter(log, maxsize=1, put_timeout=0.01)
+    writer.submit({'Trial': 1}) # Taken by the worker, which fails once released
+    writer.submit({'Trial': 2}) # Fills the queue
+    log.release.set()
+    with pytest.raises(RuntimeError) as error:
+        for trial in range(3, 10):
+            writer.submit({'Trial': trial})
+    assert isinstance(error.value.__cause__, OSError)
+    with pytest.raises(RuntimeError):
+        writer.close()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+
+from trajectory_codec import CompressedTrajectories, compress_file, compressed_path, encode, restore_file
+from trajectory_store import MISSING_NS, TRAJECTORY_DTYPE, TrajectoryWriter, open_trajectories
+
+
+def make_records(n, seed=0):
+    """Joystick-like records: 1 kHz times with jitter, positions on the 16-bit grid with a few raw floats."""
+    rng = np.random.default_rng(seed)
+    records = np.empty(n, dtype=TRAJECTORY_DTYPE)
+    records['t_ns'] = 5_000_000_000 + np.cumsum(rng.integers(900_000, 1_100_000, n))
+    records['right'] = np.round(np.cumsum(rng.normal(0, 0.01, (n, 2)), axis=0).clip(-1, 1) * 32767) / 32767
+    records['left'] = rng.uniform(-1, 1, (n, 2))
+    return records
+
+
+def assert_same_bytes(a, b):
+    assert np.asarray(a).tobytes() == np.asarray(b).tobytes()
+
+
+@pytest.mark.parametrize('n, block_size', [(0, 16), (1, 16), (1000, 4096), (1000, 64), (129, 64)])
+def test_round_trip(tmp_path, n, block_size):
+    records = make_records(n)
+    path = tmp_path / 'run.trjz'
+    path.write_bytes(encode(records, block_size))
+    archive = CompressedTrajectories(path)
+    assert len(archive) == n
+    assert_same_bytes(archive.decode(), records)
+    if n > 100:
+        assert_same_bytes(archive[37:100], records[37:100])
+        assert_same_bytes(archive[-1], records[-1])
+
+
+def test_round_trip_special_values(tmp_path):
+    records = make_records(300)
+    records['t_ns'][[0, 17, 299]] = MISSING_NS
+    records['t_ns'][100:120] = MISSING_NS
+    records['right'][5] = (-0.0, np.nan)
+    records['right'][6] = (np.inf, -np.inf)
+    records['left'][7] = (np.float32(np.nan).view(np.int32) | 1).view(np.float32), -0.0 # NaN with a payload
+    records['left'][8] = (np.finfo(np.float32).tiny / 2, -1.0)
+    path = tmp_path / 'run.trjz'
+    path.write_bytes(encode(records, 64))
+    assert_same_bytes(CompressedTrajectories(path).decode(), records)
+
+
+def test_compress_and_restore(tmp_path):
+    records = make_records(500)
+    path = tmp_path / 'S_1_PMBR_ses1_run1_trajectories.bin'
+    with TrajectoryWriter(path) as writer:
+        writer.write(records['t_ns'], records['right'], records['left'])
+    compress_file(path)
+    assert_same_bytes(open_trajectories(path), records)
+    path.unlink()
+    assert_same_bytes(open_trajectories(path)[:], records)
+
+    # An archived run cannot be written to until it is restored
+    with pytest.raises(ValueError, match='restore'):
+        TrajectoryWriter(path)
+    assert not path.exists()
+    restore_file(path)
+    assert not compressed_path(path).exists()
+    assert_same_bytes(open_trajectories(path), records)
+    with TrajectoryWriter(path) as writer:
+        assert writer.offset == len(records)
+
+
+def test_open_refuses_diverging_files(tmp_path):
+    records = make_records(50)
+    path = tmp_path / 'S_1_PMBR_ses1_run1_trajectories.bin'
+    compressed_path(path).write_bytes(encode(records))
+    path.write_bytes(records[:10].tobytes()) # A run started again after its file was removed
+    with pytest.raises(ValueError, match='archive'):
+        open_trajectories(path)
+    with pytest.raises(RuntimeError):
+        restore_file(path)
@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+from trajectory_store import (MISSING_NS, TRAJECTORY_DTYPE, TrajectoryWriter, countdown, elapsed,
+                              read_trajectories, truncate_trajectories)
+
+
+def trial(n, first):
+    times = np.arange(first, first + n, dtype=np.int64) * 1_000_000
+    right = np.column_stack((np.linspace(0, 1, n), -np.linspace(0, 1, n))).astype(np.float32)
+    return times, right, -right
+
+
+def test_write_returns_record_ranges(tmp_path):
+    path = tmp_path / 'run_trajectories.bin'
+    with TrajectoryWriter(path) as writer:
+        assert writer.write(*trial(10, 0)) == (0, 10)
+        assert writer.write(*trial(0, 0)) == (10, 0)
+        assert writer.write(*trial(5, 100)) == (10, 5)
+    records = read_trajectories(path)
+    assert len(records) == 15
+    assert records['t_ns'][10] == 100_000_000
+    assert (records['left'] == -records['right']).all()
+
+    # Reopening appends after the records already there
+    with TrajectoryWriter(path) as writer:
+        assert writer.write(*trial(3, 0)) == (15, 3)
+
+
+def test_partial_record_is_refused_until_truncated(tmp_path):
+    path = tmp_path / 'run_trajectories.bin'
+    with TrajectoryWriter(path) as writer:
+        writer.write(*trial(10, 0))
+        writer.write(*trial(4, 10))
+    with open(path, 'ab') as f: # A write cut by a crash
+        f.write(b'\x01' * (TRAJECTORY_DTYPE.itemsize // 2))
+    with pytest.raises(ValueError, match='partial record'):
+        TrajectoryWriter(path)
+
+    # Resuming cuts the file back to the committed records, the next trial continues from there
+    dropped = truncate_trajectories(path, 10)
+    assert dropped == 4 * TRAJECTORY_DTYPE.itemsize + TRAJECTORY_DTYPE.itemsize // 2
+    with TrajectoryWriter(path) as writer:
+        assert writer.offset == 10
+        assert writer.write(*trial(2, 50)) == (10, 2)
+    assert read_trajectories(path)['t_ns'][-2:].tolist() == [50_000_000, 51_000_000]
+
+
+def test_truncate_refuses_missing_records(tmp_path):
+    path = tmp_path / 'run_trajectories.bin'
+    assert truncate_trajectories(path, 5) == 0 # No file yet
+    with TrajectoryWriter(path) as writer:
+        writer.write(*trial(3, 0))
+    assert truncate_trajectories(path, 3) == 0
+    with pytest.raises(ValueError):
+        truncate_trajectories(path, 4)
+
+
+def test_elapsed_and_countdown():
+    records = np.zeros(3, dtype=TRAJECTORY_DTYPE)
+    records['t_ns'] = (5_000_000_000, 5_500_000_000, MISSING_NS)
+    t = elapsed(records, 5_000_000_000)
+    assert t[:2].tolist() == [0.0, 0.5] and np.isnan(t[2])
+    assert countdown(records, 5_000_000_000, duration=2.0)[:2].tolist() == [2.0, 1.5]
@@ -0,0 +1,356 @@
+'''Lossless compressed archive (.trjz) of the trajectory files.
+Usage:
+    python trajectory_codec.py Data/Subject_12 12 [--remove | --restore]
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import argparse
+import os
+import struct
+import sys
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from convert_runs import parse_list_column
+from trajectory_store import TRAJECTORY_DTYPE, read_trajectories, trajectory_path
+
+
+MAGIC = b'TRJZ'
+VERSION = 2
+FILE_HEADER = struct.Struct('<4sBIQI')     # magic, version, block size, records, blocks
+BLOCK_HEADER = struct.Struct('<I')         # records in the block
+# mode, value type, count type, runs, value exceptions, sample exceptions, heads
+COLUMN_HEADER = struct.Struct('<BBBIIIqq')
+
+# Column modes
+RAW, GRID_U16, GRID_S16 = range(3)
+VALUE_TYPES = (np.int8, np.int16, np.int32, np.int64)
+COUNT_TYPES = (np.uint8, np.uint16, np.uint32)
+
+COLUMNS = (('t_ns', None), ('right', 0), ('right', 1), ('left', 0), ('left', 1))
+
+
+def compressed_path(path):
+    return Path(path).with_suffix('.trjz')
+
+
+# ---------------------------------------------------------------------------
+# Integer series: delta, run-length and packing
+
+
+def _smallest(types, low, high):
+    for dtype in types:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return dtype
+    return types[-1]
+
+
+def _encode_series(s, order):
+    """(heads, values, counts) of series s: its first `order` terms and the runs of its order-th differences."""
+    heads = [int(s[0]) if len(s) else 0, int(np.diff(s[:2])[0]) if order == 2 and len(s) > 1 else 0]
+    d = np.diff(s, n=order) if len(s) > order else np.zeros(0, dtype=np.int64)
+    if not len(d):
+        return heads, d, np.zeros(0, dtype=np.int64)
+    starts = np.concatenate(([0], np.flatnonzero(d[1:] != d[:-1]) + 1))
+    return heads, d[starts], np.diff(np.append(starts, len(d)))
+
+
+def _decode_series(n, order, heads, values, counts):
+    s = np.empty(n, dtype=np.int64)
+    if not n:
+        return s
+    d = np.repeat(values, counts)
+    if order == 2 and n > 1:
+        d = np.cumsum(np.concatenate(([heads[1]], d)), dtype=np.int64)
+    s[0] = heads[0]
+    s[1:] = heads[0] + np.cumsum(d[:n - 1], dtype=np.int64)
+    return s
+
+
+def _pack_values(values):
+    """Narrowest integer type minimizing the size, the values that do not fit are exceptions."""
+    best = None
+    for code, dtype in enumerate(VALUE_TYPES):
+        info = np.iinfo(dtype)
+        outside = np.flatnonzero((values < info.min) | (values > info.max))
+        size = len(values) * np.dtype(dtype).itemsize + len(outside) * 12
+        if best is None or size < best[0]:
+            best = (size, code, outside)
+    _, code, outside = best
+    packed = values.astype(VALUE_TYPES[code])
+    packed[outside] = 0
+    return code, packed, outside.astype('<u4'), values[outside].astype('<i8')
+
+
+# ---------------------------------------------------------------------------
+# Column models
+
+
+def _grid_model(values, mode):
+    """
+    Grid indices of float32 positions and the mask of the ones the grid reproduces exactly,
+    compared bit for bit (-0.0 decodes to +0.0, NaN to a grid value: both are exceptions).
+    """
+    v = values.astype(np.float64)
+    k = np.rint((v + 1) * 65535 / 2) if mode == GRID_U16 else np.rint(v * 32767)
+    k = np.where(np.isfinite(k), k, 0).astype(np.int64)
+    exact = _grid_values(k, mode).view(np.int32) == values.view(np.int32)
+    return k, exact
+
+
+def _grid_values(k, mode):
+    if mode == GRID_U16:
+        return (k * 2 / 65535 - 1).astype(np.float32)
+    return (k / 32767).astype(np.float32)
+
+
+def _fill_inexact(s, exact):
+    """Previous exact term in place of each inexact one, so the deltas stay small."""
+    if exact.all() or not exact.any():
+        return s
+    index = np.where(exact, np.arange(len(s)), 0)
+    np.maximum.accumulate(index, out=index)
+    return s[index]
+
+
+def _encode_column(values, is_time):
+    raw_type = np.int64 if is_time else np.int32
+    bits = values.view(raw_type).astype(np.int64)
+    candidates = [(RAW, bits, np.ones(len(values), dtype=bool))]
+    if not is_time: # Times are integer ns already, delta of delta codes them as they are
+        for mode in (GRID_U16, GRID_S16):
+            k, exact = _grid_model(values, mode)
+            candidates.append((mode, k, exact))
+    best = None
+    for mode, s, exact in candidates:
+        order = 2 if is_time else 1
+        s = _fill_inexact(s, exact)
+        heads, run_values, counts = _encode_series(s, order)
+        value_code, packed, outside, outside_values = _pack_values(run_values)
+        count_code = COUNT_TYPES.index(_smallest(COUNT_TYPES, 0, int(counts.max()) if len(counts) else 0))
+        inexact = np.flatnonzero(~exact).astype('<u4')
+        blob = b''.join((
+            COLUMN_HEADER.pack(mode, value_code, count_code, len(run_values), len(outside), len(inexact),
+                               heads[0], heads[1]),
+            packed.astype(packed.dtype.newbyteorder('<')).tobytes(),
+            counts.astype(np.dtype(COUNT_TYPES[count_code]).newbyteorder('<')).tobytes(),
+            outside.tobytes(), outside_values.tobytes(),
+            inexact.tobytes(), bits[inexact].astype(np.dtype(raw_type).newbyteorder('<')).tobytes()))
+        if best is None or len(blob) < len(best):
+            best = blob
+    return best
+
+
+def _decode_column(buffer, offset, n, is_time):
+    mode, value_code, count_code, n_runs, n_outside, n_inexact, head0, head1 = \
+        COLUMN_HEADER.unpack_from(buffer, offset)
+    offset += COLUMN_HEADER.size
+
+    def take(dtype, count):
+        nonlocal offset
+        dtype = np.dtype(dtype).newbyteorder('<')
+        array = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset)
+        offset += count * dtype.itemsize
+        return array
+
+    values = take(VALUE_TYPES[value_code], n_runs).astype(np.int64)
+    counts = take(COUNT_TYPES[count_code], n_runs)
+    outside = take('u4', n_outside)
+    values[outside] = take('i8', n_outside)
+    raw_type = np.int64 if is_time else np.int32
+    inexact, inexact_bits = take('u4', n_inexact), take(raw_type, n_inexact)
+
+    s = _decode_series(n, 2 if is_time else 1, (head0, head1), values, counts)
+    if mode == RAW:
+        column = s if is_time else s.astype(raw_type).view(np.float32)
+    else:
+        column = _grid_values(s, mode)
+    column[inexact] = inexact_bits.view(column.dtype)
+    return column, offset
+
+
+# ---------------------------------------------------------------------------
+# Blocks and files
+
+
+def encode_block(records):
+    """Bytes of a block of TRAJECTORY_DTYPE records."""
+    parts = [BLOCK_HEADER.pack(len(records))]
+    for field, axis in COLUMNS:
+        column = np.ascontiguousarray(records[field] if axis is None else records[field][:, axis])
+        parts.append(_encode_column(column, axis is None))
+    return b''.join(parts)
+
+
+def decode_block(buffer, offset=0):
+    """Records of the block starting at `offset` in `buffer`."""
+    (n,) = BLOCK_HEADER.unpack_from(buffer, offset)
+    offset += BLOCK_HEADER.size
+    records = np.empty(n, dtype=TRAJECTORY_DTYPE)
+    for field, axis in COLUMNS:
+        column, offset = _decode_column(buffer, offset, n, axis is None)
+        if axis is None:
+            records[field] = column
+        else:
+            records[field][:, axis] = column
+    return records
+
+
+def encode(records, block_size=4096):
+    """Archive bytes of a record array."""
+    blocks = [encode_block(records[i:i + block_size]) for i in range(0, len(records), block_size)]
+    header = FILE_HEADER.pack(MAGIC, VERSION, block_size, len(records), len(blocks))
+    starts = np.cumsum([0] + [len(b) for b in blocks]).astype('<u8')
+    return header + starts.tobytes() + b''.join(blocks)
+
+
+class CompressedTrajectories:
+    """
+    A .trjz archive, sliced like the memory map of the trajectory file:
+    archive[offset:offset + length] decodes only the blocks it covers.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._buffer = self.path.read_bytes()
+        magic, version, self.block_size, self.n, n_blocks = FILE_HEADER.unpack_from(self._buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{self.path} is not a version {VERSION} trajectory archive')
+        self._starts = np.frombuffer(self._buffer, dtype='<u8', count=n_blocks + 1, offset=FILE_HEADER.size)
+        self._data = FILE_HEADER.size + self._starts.nbytes
+        self._block = lru_cache(maxsize=4)(self._decode_block)
+
+    def _decode_block(self, i):
+        return decode_block(self._buffer, self._data + int(self._starts[i]))
+
+    def __len__(self):
+        return self.n
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            return self[key:key + 1][0] if key >= 0 else self[self.n + key]
+        start, stop, step = key.indices(self.n)
+        if start >= stop:
+            return np.empty(0, dtype=TRAJECTORY_DTYPE)
+        first, last = start // self.block_size, (stop - 1) // self.block_size
+        records = np.concatenate([self._block(i) for i in range(first, last + 1)])
+        return records[start - first * self.block_size:stop - first * self.block_size:step]
+
+    def decode(self):
+        return self[:]
+
+
+def compress_file(path, block_size=4096):
+    """Writes the archive of a trajectory file next to it and checks that it decodes to the same bytes."""
+    records = read_trajectories(path)
+    target = compressed_path(path)
+    tmp = target.with_name(target.name + '.tmp')
+    tmp.write_bytes(encode(np.asarray(records), block_size))
+    if CompressedTrajectories(tmp).decode().tobytes() != np.asarray(records).tobytes():
+        tmp.unlink()
+        raise RuntimeError(f'{path}: the archive does not decode to the original records')
+    os.replace(tmp, target)
+    return target
+
+
+def restore_file(path):
+    """Writes the trajectory file back from its archive and deletes the archive, so the run can be resumed."""
+    path = Path(path)
+    source = compressed_path(path)
+    records = CompressedTrajectories(source).decode()
+    if path.exists() and path.read_bytes() != records.tobytes():
+        raise RuntimeError(f'{path} differs from its archive {source.name}, resolve it by hand')
+    tmp = path.with_name(path.name + '.tmp')
+    with open(tmp, 'wb') as f:
+        f.write(records.tobytes())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    source.unlink()
+    return path
+
+
+# ---------------------------------------------------------------------------
+# Comparison with the other encodings
+
+
+def _repr_cells(records, lengths):
+    """Trials as the legacy runs CSV stored them (repr of Python lists)."""
+    cells, start = [], 0
+    for length in lengths:
+        trial = records[start:start + length]
+        start += length
+        cells.append((repr((trial['t_ns'] * 1e-9).tolist()), repr(trial['right'].tolist()), repr(trial['left'].tolist())))
+    return cells
+
+
+def compare(path, lengths):
+    """Size in bytes and decode time in seconds of one run as repr strings, float64, the .bin and the archive."""
+    records = np.asarray(read_trajectories(path))
+    cells = _repr_cells(records, lengths)
+    archive = encode(records)
+    float64 = np.column_stack([records['t_ns'], records['right'], records['left']]).astype(np.float64).tobytes()
+    results = {}
+
+    # Parsed with the vectorized parser of convert_runs, literal_eval is an order of magnitude slower
+    t0 = time.perf_counter()
+    for column, width in zip(zip(*cells), (1, 2, 2)):
+        parse_list_column(column, width)
+    results['repr'] = (sum(len(c) for cell in cells for c in cell), time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    np.frombuffer(float64, dtype=np.float64).reshape(-1, 5).copy()
+    results['float64'] = (len(float64), time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    np.frombuffer(records.tobytes(), dtype=TRAJECTORY_DTYPE).copy()
+    results['bin'] = (records.nbytes, time.perf_counter() - t0)
+
+    buffer = Path(path).with_suffix('.trjz.bench')
+    buffer.write_bytes(archive)
+    try:
+        t0 = time.perf_counter()
+        CompressedTrajectories(buffer).decode()
+        results['trjz'] = (len(archive), time.perf_counter() - t0)
+    finally:
+        buffer.unlink()
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('subject_path')
+    parser.add_argument('subject_id')
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('--remove', action='store_true', help='delete each .bin once its archive is verified')
+    action.add_argument('--restore', action='store_true', help='write each .bin back from its archive, to resume a run')
+    parser.add_argument('--no-compare', action='store_true', help='skip the comparison with repr strings and float64')
+    args = parser.parse_args(argv)
+
+    import pandas as pd
+    runs = pd.read_csv(Path(args.subject_path) / f'S_{args.subject_id}_PMBR_runs.csv')
+    for (session, run), trials in runs.groupby(['Session', 'Run']):
+        path = trajectory_path(args.subject_path, args.subject_id, session, run)
+        if args.restore:
+            if compressed_path(path).exists():
+                print(f'{restore_file(path).name}: restored from {compressed_path(path).name}')
+            continue
+        if not path.exists():
+            continue
+        target = compress_file(path)
+        print(f'{path.name}: {os.path.getsize(path)} -> {os.path.getsize(target)} bytes')
+        if not args.no_compare:
+            lengths = pd.to_numeric(trials['traj_length'], errors='coerce').dropna().astype(int)
+            for name, (size, seconds) in compare(path, lengths).items():
+                print(f'  {name:<8}{size:>12} bytes {seconds * 1000:10.2f} ms to decode')
+        if args.remove:
+            path.unlink()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,156 @@
+'''Binary trajectory sidecar for the PMBR runs files, one fixed-size record per joystick sample.
+The runs CSV keeps the record range of each trial (traj_offset, traj_length).
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import csv
+import os
+from pathlib import Path
+
+import numpy as np
+
+
+# One record per joystick sample: session ns, right (x, y), left (x, y)
+TRAJECTORY_DTYPE = np.dtype([('t_ns', '<i8'), ('right', '<f4', (2,)), ('left', '<f4', (2,))])
+
+# t_ns of samples with no time, in runs converted from files without a time column
+MISSING_NS = np.iinfo(np.int64).min
+
+
+def trajectory_path(subject_path, subject_id, session, run):
+    return Path(subject_path) / f'S_{subject_id}_PMBR_ses{session}_run{run}_trajectories.bin'
+
+
+class TrajectoryWriter:
+    """
+    Appends trial trajectories to a trajectory file.
+    write() returns the (offset, length) record range to store in the runs CSV.
+    A file ending with a partial record (a write cut by a crash) is refused,
+    resuming the run truncates it (see truncate_trajectories). So is a run
+    whose trajectories were archived (.trjz): the archive must be restored
+    first, or the new records would start a second file at offset 0.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        if self.path.with_suffix('.trjz').exists():
+            raise ValueError(f'{self.path.with_suffix(".trjz")} exists, restore it before writing to the run '
+                             f'(python trajectory_codec.py SUBJECT_PATH ID --restore)')
+        self._file = open(self.path, 'ab')
+        size = self._file.tell()
+        if size % TRAJECTORY_DTYPE.itemsize:
+            self._file.close()
+            raise ValueError(f'{self.path} ends with a partial record, resume the run (--resume) to truncate it')
+        self.offset = size // TRAJECTORY_DTYPE.itemsize
+
+    def write(self, times, right_positions, left_positions):
+        n = len(times)
+        records = np.empty(n, dtype=TRAJECTORY_DTYPE)
+        if n:
+            records['t_ns'] = times
+            records['right'] = right_positions
+            records['left'] = left_positions
+            self._file.write(records.tobytes())
+        offset = self.offset
+        self.offset += n
+        return offset, n
+
+    def flush(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def truncate_trajectories(path, n):
+    """Cuts a trajectory file after its first `n` records, returns the number of bytes dropped."""
+    path = Path(path)
+    if not path.exists():
+        return 0
+    end = n * TRAJECTORY_DTYPE.itemsize
+    with open(path, 'rb+') as f:
+        size = f.seek(0, os.SEEK_END)
+        if size < end:
+            raise ValueError(f'{path} has {size // TRAJECTORY_DTYPE.itemsize} records, the runs file points to {n}')
+        if size > end:
+            f.truncate(end)
+            os.fsync(f.fileno())
+    return size - end
+
+
+def read_trajectories(path):
+    """Memory-maps a trajectory file as a structured array with TRAJECTORY_DTYPE fields."""
+    if os.path.getsize(path) == 0:
+        return np.empty(0, dtype=TRAJECTORY_DTYPE)
+    return np.memmap(path, dtype=TRAJECTORY_DTYPE, mode='r')
+
+
+def elapsed(records, window_start_ns=0):
+    """Seconds since the response window opened, NaN for samples without a time."""
+    t_ns = records['t_ns']
+    return np.where(t_ns == MISSING_NS, np.nan, (t_ns - np.int64(window_start_ns)) * 1e-9)
+
+
+def countdown(records, window_start_ns=0, duration=2.0):
+    """CountdownTimer values of the samples (the legacy `time` column): remaining seconds of the window."""
+    return duration - elapsed(records, window_start_ns)
+
+
+def open_trajectories(path):
+    """
+    Memory map of a trajectory file, or its compressed archive when only that is left (see trajectory_codec.py).
+    A file kept next to its archive must hold the same records, anything else was written after archiving.
+    """
+    path = Path(path)
+    archive = path.with_suffix('.trjz')
+    if not archive.exists():
+        return read_trajectories(path)
+    from trajectory_codec import CompressedTrajectories
+    compressed = CompressedTrajectories(archive)
+    if not path.exists():
+        return compressed
+    records = read_trajectories(path)
+    if len(records) != len(compressed):
+        raise ValueError(f'{path} has {len(records)} records and its archive {archive.name} {len(compressed)}, '
+                         f'one of them was written after the other')
+    return records
+
+
+def load_subject_trials(subject_path, subject_id):
+    """
+    Maps every trial of a subject's runs CSV to its trajectory records and window start.
+    Returns a dict keyed by (Session, Run, Block, Trial) of (records, WindowStart_ns);
+    records are views on the memory map (decoded arrays for compressed runs).
+    Converted legacy runs have no WindowStart_ns, their t_ns count from the window start (0).
+    Trials without a press ('NA') are left out.
+    """
+    subject_path = Path(subject_path)
+    run_path = subject_path / f'S_{subject_id}_PMBR_runs.csv'
+    maps = {}
+    trials = {}
+    with open(run_path, newline='') as f:
+        for row in csv.DictReader(f):
+            if row['traj_offset'] in ('', 'NA'):
+                continue
+            key = (row['Session'], row['Run'])
+            if key not in maps:
+                maps[key] = open_trajectories(trajectory_path(subject_path, subject_id, *key))
+            offset, length = int(row['traj_offset']), int(row['traj_length'])
+            window_start = row.get('WindowStart_ns', 'NA')
+            trials[(int(row['Session']), int(row['Run']), int(row['Block']), int(row['Trial']))] = \
+                (maps[key][offset:offset + length], 0 if window_start in ('', 'NA') else int(window_start))
+    return trials
+
+
+def load_subject_trajectories(subject_path, subject_id):
+    """Trajectory records of every trial of a subject, keyed as in load_subject_trials."""
+    return {key: records for key, (records, _) in load_subject_trials(subject_path, subject_id).items()}
@@ -0,0 +1,162 @@
+'''Columnar store of the trials of every Data/Subject_* runs file, updated incrementally.
+Usage:
+    python trial_store.py Data
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import csv
+import io
+import json
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+
+
+INDEX_COLUMNS = ('ID', 'Session', 'Run', 'Block', 'Trial')
+VALUE_COLUMNS = ('TrialStart', 'RT_press', 'RT_start_right', 'RT_start_left', 'RT_end_right', 'RT_end_left')
+POINTER_COLUMNS = ('traj_offset', 'traj_length')
+COLUMNS = INDEX_COLUMNS + VALUE_COLUMNS + POINTER_COLUMNS + ('source',)
+
+csv.field_size_limit(sys.maxsize)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except ValueError: # 'NA' and empty cells
+        return np.nan
+
+
+def _to_int(value, default=-1):
+    try:
+        return int(value)
+    except ValueError:
+        return default
+
+
+class TrialStore:
+    """
+    Columnar store of the scalar trial columns of a whole cohort.
+    Index columns are int32, RT columns float64 with NaN for 'NA'/empty cells,
+    traj_offset/traj_length are -1 for legacy files and trials without a trajectory.
+    `source` is the position of the runs file in the manifest.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.manifest = {'files': []}
+        self.columns = {name: np.empty(0, dtype=self._dtype(name)) for name in COLUMNS}
+        if (self.path / 'manifest.json').exists():
+            with open(self.path / 'manifest.json') as f:
+                self.manifest = json.load(f)
+            self.columns = {name: np.load(self.path / f'{name}.npy', mmap_mode='r') for name in COLUMNS}
+
+    @staticmethod
+    def _dtype(name):
+        return np.float64 if name in VALUE_COLUMNS else np.int32
+
+    def __len__(self):
+        return len(self.columns['ID'])
+
+    def _parse(self, header, lines, source):
+        """Parses CSV lines (without header) into a dict of column arrays."""
+        col = {name: i for i, name in enumerate(header)}
+        rows = list(csv.reader(io.StringIO(lines)))
+        out = {}
+        for name in INDEX_COLUMNS:
+            out[name] = np.fromiter((_to_int(r[col[name]]) for r in rows), dtype=np.int32, count=len(rows))
+        for name in VALUE_COLUMNS:
+            out[name] = np.fromiter((_to_float(r[col[name]]) for r in rows), dtype=np.float64, count=len(rows))
+        for name in POINTER_COLUMNS:
+            if name in col:
+                out[name] = np.fromiter((_to_int(r[col[name]]) for r in rows), dtype=np.int32, count=len(rows))
+            else:
+                out[name] = np.full(len(rows), -1, dtype=np.int32)
+        out['source'] = np.full(len(rows), source, dtype=np.int32)
+        return out
+
+    def _ingest(self, run_path, entry, source):
+        """
+        Reads the part of `run_path` that is not in the store yet.
+        Returns (new columns, updated manifest entry, True if previous rows of this file must be dropped).
+        """
+        stat = run_path.stat()
+        reset = entry is None or stat.st_size < entry['consumed']
+        with open(run_path, 'rb') as f:
+            first = f.readline()
+            header = next(csv.reader([first.decode()]))
+            if not reset and header != entry['header']:
+                reset = True
+            start = len(first) if reset else entry['consumed']
+            f.seek(start)
+            data = f.read()
+        # Only complete lines, a row being written right now is picked up next time
+        end = data.rfind(b'\n') + 1
+        new = self._parse(header, data[:end].decode(), source)
+        entry = {'path': str(run_path), 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size,
+                 'consumed': start + end, 'header': header,
+                 'rows': (0 if reset else entry['rows']) + len(new['ID'])}
+        return new, entry, reset
+
+    def update(self, data_path='Data'):
+        """Ingests new and grown runs files under `data_path`. Returns the number of rows added."""
+        entries = {e['path']: (i, e) for i, e in enumerate(self.manifest['files'])}
+        files = list(self.manifest['files'])
+        keep = np.ones(len(self), dtype=bool)
+        pieces = []
+        for run_path in sorted(Path(data_path).glob('Subject_*/S_*_PMBR_runs.csv')):
+            source, entry = entries.get(str(run_path), (len(files), None))
+            stat = run_path.stat()
+            if entry is not None and entry['mtime_ns'] == stat.st_mtime_ns and entry['size'] == stat.st_size:
+                continue
+            new, entry, reset = self._ingest(run_path, entry, source)
+            if source == len(files):
+                files.append(entry)
+            else:
+                files[source] = entry
+            if reset:
+                keep &= np.asarray(self.columns['source']) != source
+            pieces.append(new)
+        if not pieces:
+            return 0
+
+        columns = {name: np.concatenate([np.asarray(self.columns[name])[keep]] + [p[name] for p in pieces])
+                   for name in COLUMNS}
+        order = np.lexsort([columns[name] for name in reversed(INDEX_COLUMNS)])
+        columns = {name: values[order] for name, values in columns.items()}
+        self._save(columns, {'files': files})
+        return sum(len(p['ID']) for p in pieces)
+
+    def _save(self, columns, manifest):
+        # Write everything next to the live files, then swap them in; the manifest goes last
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.columns = {}
+        for name, values in columns.items():
+            tmp = self.path / f'{name}.tmp.npy'
+            np.save(tmp, values)
+            os.replace(tmp, self.path / f'{name}.npy')
+        tmp = self.path / 'manifest.tmp.json'
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f, indent=1)
+        os.replace(tmp, self.path / 'manifest.json')
+        self.manifest = manifest
+        self.columns = {name: np.load(self.path / f'{name}.npy', mmap_mode='r') for name in COLUMNS}
+
+    def subject(self, subject_id):
+        """Columns restricted to one subject, as views (rows are sorted by ID)."""
+        ids = self.columns['ID']
+        lo, hi = np.searchsorted(ids, subject_id, 'left'), np.searchsorted(ids, subject_id, 'right')
+        return {name: values[lo:hi] for name, values in self.columns.items()}
+
+    def to_dataframe(self):
+        """The whole store as a pandas DataFrame indexed by (ID, Session, Run, Block, Trial)."""
+        import pandas as pd
+        return pd.DataFrame({name: np.asarray(values) for name, values in self.columns.items()}).set_index(list(INDEX_COLUMNS))
+
+
+if __name__ == '__main__':
+    data = sys.argv[1] if len(sys.argv) > 1 else 'Data'
+    store = TrialStore(Path(data) / 'trial_store')
+    print(f'Added {store.update(data)} rows, {len(store)} trials in store')
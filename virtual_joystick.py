@@ -0,0 +1,209 @@
+'''Virtual joysticks replaying recorded streams, with the pyglet and psychopy joystick interfaces,
+to run the task without the sticks.
+Paul de Fontenay, UPHUMMEL EPFL, 2025
+'''
+
+import time
+
+import numpy as np
+
+
+class ReplayTrack:
+    """
+    A recorded stream: `times` in seconds from the start of the track
+    (non-decreasing) and `axes`, one row of axis values per time.
+    `buttons` optionally holds the button states at the same times.
+    """
+
+    def __init__(self, times, axes, buttons=None):
+        self.times = np.asarray(times, dtype=np.float64)
+        self.axes = np.asarray(axes, dtype=np.float64)
+        self.axes = self.axes.reshape(len(self.times), self.axes.shape[-1] if self.axes.ndim > 1 else 1)
+        self.buttons = None if buttons is None else np.asarray(buttons, dtype=bool).reshape(len(self.times), -1)
+        if len(self.times) and np.any(np.diff(self.times) < 0):
+            raise ValueError('track times must be non-decreasing')
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def duration(self):
+        return float(self.times[-1]) if len(self.times) else 0.0
+
+    def state_at(self, t):
+        """Row index of the sample in effect at track time t, -1 before the first sample."""
+        return int(np.searchsorted(self.times, t, side='right')) - 1
+
+
+def concatenate(tracks, gap=0.0):
+    """Plays tracks one after the other, with `gap` seconds between them during which the last sample is held."""
+    tracks = [t for t in tracks if len(t)]
+    if not tracks:
+        return ReplayTrack([], np.zeros((0, 2)))
+    times, axes, offset = [], [], 0.0
+    for track in tracks:
+        times.append(track.times - track.times[0] + offset)
+        axes.append(track.axes)
+        offset = times[-1][-1] + gap
+    return ReplayTrack(np.concatenate(times), np.concatenate(axes))
+
+
+def load_probe_csv(path):
+    """
+    (t_ns, x, y) of a CSV written by one of the probe scripts: the first time-like
+    column (Timestamp, Time, *_ns or ISO dates) and the two axis columns.
+    """
+    import pandas as pd
+    frame = pd.read_csv(path)
+    time_column = next(c for c in frame.columns if c.lower().startswith(('time', 'timestamp')))
+    x_column, y_column = [c for c in frame.columns if c != time_column][:2]
+    t = frame[time_column]
+    if time_column.endswith('_ns'):
+        t_ns = t.to_numpy(np.int64)
+    elif pd.api.types.is_numeric_dtype(t):
+        t_ns = np.round(t.to_numpy(np.float64) * 1e9).astype(np.int64)
+    else:
+        t_ns = pd.to_datetime(t).to_numpy('datetime64[ns]').astype(np.int64)
+    return t_ns - t_ns[0], frame[x_column].to_numpy(np.float64), frame[y_column].to_numpy(np.float64)
+
+
+def track_from_csv(path):
+    """Track of one stick recorded by a probe script (pglet_joysticj.py, joystick_thread.py, ...)."""
+    t_ns, x, y = load_probe_csv(path)
+    return ReplayTrack(t_ns * 1e-9, np.column_stack((x, y)))
+
+
+def tracks_from_trajectory(trajectory, window_start_ns=0, rate=60.0):
+    """
+    (right, left) tracks of one stored trial (TRAJECTORY_DTYPE records).
+    Time runs from the opening of the response window, t_ns - window_start_ns;
+    trials converted without a time column are spaced at `rate`.
+    """
+    from trajectory_store import elapsed
+    t = elapsed(trajectory, window_start_ns)
+    missing = np.isnan(t)
+    t[missing] = np.flatnonzero(missing) / rate
+    t = np.maximum.accumulate(t) if len(t) else t # Countdown reads can repeat, never go back in time
+    return ReplayTrack(t, trajectory['right']), ReplayTrack(t, trajectory['left'])
+
+
+def tracks_from_subject(subject_path, subject_id, gap=1.0, rate=60.0):
+    """(right, left) tracks replaying every stored trial of a subject in order, `gap` seconds apart."""
+    from trajectory_store import load_subject_trials
+    trials = load_subject_trials(subject_path, subject_id)
+    pairs = [tracks_from_trajectory(*trials[k], rate=rate) for k in sorted(trials)]
+    return concatenate([p[0] for p in pairs], gap), concatenate([p[1] for p in pairs], gap)
+
+
+class VirtualJoystick:
+    """
+    Joystick whose state is the sample of `track` in effect at the current replay time.
+
+    Replay time is (clock() - start time) * speed, `clock` returning seconds
+    (time.perf_counter by default, a virtual clock for accelerated runs).
+    Before start() and before the first sample the stick is at rest; after
+    the last sample it holds the last value, or starts over if `loop` is set.
+    press() injects a button press, since the recordings have no buttons.
+    """
+
+    def __init__(self, track, speed=1.0, loop=False, clock=time.perf_counter, n_buttons=12, name='Virtual joystick'):
+        self.track = track
+        self.speed = speed
+        self.loop = loop
+        self.clock = clock
+        self.name = name
+        self.n_buttons = n_buttons
+        self._start = None
+        self._pressed = {} # button -> (from, until) replay times it is held down
+
+    # Replay control
+    def start(self):
+        """Starts (or restarts) the replay from the beginning of the track, pending presses are dropped."""
+        self._start = self.clock()
+        self._pressed.clear()
+
+    def replay_time(self):
+        if self._start is None:
+            return -np.inf
+        t = (self.clock() - self._start) * self.speed
+        if self.loop and self.track.duration > 0:
+            t %= self.track.duration
+        return t
+
+    def axes_at(self, t):
+        """
+        Axis values at clock time(s) t (as returned by `clock`), one row per time,
+        for samplers that backfill past instants.
+        """
+        track, start = self.track, self._start
+        t = np.asarray(t, dtype=np.float64)
+        if start is None or not len(track):
+            return np.zeros(t.shape + (track.axes.shape[1],))
+        replay = (t - start) * self.speed
+        if self.loop and track.duration > 0:
+            replay %= track.duration
+        i = np.searchsorted(track.times, replay, side='right') - 1
+        return np.where((i >= 0)[..., None], track.axes[np.maximum(i, 0)], 0.0)
+
+    @property
+    def finished(self):
+        return not self.loop and self.replay_time() > self.track.duration
+
+    def press(self, button=0, hold=0.1, delay=0.0):
+        """Holds `button` down for `hold` seconds of replay time, starting `delay` seconds from now."""
+        start = max(self.replay_time(), 0.0) + delay
+        self._pressed[button] = (start, start + hold)
+
+    def _state(self):
+        """(track, row) read together, so a track swapped from another thread is never indexed with a stale row."""
+        track = self.track
+        return track, track.state_at(self.replay_time())
+
+    # psychopy.hardware.joystick surface
+    def getAllAxes(self):
+        track, i = self._state()
+        return [0.0] * track.axes.shape[1] if i < 0 else track.axes[i].tolist()
+
+    def getAxis(self, axis):
+        track, i = self._state()
+        return 0.0 if i < 0 or axis >= track.axes.shape[1] else float(track.axes[i, axis])
+
+    def getX(self):
+        return self.getAxis(0)
+
+    def getY(self):
+        return self.getAxis(1)
+
+    def getNumAxes(self):
+        return self.track.axes.shape[1]
+
+    def getButton(self, button):
+        t = self.replay_time()
+        held_from, held_until = self._pressed.get(button, (np.inf, -np.inf))
+        if held_from <= t <= held_until:
+            return True
+        track = self.track
+        i = track.state_at(t)
+        buttons = track.buttons
+        return bool(buttons is not None and i >= 0 and button < buttons.shape[1] and buttons[i, button])
+
+    def getAllButtons(self):
+        return [self.getButton(b) for b in range(self.n_buttons)]
+
+    def getNumButtons(self):
+        return self.n_buttons
+
+    def getName(self):
+        return self.name
+
+    # pyglet.input.Joystick surface
+    x = property(getX)
+    y = property(getY)
+    buttons = property(getAllButtons)
+
+    def open(self, window=None, exclusive=False):
+        if self._start is None:
+            self.start()
+
+    def close(self):
+        pass